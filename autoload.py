@@ -0,0 +1,106 @@
+
+import os
+import io
+import contextlib
+
+from cfg import nil, Symbol
+from datatypes import List, String
+from parsing import parse_lines
+import modulecache
+
+
+# Indexes built so far, by the modules they start from, along with the
+# mtimes of the files they were built from
+indexes = {}
+
+
+def module_path(directory, module):
+    """The absolute path that load finds a module at."""
+    if not module.endswith(".tl"):
+        module += ".tl"
+    return os.path.abspath(os.path.join(directory, module))
+
+
+def read_module(abspath, use_cache):
+    """Return a module's mtime and its top-level expressions.
+
+Messages from parsing are left for when the module is actually loaded.
+Raise OSError if the module can't be read, or SyntaxError if it can't
+be parsed.
+"""
+    with open(abspath) as f:
+        code = f.read()
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+    expressions = None
+    if use_cache:
+        expressions = modulecache.read(abspath, mtime, code)
+    if expressions is None:
+        with contextlib.redirect_stderr(io.StringIO()):
+            expressions = list(parse_lines(io.StringIO(code)))
+        if use_cache:
+            modulecache.write(abspath, mtime, code)
+    return mtime, expressions
+
+
+def scan_modules(abspaths, use_cache):
+    """Find the global names that loading some modules would define.
+
+Return a dictionary mapping each name to the absolute path of the
+module that defines it, and a dictionary mapping the path of each
+module that would be loaded to its mtime. Modules are followed through
+their top-level load calls in the order that loading them would run
+those calls; if two modules define the same name, the first one wins,
+just as the second would fail to redefine it.
+"""
+    names = {}
+    mtimes = {}
+    def_symbol = Symbol("def")
+    load_symbol = Symbol("load")
+
+    def scan(abspath):
+        mtimes[abspath], expressions = read_module(abspath, use_cache)
+        directory = os.path.dirname(abspath)
+        for expr in expressions:
+            if not isinstance(expr, List) or expr is nil:
+                continue
+            elif (expr.head is def_symbol and expr.length == 3
+                    and isinstance(expr[1], Symbol)):
+                # (def name value)
+                names.setdefault(expr[1], abspath)
+            elif (expr.head is load_symbol and expr.length == 2
+                    and isinstance(expr[1], (Symbol, String))):
+                # (load module), relative to this module's directory
+                submodule = module_path(directory, str(expr[1]))
+                if submodule not in mtimes:
+                    scan(submodule)
+
+    for abspath in abspaths:
+        if abspath not in mtimes:
+            scan(abspath)
+    return names, mtimes
+
+
+def build_index(abspaths, use_cache=True):
+    """Index the names that loading some modules would define.
+
+Return the dictionary of names from scan_modules, and a list of the
+module files it came from. Return None if any of the modules can't be
+read or parsed; they should then be loaded right away, so that the
+errors show up as usual.
+"""
+    key = tuple(abspaths)
+    entry = indexes.get(key)
+    if entry is not None:
+        names, mtimes = entry
+        try:
+            if all(os.stat(path).st_mtime_ns == mtime
+                   for path, mtime in mtimes.items()):
+                return names.copy(), list(mtimes)
+        except OSError:
+            pass
+    try:
+        names, mtimes = scan_modules(abspaths, use_cache)
+    except (OSError, SyntaxError, RecursionError):
+        return None
+    indexes[key] = names, mtimes
+    return names.copy(), list(mtimes)
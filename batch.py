@@ -0,0 +1,339 @@
+
+import os
+import sys
+import gc
+import time
+import signal
+import select
+import argparse
+import tempfile
+import traceback
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import cfg
+import output
+import run
+
+
+# Exit status of a job that ran out of time, as from the timeout command
+TIMEOUT_STATUS = 124
+
+
+class Job:
+    """One program in a batch, and what happened when it ran."""
+
+    def __init__(self, number, filename):
+        self.number = number
+        self.filename = filename
+        self.stdout = ""
+        self.stderr = ""
+        # As for subprocess: the exit status, or minus the number of the
+        # signal that killed the process
+        self.returncode = None
+        self.timed_out = False
+        self.elapsed = 0.0
+        # For a job run in a forked child: the child's pid, when it
+        # started, when it runs out of time, and the temporary files its
+        # output goes to
+        self.pid = None
+        self.start_time = None
+        self.deadline = None
+        self.stdout_file = None
+        self.stderr_file = None
+
+    @property
+    def status(self):
+        """The job's exit status, with TIMEOUT_STATUS for a timeout."""
+        if self.timed_out:
+            return TIMEOUT_STATUS
+        return self.returncode
+
+    def problem(self):
+        """Describe what went wrong with the job, or return None."""
+        if self.timed_out:
+            return f"timed out after {self.elapsed:.1f} s"
+        elif self.returncode is not None and self.returncode < 0:
+            return f"killed by signal {-self.returncode}"
+        elif self.returncode:
+            return f"exited with status {self.returncode}"
+        return None
+
+
+def read_manifest(path):
+    """Return the program file names listed in a manifest.
+
+A manifest has one file name per line; blank lines and lines starting
+with ; are ignored. A path of - reads the manifest from stdin.
+"""
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path) as f:
+            lines = f.read().splitlines()
+    return [line.strip() for line in lines
+            if line.strip() and not line.lstrip().startswith(";")]
+
+
+def warm_program(options):
+    """Create the Program that every job starts from a copy of.
+
+The whole library is loaded up front, since every job would otherwise
+load the parts it uses for itself.
+"""
+    warm_options = argparse.Namespace(**vars(options))
+    warm_options.no_autoload = True
+    return run.new_program(is_repl=False, options=warm_options)
+
+
+def run_batch(filenames, options):
+    """Run many programs, each as if on its own, and report the results.
+
+Return the exit status for the whole batch: 0 if every program ran to
+completion, or 1 if not.
+"""
+    jobs = [Job(number, filename)
+            for number, filename in enumerate(filenames, 1)]
+    workers = getattr(options, "jobs", None) or os.cpu_count() or 1
+    timeout = getattr(options, "timeout", None)
+    reporter = Reporter(jobs, getattr(options, "output_dir", None))
+    start_time = time.monotonic()
+    if hasattr(os, "fork"):
+        program = warm_program(options)
+        run_forked(program, jobs, workers, timeout, options,
+                   reporter.finish)
+    else:
+        run_spawned(jobs, workers, timeout, options, reporter.finish)
+    return reporter.summarize(time.monotonic() - start_time)
+
+
+def run_forked(program, jobs, workers, timeout, options, finish):
+    """Run each job in a child process forked from the warm Program.
+
+Each child gets its own copy of the Program, so nothing one job does
+can affect another. Up to workers children run at a time.
+"""
+    # Keep the garbage collector from touching the warm Program's
+    # objects, which would copy the memory they are in to every child
+    gc.collect()
+    gc.freeze()
+    pending = iter(jobs)
+    # Jobs that are running, by the read end of a pipe whose write end
+    # only the child has; it becomes readable when the child exits
+    running = {}
+    try:
+        while True:
+            while len(running) < workers:
+                job = next(pending, None)
+                if job is None:
+                    break
+                sentinel = start_child(program, job, options)
+                running[sentinel] = job
+                job.deadline = (None if timeout is None
+                                else job.start_time + timeout)
+            if not running:
+                break
+            deadlines = [job.deadline for job in running.values()
+                         if job.deadline is not None]
+            wait = (max(min(deadlines) - time.monotonic(), 0)
+                    if deadlines else None)
+            finished, _, _ = select.select(list(running), [], [], wait)
+            for sentinel in finished:
+                job = running.pop(sentinel)
+                os.close(sentinel)
+                _, wait_status = os.waitpid(job.pid, 0)
+                job.elapsed = time.monotonic() - job.start_time
+                job.returncode = returncode(wait_status)
+                collect_output(job)
+                finish(job)
+            now = time.monotonic()
+            for job in running.values():
+                if (job.deadline is not None and job.deadline <= now
+                        and not job.timed_out):
+                    job.timed_out = True
+                    os.kill(job.pid, signal.SIGKILL)
+    finally:
+        # If the batch is interrupted, don't leave children running
+        for sentinel, job in running.items():
+            try:
+                os.kill(job.pid, signal.SIGKILL)
+                os.waitpid(job.pid, 0)
+            except OSError:
+                pass
+            os.close(sentinel)
+        gc.unfreeze()
+
+
+def start_child(program, job, options):
+    """Fork a child to run a job; return the job's sentinel."""
+    job.stdout_file = tempfile.TemporaryFile()
+    job.stderr_file = tempfile.TemporaryFile()
+    sentinel, child_end = os.pipe()
+    # Anything still buffered, such as the report of the last job to
+    # finish, would otherwise be copied into the child and written out
+    # again as part of its output
+    output.stdout.flush()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    job.start_time = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        # In the child
+        os.close(sentinel)
+        status = 1
+        try:
+            # Jobs don't share stdin with each other or with the batch
+            null_fd = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(null_fd, 0)
+            os.dup2(job.stdout_file.fileno(), 1)
+            os.dup2(job.stderr_file.fileno(), 2)
+            # Output now goes to a file, not the terminal
+            output.stdout.configure()
+            if run.run_file(job.filename, environment=program,
+                            options=options):
+                status = 0
+            output.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            try:
+                traceback.print_exc()
+                sys.stderr.flush()
+            except BaseException:
+                pass
+        os._exit(status)
+    os.close(child_end)
+    job.pid = pid
+    return sentinel
+
+
+def returncode(wait_status):
+    """Convert a status from os.waitpid to a subprocess-style code."""
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+def collect_output(job):
+    """Read what a job wrote from its temporary files."""
+    for stream in ("stdout", "stderr"):
+        file = getattr(job, stream + "_file")
+        file.seek(0)
+        text = file.read().decode("utf-8", "replace")
+        file.close()
+        setattr(job, stream, text)
+
+
+def run_spawned(jobs, workers, timeout, options, finish):
+    """Run each job in a new interpreter process.
+
+This is for platforms without fork; each process loads the library for
+itself.
+"""
+    command = [sys.executable,
+               os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "tinylisp2.py"),
+               *program_args(options)]
+
+    def run_job(job):
+        start_time = time.monotonic()
+        try:
+            result = subprocess.run(command + [job.filename],
+                                    capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired as err:
+            job.timed_out = True
+            stdout, stderr = err.stdout, err.stderr
+        else:
+            job.returncode = result.returncode
+            stdout, stderr = result.stdout, result.stderr
+        job.elapsed = time.monotonic() - start_time
+        job.stdout = (stdout or b"").decode("utf-8", "replace")
+        job.stderr = (stderr or b"").decode("utf-8", "replace")
+        return job
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Results come back in order, which is the order they are
+        # reported in anyway
+        for job in executor.map(run_job, jobs):
+            finish(job)
+
+
+def program_args(options):
+    """The command-line args that give a single run the same options."""
+    args = ["--engine", getattr(options, "engine", "tree")]
+    if getattr(options, "no_library", False):
+        # These can't be given together, but --builtins-only means both
+        if getattr(options, "no_short_names", False):
+            args.append("--builtins-only")
+        else:
+            args.append("--no-library")
+    elif getattr(options, "no_short_names", False):
+        args.append("--no-short-names")
+    for flag in ("no_native_library", "no_module_cache", "no_autoload",
+                 "stats"):
+        if getattr(options, flag, False):
+            args.append("--" + flag.replace("_", "-"))
+    for option in ("image", "max_stack", "output_buffer", "flush"):
+        value = getattr(options, option, None)
+        if value is not None:
+            args += ["--" + option.replace("_", "-"), str(value)]
+    return args
+
+
+class Reporter:
+    """Report the results of a batch's jobs in order as they finish.
+
+Without an output directory, each program's output is written to stdout
+and its errors to stderr, after a header with its file name. With one,
+they go in files named after the program, ending in .out and .err.
+"""
+
+    def __init__(self, jobs, output_dir=None):
+        self.jobs = jobs
+        self.output_dir = output_dir
+        self.finished = set()
+        self.next_index = 0
+        self.used_names = set()
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def finish(self, job):
+        self.finished.add(job.number)
+        # Report every job up to the first one that is still running
+        while (self.next_index < len(self.jobs)
+               and self.jobs[self.next_index].number in self.finished):
+            self.report(self.jobs[self.next_index])
+            self.next_index += 1
+
+    def report(self, job):
+        if self.output_dir is not None:
+            name = os.path.splitext(os.path.basename(job.filename))[0]
+            if name in self.used_names:
+                name = f"{name}-{job.number}"
+            self.used_names.add(name)
+            path = os.path.join(self.output_dir, name)
+            with open(path + ".out", "w") as f:
+                f.write(job.stdout)
+            with open(path + ".err", "w") as f:
+                f.write(job.stderr)
+        else:
+            header = f"==> {job.filename} <==\n"
+            output.stdout.write(header + job.stdout)
+            if job.stderr:
+                output.stdout.flush()
+                sys.stderr.write(header + job.stderr)
+        problem = job.problem()
+        if problem is not None:
+            cfg.error(job.filename, problem)
+        # Don't keep the output of jobs that have been reported
+        job.stdout = job.stderr = ""
+
+    def summarize(self, elapsed):
+        """Report totals for the batch; return its exit status."""
+        timed_out = sum(job.timed_out for job in self.jobs)
+        failed = sum(job.status != 0 for job in self.jobs) - timed_out
+        ok = len(self.jobs) - failed - timed_out
+        output.stdout.flush()
+        print(f"Ran {len(self.jobs)} programs in {elapsed:.2f} s: {ok} ok, "
+              f"{failed} failed, {timed_out} timed out",
+              file=sys.stderr)
+        return 0 if ok == len(self.jobs) else 1
@@ -0,0 +1,117 @@
+
+from cfg import UNLIMITED
+
+
+# Decorators for member functions that implement builtins
+
+def macro(pyfunc):
+    """Mark this builtin as a macro."""
+    pyfunc.is_macro = True
+    pyfunc.name = pyfunc.__name__
+    if not hasattr(pyfunc, "is_quiet"):
+        pyfunc.is_quiet = False
+    if not hasattr(pyfunc, "top_level_only"):
+        pyfunc.top_level_only = False
+    if not hasattr(pyfunc, "repl_only"):
+        pyfunc.repl_only = False
+    return pyfunc
+
+
+def function(pyfunc):
+    """Mark this builtin as a function."""
+    pyfunc.is_macro = False
+    pyfunc.name = pyfunc.__name__
+    if not hasattr(pyfunc, "is_quiet"):
+        pyfunc.is_quiet = False
+    if not hasattr(pyfunc, "top_level_only"):
+        pyfunc.top_level_only = False
+    if not hasattr(pyfunc, "repl_only"):
+        pyfunc.repl_only = False
+    return pyfunc
+
+
+def quiet(pyfunc):
+    """This builtin's return value is only displayed in REPL mode."""
+    pyfunc.is_quiet = True
+    return pyfunc
+
+
+def top_level_only(pyfunc):
+    """This builtin cannot be called inside a function, only at top level."""
+    pyfunc.top_level_only = True
+    return pyfunc
+
+
+def repl_only(pyfunc):
+    """This builtin can only be called at top level in the REPL."""
+    pyfunc.repl_only = True
+    pyfunc.top_level_only = True
+    return pyfunc
+
+
+def params(min_param_count, max_param_count=None):
+    """Specify the min and max number of params this builtin takes."""
+    def params_decorator(pyfunc):
+        if max_param_count is not None:
+            pyfunc.min_param_count = min_param_count
+            pyfunc.max_param_count = max_param_count
+        elif min_param_count == UNLIMITED:
+            # This indicates a variadic builtin, so the actual minimum
+            # is zero, not infinity
+            pyfunc.min_param_count = 0
+            pyfunc.max_param_count = min_param_count
+        else:
+            pyfunc.min_param_count = min_param_count
+            pyfunc.max_param_count = min_param_count
+        return pyfunc
+    return params_decorator
+
+
+def two_args(fast_pyfunc):
+    """Give this builtin a faster implementation for calls with two args.
+
+The fast implementation takes exactly two args and must behave the same
+as the general one; typically it handles the common case directly and
+defers to the general implementation for everything else.
+"""
+    def two_args_decorator(pyfunc):
+        pyfunc.fast_two_args = fast_pyfunc
+        return pyfunc
+    return two_args_decorator
+
+
+class Builtin:
+    """A builtin function or macro, as a tinylisp value.
+
+Wraps the member function that implements the builtin together with the
+attributes its decorators gave it, so that the evaluators can recognize
+a builtin with a single type check and read its arity and flags without
+going through the bound method. Call the builtin through call, or
+through call2 for exactly two args.
+"""
+    __slots__ = ("call", "call2", "name", "tl_name", "is_macro", "is_quiet",
+                 "top_level_only", "repl_only", "min_param_count",
+                 "max_param_count")
+
+    def __init__(self, method, tl_name):
+        self.call = method
+        fast_pyfunc = getattr(method, "fast_two_args", None)
+        if fast_pyfunc is not None:
+            self.call2 = fast_pyfunc.__get__(method.__self__)
+        else:
+            self.call2 = method
+        self.name = method.name
+        self.tl_name = tl_name
+        self.is_macro = method.is_macro
+        self.is_quiet = method.is_quiet
+        self.top_level_only = method.top_level_only
+        self.repl_only = method.repl_only
+        self.min_param_count = method.min_param_count
+        self.max_param_count = method.max_param_count
+
+    def __call__(self, *args):
+        return self.call(*args)
+
+    def __repr__(self):
+        builtin_type = "macro" if self.is_macro else "function"
+        return f"<builtin {builtin_type} {self.name}>"
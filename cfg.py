@@ -1,6 +1,10 @@
 
 import sys
 import string
+import weakref
+
+from datatypes import List, String, IntVector, HashMap, HashSet, nil
+import output
 
 
 # Scanning/parsing related constants
@@ -28,12 +32,58 @@ Enter expressions at the prompt.
   errors if it is unbound; if quoted with q, it is kept unevaluated.
 
 The builtin functions and macros are: cons, head, tail, +, -, *, /,
-mod, <, =, same-type?, unparse, write, locals, eval, def, if, q,
-and load. Most of these also have abbreviated names, unless you have
+mod, <, =, same-type?, unparse, parse, write, locals, eval, def, if,
+q, and load. Most of these also have abbreviated names, unless you have
 invoked the interpreter with --no-short-names or --builtins-only:
 cons -> c, head -> h, tail -> t, mod -> %, same-type? -> y,
 unparse -> u, write -> w, eval -> v, def -> d, if -> ?.
 
+Vectors are compact arrays of 64-bit integers. Convert lists of integers
+to vectors with to-vector and back with from-vector, or build one with
+vector-range. vector+, vector-, vector*, vector/, vector-mod, vector<
+and vector= work item by item on two vectors (or a vector and an
+integer); vector-sum, vector-product, vector-length, vector-get and
+vector-slice round out the set. (+ vec) and (* vec) also work.
+
+range, count-up, count-down and repeat return lazy lists, whose items
+are only produced when something looks at them, so (take 10 (range
+1000000000)) is quick. map, filter, take-while and zip are lazy when
+given a lazy list. Lazy lists act just like other lists; (force seq)
+produces all the items of one at once.
+
+(memoize func) returns a version of a function that remembers its
+results for the arguments it has been called with, keeping the 10000
+most recently used ones; (memoize func size) keeps size of them instead.
+memo-stats gives a memoized function's cache statistics, and memo-clear
+empties its cache.
+
+Integer builtins: isqrt, (pow-mod base exponent modulus), gcd, lcm,
+(divmod a b) -> (quotient remainder), bit-and, bit-or, bit-xor, bit-not,
+shift-left, shift-right, int-prime?, (int-to-base base num) and
+(int-from-base base digits). The library's prime?, to-base and
+from-base use them.
+
+(hash-map key value ...) and (hash-set item ...) build hash maps and
+sets, whose keys can be any values (lists are compared by their items).
+to-hash-map and to-hash-set convert a list of (key value) pairs or a
+list of items. hash-get, hash-has?, hash-size, hash-keys, hash-values
+and hash-items look things up in constant time, and hash-insert and
+hash-delete return an updated copy, leaving the original unchanged.
+
+(sort seq) sorts a list of integers or of strings, or the characters of
+a string, keeping equal items in their original order. (sort-by func
+seq) sorts by the result of calling func on each item, and (group-by
+func seq) returns a list of (key items) pairs, one for each different
+result of func, in the order they first appear.
+
+(read-line) reads a line of input as a String, or nil at the end of the
+input; (read-lines) gives a lazy list of the rest of the lines,
+(read-all) the rest of the input as one String, and (read-ints) a lazy
+list of the whitespace-separated integers in it. They read from stdin,
+or from a file if given its name: (read-line "data.txt"). Each file
+stays open, so reads carry on where the last one stopped. (parse str)
+turns the first expression in a String into a value, unevaluated.
+
 The core library defines many more functions and macros. It is loaded
 by default, unless you have invoked the interpreter with --no-library
 or --builtins-only. Some library functions also have abbreviated names.
@@ -53,20 +103,21 @@ Special features in the interactive prompt:
 # Max param count of variadic builtins
 UNLIMITED = float("inf")
 
-# The empty list, nil
-nil = []
-
 
 # Shortcut functions for print without newline and print to stderr
+# Output to stdout is buffered; it is written out before anything goes
+# to stderr, so that the two stay in order on a terminal
 def write(*args):
-    print(*args, end="")
+    print(*args, end="", file=output.stdout)
 
 
 def error(*args):
+    output.stdout.flush()
     print("Error:", *args, file=sys.stderr)
 
 
 def warn(*args):
+    output.stdout.flush()
     print("Warning:", *args, file=sys.stderr)
 
 
@@ -80,21 +131,33 @@ def recursion_error():
 
 def tl_truthy(value):
     """Is the value truthy in tinylisp?"""
-    if value == nil or value == "" or value == 0:
+    if isinstance(value, List):
+        # nil is the only empty List; comparing with it would find the
+        # length of a lazy List
+        return value is not nil
+    elif value == "" or value == 0:
         return False
+    elif isinstance(value, (IntVector, HashMap, HashSet)):
+        return len(value) > 0
     else:
         return True
 
 
 def tl_type(value):
-    if isinstance(value, list):
+    if isinstance(value, List):
         return "List"
     elif isinstance(value, int):
         return "Integer"
-    elif isinstance(value, str):
+    elif isinstance(value, String):
         return "String"
     elif isinstance(value, Symbol):
         return "Symbol"
+    elif isinstance(value, IntVector):
+        return "Vector"
+    elif isinstance(value, HashMap):
+        return "HashMap"
+    elif isinstance(value, HashSet):
+        return "HashSet"
     else:
         return "Builtin"
 
@@ -108,14 +171,31 @@ class UserQuit(BaseException):
 # Class for symbols to distinguish them from strings
 
 class Symbol:
-    def __init__(self, name):
-        self.name = str(name)
-
-    def __eq__(self, rhs):
-        if isinstance(rhs, Symbol):
-            return self.name == rhs.name
-        else:
-            return self.name == rhs
+    """A tinylisp symbol.
+
+Symbols are interned: constructing a Symbol with a name that has been
+seen before returns the existing object. So two Symbols are equal
+exactly when they are the same object, and the default identity-based
+equality and hash (computed in C, no method call or string hashing
+involved) are the right ones. Symbols never compare equal to Strings
+or Python strs.
+
+The table of interned Symbols only holds weak references, so a Symbol
+that nothing uses any more (say, one parsed from input at runtime) can
+be freed; making one with that name later just interns a new object.
+"""
+    __slots__ = ("name", "__weakref__")
+    _table = weakref.WeakValueDictionary()
+
+    def __new__(cls, name):
+        name = str(name)
+        try:
+            return cls._table[name]
+        except KeyError:
+            symbol = super().__new__(cls)
+            symbol.name = name
+            cls._table[name] = symbol
+            return symbol
 
     def __str__(self):
         return self.name
@@ -123,5 +203,6 @@ class Symbol:
     def __repr__(self):
         return f"Symbol({self.name!r})"
 
-    def __hash__(self):
-        return hash(repr(self))
+    def __reduce__(self):
+        # Re-intern when unpickling or copying
+        return (Symbol, (self.name,))
@@ -0,0 +1,632 @@
+
+import sys
+
+from cfg import nil, Symbol
+import cfg
+from datatypes import List, Environment, Memoized, String, memo_key
+from builtin import Builtin
+from execution import Program
+
+
+# Compiled code is cached per expression; when the cache grows past
+# this many entries (e.g. because a program evals lots of generated
+# code), it is cleared and refilled as needed
+CODE_CACHE_SIZE = 100_000
+
+# Global names can only be bound once, by def, except for the REPL's _,
+# which is rebound after every expression. References to any other
+# global name that is already defined, including calls through it, can
+# be compiled for the value the name has at that point.
+REBINDABLE_NAMES = {Symbol("_")}
+
+# Compiled code uses about two and a half times as many Python frames
+# per non-tail tinylisp call as the tree-walking evaluator does, so
+# while it runs, the recursion limit is raised by this factor to
+# support at least the same depth
+RECURSION_LIMIT_FACTOR = 3
+
+# Same for the information about how to call each function value; this
+# is smaller because programs can create lots of short-lived closures
+FUNCTION_CACHE_SIZE = 10_000
+
+
+class TailCall:
+    """A call to a user-defined function, made in tail position.
+
+Compiled code in tail position returns one of these instead of making
+the call itself; the trampoline loop in CompiledProgram.run_calls then
+runs the function body. This keeps tail calls in constant stack space.
+A call to a memoized function also carries the function and the key for
+its result (memo), so that run_calls can store the result.
+"""
+    __slots__ = ("body", "frame", "memo")
+
+    def __init__(self, body, frame, memo=None):
+        self.body = body
+        self.frame = frame
+        self.memo = memo
+
+
+class FunctionInfo:
+    """How to set up frames for calls to a user-defined function.
+
+If the function's environment and parameter list are well formed, all
+of its calls bind the same names, so its frames have a fixed layout:
+the names from the environment in order, then the parameter names. A
+frame for a call is then just the layout and the environment's values
+(the prefix) followed by the argument values, with default values
+filled in for missing arguments. The environment and parameter list are
+checked once, here, instead of on every call.
+
+Functions with repeated names or malformed parameter lists or
+environments have no fixed layout (layout is None); their calls go
+through bind_params, which gives the same messages as in the
+tree-walking evaluator.
+"""
+    __slots__ = ("environment", "param_names", "body", "layout", "prefix",
+                 "params", "defaults", "min_arg_count", "variadic",
+                 "shadowed", "global_count", "body_code", "memoized")
+
+    def __init__(self, function):
+        self.environment, self.param_names, self.body = function
+        # The function itself, if its results are cached
+        self.memoized = function if type(function) is Memoized else None
+        self.layout = None
+        self.prefix = None
+        self.params = ()
+        self.defaults = ()
+        self.min_arg_count = 0
+        self.variadic = isinstance(self.param_names, Symbol)
+        self.shadowed = ()
+        self.global_count = None
+        self.body_code = None
+        if type(self.environment) is Environment:
+            # Built by locals, so the pairs are known to be well formed
+            names = list(self.environment.bindings)
+            values = list(self.environment.bindings.values())
+        else:
+            names = []
+            values = []
+            for pair in self.environment:
+                if not (isinstance(pair, List) and len(pair) == 2
+                        and isinstance(pair.head, Symbol)):
+                    return
+                names.append(pair.head)
+                values.append(pair.tail.head)
+        params = []
+        defaults = []
+        if self.variadic:
+            params.append(self.param_names)
+        elif isinstance(self.param_names, List):
+            for param in self.param_names:
+                if isinstance(param, Symbol):
+                    params.append(param)
+                    defaults.append(None)
+                    self.min_arg_count = len(params)
+                elif (isinstance(param, List) and 1 <= len(param) <= 2
+                      and isinstance(param.head, Symbol)):
+                    # A name + default value pair; an unspecified
+                    # default value is nil
+                    params.append(param.head)
+                    defaults.append(param.tail.head)
+                else:
+                    return
+        else:
+            return
+        layout = (*names, *params)
+        if len(set(layout)) == len(layout):
+            self.layout = layout
+            self.prefix = [layout, *values]
+            self.params = tuple(params)
+            self.defaults = tuple(defaults)
+
+
+class CompiledProgram(Program):
+    """A Program that compiles expressions into Python closures.
+
+Each expression (and each function body) is compiled once into a tree
+of nested closures, with the decisions that the tree-walking evaluate()
+makes on every execution already taken: what kind of node an expression
+is, which frame slot a local name lives in, which builtin or macro a
+global name refers to, and whether a call is in tail position. User
+macros called through global names are expanded once, when their call
+site is first executed. Output, errors, and tail-call behavior match
+the tree-walking evaluator.
+
+Local scopes are frames: Python lists whose first item is the layout
+(the tuple of local names) and whose remaining items are the values of
+those names, in order. A compiled node is a function taking the current
+frame. Nodes in tail position may return a TailCall, which run_calls()
+resolves.
+"""
+
+    def __init__(self, *args, **kwargs):
+        self.code_cache = {}
+        self.function_cache = {}
+        self.frames = [[()]]
+        self.recursion_limit = (RECURSION_LIMIT_FACTOR
+                                * sys.getrecursionlimit())
+        super().__init__(*args, **kwargs)
+
+    def execute(self, code):
+        # Only raise the recursion limit while compiled code is running,
+        # so the rest of the process (including other engines) keeps
+        # its own limit
+        old_limit = sys.getrecursionlimit()
+        if old_limit < self.recursion_limit:
+            sys.setrecursionlimit(self.recursion_limit)
+        try:
+            return super().execute(code)
+        finally:
+            sys.setrecursionlimit(old_limit)
+
+    @property
+    def current_scope(self):
+        """The innermost frame, as a dictionary."""
+        frame = self.frames[-1]
+        return dict(zip(frame[0], frame[1:]))
+
+    def lookup_name(self, name):
+        frame = self.frames[-1]
+        if name in frame[0]:
+            return frame[frame[0].index(name) + 1]
+        else:
+            return super().lookup_name(name)
+
+    def autoload(self, name):
+        # Load the module in a frame of its own
+        self.frames.append([()])
+        try:
+            super().autoload(name)
+        finally:
+            self.frames.pop()
+
+    def evaluate(self, expr, top_level=False):
+        frame = self.frames[-1]
+        code = self.compile(expr, frame[0], True, top_level)
+        # Pass the result straight to run_calls without keeping it here,
+        # so that the frames of finished tail calls (and the values in
+        # them, such as the start of a lazy list being walked) can be
+        # freed
+        return self.run_calls(code(frame))
+
+    def run_calls(self, result):
+        """Run tail calls until a result that is a real value comes out."""
+        frames = self.frames
+        memo_keys = None
+        while type(result) is TailCall:
+            if result.memo is not None:
+                # The result of this tail call is the result of the whole
+                # chain of tail calls
+                if memo_keys is None:
+                    memo_keys = []
+                memo_keys.append(result.memo)
+            frame = result.frame
+            frames.append(frame)
+            try:
+                result = result.body(frame)
+            finally:
+                frames.pop()
+        if memo_keys is not None:
+            # Store the outermost call's result last, so that it's the
+            # last to be evicted
+            for function, key in reversed(memo_keys):
+                function.store(key, result)
+        return result
+
+    def evaluate_in_scope(self, expr, scope):
+        self.frames.append([tuple(scope), *scope.values()])
+        try:
+            return self.evaluate(expr)
+        finally:
+            self.frames.pop()
+
+    def call(self, function, args):
+        # Skip compiling a new call expression for every call
+        if type(function) is Builtin and not function.is_macro:
+            return self.check_and_call_builtin(function, list(args), False)
+        elif isinstance(function, List) and function.length == 3:
+            arg_codes = [constant(arg) for arg in args]
+            return self.run_calls(self.prepare_call(
+                self.function_info(function), arg_codes, self.frames[-1]))
+        else:
+            return super().call(function, args)
+
+    def compile(self, expr, layout, tail, top_level):
+        """Return the cached compiled code for an expression.
+
+The layout is the tuple of local names in the frame the code will run
+with; tail and top_level say whether the expression is in tail position
+and at top level.
+"""
+        key = (id(expr), layout, tail, top_level)
+        try:
+            return self.code_cache[key][1]
+        except KeyError:
+            pass
+        code = self.compile_expression(expr, layout, tail, top_level)
+        if len(self.code_cache) >= CODE_CACHE_SIZE:
+            self.code_cache.clear()
+        # Keep the expression alive alongside its code, so that its id
+        # can't be reused while the cache entry exists
+        self.code_cache[key] = (expr, code)
+        return code
+
+    def function_info(self, function):
+        """Return the cached FunctionInfo for a user-defined function."""
+        try:
+            return self.function_cache[id(function)][1]
+        except KeyError:
+            pass
+        info = FunctionInfo(function)
+        if len(self.function_cache) >= FUNCTION_CACHE_SIZE:
+            self.function_cache.clear()
+        self.function_cache[id(function)] = (function, info)
+        return info
+
+    def compile_expression(self, expr, layout, tail, top_level):
+        if isinstance(expr, List) and expr is not nil:
+            return self.compile_call(expr, layout, tail, top_level)
+        elif isinstance(expr, Symbol):
+            return self.compile_name(expr, layout)
+        elif (expr is nil or isinstance(expr, (int, String))
+                or type(expr) is Builtin):
+            # Nil, integers, strings, and builtins evaluate to themselves
+            return constant(expr)
+        else:
+            def unexpected(frame):
+                # Code should never get here
+                raise TypeError("unexpected type in evaluate():",
+                                type(expr))
+            return unexpected
+
+    def compile_name(self, name, layout):
+        if name in layout:
+            index = layout.index(name) + 1
+
+            def local_name(frame):
+                return frame[index]
+            return local_name
+        elif name in self.autoload_index:
+            return self.compile_when_loaded(
+                name, lambda: self.compile_name(name, layout))
+        elif (name not in REBINDABLE_NAMES
+                and self.global_scope.get(name) is not None):
+            # The name will always have its current value
+            return constant(self.global_scope[name])
+        else:
+            # The name isn't defined yet, or it can be rebound: look it
+            # up again only when the global scope has a new version
+            global_scope = self.global_scope
+            cached_version = None
+            cached_value = None
+
+            def global_name(frame):
+                nonlocal cached_version, cached_value
+                if cached_version != self.global_version:
+                    cached_value = global_scope.get(name)
+                    if cached_value is None:
+                        cached_value = self.global_value(name)
+                        if cached_value is None:
+                            cfg.error(f"{name!r} is not defined")
+                            return nil
+                    cached_version = self.global_version
+                return cached_value
+            return global_name
+
+    def compile_call(self, expr, layout, tail, top_level):
+        head_expr = expr.head
+        if isinstance(head_expr, Symbol):
+            if head_expr not in layout and head_expr in self.autoload_index:
+                return self.compile_when_loaded(
+                    head_expr,
+                    lambda: self.compile_call(expr, layout, tail, top_level))
+            elif (head_expr not in layout
+                    and head_expr not in REBINDABLE_NAMES
+                    and self.global_scope.get(head_expr) is not None):
+                # A global name that will always have its current value
+                head = self.global_scope[head_expr]
+                return self.compile_call_to(head, expr, layout, tail,
+                                            top_level)
+        elif not isinstance(head_expr, List):
+            # The head is a literal, which evaluates to itself
+            return self.compile_call_to(head_expr, expr, layout, tail,
+                                        top_level)
+        return self.compile_dynamic_call(expr, layout, tail, top_level)
+
+    def compile_when_loaded(self, name, compile_code):
+        """Put off compiling code that names an unloaded library name.
+
+The returned node loads the name's module the first time it runs, as
+looking the name up would, and then calls compile_code, so the code is
+compiled with the name's value. Compiling it right away would load the
+module even if the code never runs.
+"""
+        code = None
+
+        def when_loaded(frame):
+            nonlocal code
+            if code is None:
+                self.global_value(name)
+                code = compile_code()
+            return code(frame)
+        return when_loaded
+
+    def compile_call_to(self, head, expr, layout, tail, top_level):
+        """Compile a call whose head value is known in advance."""
+        arg_exprs = expr.tail
+        if type(head) is Builtin:
+            if head is self.if_builtin:
+                return self.compile_if(arg_exprs, layout, tail, top_level)
+            elif head is self.eval_builtin:
+                return self.compile_eval(arg_exprs, layout, tail, top_level)
+            elif head.is_macro:
+                return self.compile_builtin_macro(head, arg_exprs, top_level)
+            else:
+                arg_codes = self.compile_args(arg_exprs, layout)
+                return self.compile_builtin_function(head, arg_codes,
+                                                     top_level)
+        elif self.is_macro(head):
+            return self.compile_macro(head, arg_exprs, layout, tail,
+                                      top_level)
+        elif isinstance(head, List) and head is not nil:
+            if len(head) != 3:
+                def bad_function(frame):
+                    cfg.error("List callable as function must have "
+                              "3 elements, not", len(head))
+                    return nil
+                return bad_function
+            info = self.function_info(head)
+            arg_codes = self.compile_args(arg_exprs, layout)
+            if tail:
+                def function_tail_call(frame):
+                    return self.prepare_call(info, arg_codes, frame)
+                return function_tail_call
+            else:
+                def function_call(frame):
+                    call = self.prepare_call(info, arg_codes, frame)
+                    return self.run_calls(call)
+                return function_call
+        else:
+            def not_a_function(frame):
+                cfg.error(head, "is not a function or macro")
+                return nil
+            return not_a_function
+
+    def compile_dynamic_call(self, expr, layout, tail, top_level):
+        """Compile a call whose head has to be evaluated every time."""
+        head_code = self.compile_expression(expr.head, layout, False, False)
+        arg_codes = self.compile_args(expr.tail, layout)
+
+        def dynamic_call(frame):
+            head = head_code(frame)
+            if ((type(head) is List or type(head) is Memoized)
+                    and head.length == 3):
+                # Most common case: a user-defined function
+                call = self.prepare_call(self.function_info(head),
+                                         arg_codes, frame)
+                if tail:
+                    return call
+                else:
+                    return self.run_calls(call)
+            elif (type(head) is Builtin and not head.is_macro
+                    and head is not self.eval_builtin):
+                return self.call_builtin(head, arg_codes, frame, top_level)
+            else:
+                # Macros, ifs, evals, and errors
+                code = self.compile_call_to(head, expr, layout, tail,
+                                            top_level)
+                return code(frame)
+        return dynamic_call
+
+    def compile_args(self, arg_exprs, layout):
+        return tuple(self.compile_expression(arg, layout, False, False)
+                     for arg in arg_exprs)
+
+    def compile_if(self, arg_exprs, layout, tail, top_level):
+        if len(arg_exprs) != 3:
+            def bad_if(frame):
+                cfg.error("if takes 3 arguments, not", len(arg_exprs))
+                return nil
+            return bad_if
+        cond_expr, true_expr, false_expr = arg_exprs
+        cond_code = self.compile_expression(cond_expr, layout, False, False)
+        true_code = self.compile_expression(true_expr, layout, tail,
+                                            top_level)
+        false_code = self.compile_expression(false_expr, layout, tail,
+                                             top_level)
+        tl_truthy = cfg.tl_truthy
+
+        def if_(frame):
+            if tl_truthy(cond_code(frame)):
+                return true_code(frame)
+            else:
+                return false_code(frame)
+        return if_
+
+    def compile_eval(self, arg_exprs, layout, tail, top_level):
+        if len(arg_exprs) != 1:
+            def bad_eval(frame):
+                cfg.error("eval takes 1 argument, not", len(arg_exprs))
+                return nil
+            return bad_eval
+        arg_code = self.compile_expression(arg_exprs.head, layout,
+                                           False, False)
+
+        def eval_(frame):
+            code = self.compile(arg_code(frame), layout, tail, top_level)
+            return code(frame)
+        return eval_
+
+    def compile_builtin_macro(self, builtin, arg_exprs, top_level):
+        if builtin is self.quote_builtin and len(arg_exprs) == 1:
+            return constant(arg_exprs.head)
+        args = tuple(arg_exprs)
+
+        def builtin_macro(frame):
+            return self.check_and_call_builtin(builtin, args, top_level)
+        return builtin_macro
+
+    def compile_builtin_function(self, builtin, arg_codes, top_level):
+        arg_count = len(arg_codes)
+        if (builtin.top_level_only and not top_level
+                or builtin.repl_only
+                or not (builtin.min_param_count
+                        <= arg_count
+                        <= builtin.max_param_count)):
+            # Let call_builtin take care of the error messages
+            def checked_call(frame):
+                return self.call_builtin(builtin, arg_codes, frame,
+                                         top_level)
+            return checked_call
+        elif arg_count == 1:
+            arg_code, = arg_codes
+            builtin_call = builtin.call
+
+            def call1(frame):
+                return builtin_call(arg_code(frame))
+            return call1
+        elif arg_count == 2:
+            arg_code1, arg_code2 = arg_codes
+            builtin_call2 = builtin.call2
+
+            def call2(frame):
+                return builtin_call2(arg_code1(frame), arg_code2(frame))
+            return call2
+        else:
+            builtin_call = builtin.call
+
+            def call(frame):
+                return builtin_call(*[arg_code(frame)
+                                      for arg_code in arg_codes])
+            return call
+
+    def compile_macro(self, macro, arg_exprs, layout, tail, top_level):
+        """Compile a call to a user-defined macro.
+
+If the arguments can be bound to the macro's parameters without any
+messages, the expansion is computed and compiled the first time the
+call is executed and reused from then on. Otherwise, the macro is
+expanded every time, just as the tree-walking evaluator does it.
+"""
+        if self.macro_bindings(macro.head, arg_exprs) is None:
+            def dynamic_macro(frame):
+                try:
+                    expansion = self.expand_macro(macro, arg_exprs)
+                except TypeError:
+                    return nil
+                code = self.compile(expansion, layout, tail, top_level)
+                return code(frame)
+            return dynamic_macro
+        expansion_code = None
+
+        def expanded_macro(frame):
+            nonlocal expansion_code
+            if expansion_code is None:
+                expansion = self.expand_macro(macro, arg_exprs)
+                expansion_code = self.compile(expansion, layout, tail,
+                                              top_level)
+            return expansion_code(frame)
+        return expanded_macro
+
+    def prepare_call(self, info, arg_codes, frame):
+        """Set up a call to a user-defined function.
+
+Evaluate the arguments and put them in a new frame for the function
+body. Return a TailCall that will run the body, the cached result if
+the function is memoized and has one, or nil if there was an error.
+"""
+        args = [arg_code(frame) for arg_code in arg_codes]
+        memoized = info.memoized
+        if memoized is not None:
+            key = memo_key(args)
+            value = memoized.lookup(key)
+            if value is not None:
+                return value
+        layout = info.layout
+        if layout is not None:
+            if info.global_count != len(self.global_scope):
+                self.find_shadowed_params(info)
+            arg_count = len(args)
+            if info.variadic:
+                args = [List.from_iterable(args)]
+            elif (info.min_arg_count <= arg_count < len(info.params)
+                    and not info.shadowed):
+                # Fill in default values, evaluated in the caller's
+                # scope (with warnings, bind_params gets the order of
+                # the messages right)
+                args.extend([self.evaluate(default)
+                             for default in info.defaults[arg_count:]])
+            elif arg_count != len(info.params):
+                layout = None
+        if layout is not None:
+            for name in info.shadowed:
+                cfg.warn("parameter name shadows global name", name)
+            new_frame = info.prefix + args
+            body_code = info.body_code
+            if body_code is None:
+                body_code = self.compile(info.body, layout, True, False)
+                info.body_code = body_code
+        else:
+            try:
+                new_scope = self.bind_params(info.environment,
+                                             info.param_names,
+                                             List.from_iterable(args))
+            except TypeError:
+                # There was a problem with the structure of the parameter
+                # list (bind_params already gave the error message)
+                return nil
+            layout = tuple(new_scope)
+            new_frame = [layout, *new_scope.values()]
+            body_code = self.compile(info.body, layout, True, False)
+        if memoized is not None:
+            return TailCall(body_code, new_frame, (memoized, key))
+        return TailCall(body_code, new_frame)
+
+    def find_shadowed_params(self, info):
+        """Update the list of a function's params that are global names.
+
+Global names are only ever added, never removed, so the list only
+needs updating when the size of the global scope has changed.
+"""
+        info.shadowed = [name for name in info.params
+                         if self.is_global_name(name)]
+        info.global_count = len(self.global_scope)
+
+    def call_builtin(self, builtin, arg_codes, frame, top_level):
+        """Call a builtin function with the values of arg_codes."""
+        if builtin.top_level_only and not top_level:
+            cfg.error(builtin.tl_name,
+                      "can only be called at top level")
+            return nil
+        args = [arg_code(frame) for arg_code in arg_codes]
+        return self.check_and_call_builtin(builtin, args, top_level,
+                                           top_level_checked=True)
+
+    def check_and_call_builtin(self, builtin, args, top_level,
+                               top_level_checked=False):
+        if (builtin.top_level_only and not top_level
+                and not top_level_checked):
+            cfg.error(builtin.tl_name,
+                      "can only be called at top level")
+            return nil
+        elif builtin.repl_only and not self.is_repl:
+            cfg.error(builtin.tl_name, "can only be used in REPL mode")
+        if len(args) < builtin.min_param_count:
+            cfg.error(builtin.tl_name, "takes at least",
+                      builtin.min_param_count, "arguments, got", len(args))
+            return nil
+        elif len(args) > builtin.max_param_count:
+            cfg.error(builtin.tl_name, "takes at most",
+                      builtin.max_param_count, "arguments, got", len(args))
+            return nil
+        elif len(args) == 2:
+            return builtin.call2(*args)
+        else:
+            return builtin.call(*args)
+
+
+def constant(value):
+    def constant_value(frame):
+        return value
+    return constant_value
@@ -0,0 +1,666 @@
+import zlib
+from array import array
+from collections import OrderedDict
+
+
+class List:
+    """An immutable singly linked list built out of cons cells.
+
+Each cell holds a head value and a tail List, and it knows its length.
+The empty list, nil, is a unique cell whose head and tail are both
+nil. Since cells are never modified, tails share structure freely:
+cons and tail are O(1) and never copy anything.
+"""
+    __slots__ = ("head", "tail", "length")
+
+    def __init__(self, head, tail):
+        self.head = head
+        self.tail = tail
+        self.length = tail.length + 1
+
+    @classmethod
+    def from_iterable(cls, items):
+        """Build a List containing the items of a Python iterable."""
+        if not isinstance(items, (list, tuple)):
+            items = list(items)
+        result = nil
+        for item in reversed(items):
+            result = cls(item, result)
+        return result
+
+    @classmethod
+    def from_pairs(cls, pairs):
+        """Build a List of (key value) Lists, the form locals returns.
+
+The pairs are a Python iterable of (key, value) tuples.
+"""
+        return cls.from_iterable([cls(key, cls(value, nil))
+                                  for key, value in pairs])
+
+    def __iter__(self):
+        cell = self
+        while cell.length:
+            yield cell.head
+            cell = cell.tail
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __getitem__(self, index):
+        if not isinstance(index, int):
+            raise TypeError("List indices must be integers")
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("List index out of range")
+        cell = self
+        for _ in range(index):
+            cell = cell.tail
+        return cell.head
+
+    def __eq__(self, rhs):
+        if not isinstance(rhs, List):
+            return NotImplemented
+        # Walk both lists together instead of recursing down the tails,
+        # so that comparing long lists can't exhaust the Python stack
+        cell1 = self
+        cell2 = rhs
+        if cell1.length != cell2.length:
+            return False
+        while cell1 is not cell2:
+            if cell1.head != cell2.head:
+                return False
+            cell1 = cell1.tail
+            cell2 = cell2.tail
+        return True
+
+    __hash__ = None
+
+    def __repr__(self):
+        # Look the same as a Python list in messages
+        return repr(list(self))
+
+    def __reduce__(self):
+        # Pickle as a flat sequence of items rather than as a chain
+        # of nested cells
+        return (List.from_iterable, (tuple(self),))
+
+
+# The empty list, nil, is its own head and tail
+nil = List.__new__(List)
+nil.head = nil
+nil.tail = nil
+nil.length = 0
+
+
+class LazySeq(List):
+    """A List whose items are produced on demand by a Python iterator.
+
+Each cell has its head, but its tail is only produced, by taking the
+next item from the iterator, the first time it is needed. Then it is
+kept, so a LazySeq can be traversed as many times as any other List.
+A LazySeq is never empty: from_iterator returns nil if the iterator has
+no items, so identity tests against nil still work. Anything that needs
+the length of a LazySeq (including comparing it to another List) forces
+all of it, as does converting it to a Python sequence.
+"""
+    __slots__ = ("_tail", "_rest")
+
+    @classmethod
+    def from_iterator(cls, iterator):
+        """Return a LazySeq of the items of an iterator, or nil."""
+        for item in iterator:
+            return cls.cons(item, None, iterator)
+        return nil
+
+    @classmethod
+    def cons(cls, head, tail, rest=None):
+        """Make a cell whose tail is tail, or whose items come from rest."""
+        cell = cls.__new__(cls)
+        cell.head = head
+        cell._tail = tail
+        cell._rest = rest
+        return cell
+
+    @property
+    def tail(self):
+        if self._rest is not None:
+            self._tail = LazySeq.from_iterator(self._rest)
+            self._rest = None
+        return self._tail
+
+    @property
+    def length(self):
+        length = 0
+        cell = self
+        while type(cell) is LazySeq:
+            length += 1
+            cell = cell.tail
+        return length + cell.length
+
+    def __iter__(self):
+        cell = self
+        while cell is not nil:
+            yield cell.head
+            cell = cell.tail
+
+    def __bool__(self):
+        return True
+
+
+class Environment(List):
+    """The environment of a closure: a List of (name value) pairs.
+
+An Environment is built by locals from the bindings of a scope, so its
+pairs are known to be well formed. It keeps the bindings in a dict as
+well, which calls to the closure copy instead of checking the pairs
+again. To any other code, it is just a List.
+"""
+    __slots__ = ("bindings",)
+
+    @classmethod
+    def from_bindings(cls, bindings):
+        """Build an Environment from a dict of name:value bindings."""
+        if not bindings:
+            return nil
+        pairs = List.from_pairs(bindings.items())
+        environment = cls(pairs.head, pairs.tail)
+        environment.bindings = dict(bindings)
+        return environment
+
+
+class Memoized(List):
+    """A user-defined function whose results are cached.
+
+A Memoized is still the List (env params body) of the function it
+wraps, so the evaluators call it like any other function; they also
+look up the structural key of the argument values (see memo_key) in
+its cache first, and store the result there when they have to run the
+body. The cache holds at most max_size results and evicts the least
+recently used one to make room for another.
+"""
+    __slots__ = ("cache", "max_size", "hits", "misses", "evictions")
+
+    @classmethod
+    def from_function(cls, function, max_size):
+        memoized = cls(function.head, function.tail)
+        memoized.cache = OrderedDict()
+        memoized.max_size = max_size
+        memoized.hits = 0
+        memoized.misses = 0
+        memoized.evictions = 0
+        return memoized
+
+    def lookup(self, key):
+        """Return the cached result for key, or None if there isn't one."""
+        value = self.cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.cache.move_to_end(key)
+        return value
+
+    def store(self, key, value):
+        self.cache[key] = value
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.cache.clear()
+
+
+def structural_key(value):
+    """A hashable value that is equal for equal tinylisp values."""
+    if isinstance(value, List):
+        # Lists aren't hashable, but a tuple of their items' keys is
+        return tuple(map(structural_key, value))
+    else:
+        return value
+
+
+def memo_key(args):
+    """The key for a Memoized function's cache from its argument values."""
+    return tuple(map(structural_key, args))
+
+
+class String:
+    """An immutable string with O(1) head and tail and cheap prepending.
+
+A String is a run of prepended characters followed by a suffix of an
+ordinary Python str. Taking the tail drops a prepended character or
+advances the start of the suffix, so no characters are copied. The
+prepended characters live back to front in a buffer that can be shared
+by many Strings: prepending to a String that ends its buffer appends to
+the buffer in place, so building a string one character at a time
+costs amortized O(1) per character.
+
+The full Python str is only built when it is needed (for output or
+equality tests), and then it is cached.
+"""
+    __slots__ = ("_buffer", "_used", "_text", "_start", "_value")
+
+    def __init__(self, text=""):
+        self._buffer = None
+        self._used = 0
+        self._text = text
+        self._start = 0
+        self._value = text
+
+    @classmethod
+    def _view(cls, buffer, used, text, start):
+        string = cls.__new__(cls)
+        string._buffer = buffer
+        string._used = used
+        string._text = text
+        string._start = start
+        string._value = None
+        return string
+
+    @property
+    def head(self):
+        """The character code of the first character."""
+        if self._used:
+            return ord(self._buffer[self._used - 1])
+        else:
+            return ord(self._text[self._start])
+
+    @property
+    def tail(self):
+        """A String of all characters but the first."""
+        if self._used:
+            return String._view(self._buffer, self._used - 1,
+                                self._text, self._start)
+        elif self._start < len(self._text):
+            return String._view(None, 0, self._text, self._start + 1)
+        else:
+            return self
+
+    def prepend(self, char):
+        """Return a new String with char in front of this one."""
+        buffer = self._buffer
+        used = self._used
+        if buffer is None:
+            buffer = [char]
+        elif used == len(buffer):
+            # This String ends the buffer, so it can grow in place
+            buffer.append(char)
+        elif buffer[used] != char:
+            # Another String already extended the buffer with a
+            # different character; this one needs a buffer of its own
+            buffer = buffer[:used]
+            buffer.append(char)
+        # Otherwise, the buffer already has the right character in the
+        # right place and can simply be shared
+        return String._view(buffer, used + 1, self._text, self._start)
+
+    def __str__(self):
+        if self._value is None:
+            value = self._text[self._start:]
+            if self._used:
+                value = "".join(reversed(self._buffer[:self._used])) + value
+            # Keep the materialized str as this String's only storage
+            self._buffer = None
+            self._used = 0
+            self._text = value
+            self._start = 0
+            self._value = value
+        return self._value
+
+    def __len__(self):
+        return self._used + len(self._text) - self._start
+
+    def __bool__(self):
+        return self._used > 0 or self._start < len(self._text)
+
+    def __iter__(self):
+        return iter(str(self))
+
+    def __eq__(self, rhs):
+        if isinstance(rhs, String):
+            return len(self) == len(rhs) and str(self) == str(rhs)
+        elif isinstance(rhs, str):
+            return len(self) == len(rhs) and str(self) == rhs
+        else:
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __reduce__(self):
+        return (String, (str(self),))
+
+
+class IntVector:
+    """An immutable vector of 64-bit signed integers.
+
+The items are stored unboxed in an array.array, so bulk operations on
+a vector run as C loops instead of tinylisp recursion. Constructing an
+IntVector raises OverflowError if an item doesn't fit in 64 bits.
+"""
+    __slots__ = ("items",)
+
+    def __init__(self, items=()):
+        if isinstance(items, array) and items.typecode == "q":
+            self.items = items
+        else:
+            self.items = array("q", items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return len(self.items) > 0
+
+    def __eq__(self, rhs):
+        if isinstance(rhs, IntVector):
+            return self.items == rhs.items
+        else:
+            return NotImplemented
+
+    def __hash__(self):
+        return hash(self.items.tobytes())
+
+    def __repr__(self):
+        return f"IntVector({self.items.tolist()!r})"
+
+    def __reduce__(self):
+        return (IntVector, (self.items,))
+
+
+def stable_hash(value):
+    """A 32-bit hash of a tinylisp value that is the same on every run.
+
+Python's own str hashes change from run to run, which would change the
+order that hash maps and sets list their items in. Values that are
+equal in tinylisp have equal stable hashes; Lists hash by structure.
+"""
+    if isinstance(value, int):
+        return hash(value) & HASH_MASK
+    elif isinstance(value, String):
+        return zlib.crc32(str(value).encode("utf-8", "surrogatepass"))
+    elif isinstance(value, List):
+        result = 0x345678
+        for item in value:
+            result = (result * 1000003 ^ stable_hash(item)) & HASH_MASK
+        return result ^ len(value)
+    elif isinstance(value, IntVector):
+        return zlib.crc32(value.items.tobytes()) ^ 0x7F4A7C15
+    elif isinstance(value, HashTrie):
+        return value.stable_hash()
+    else:
+        # Symbols and builtins are only ever equal to themselves, so
+        # their names will do
+        return zlib.crc32(str(value).encode("utf-8", "surrogatepass")) ^ 1
+
+
+# Hash array mapped tries
+# Each level of a trie uses TRIE_BITS bits of a key's hash to pick one
+# of up to 2 ** TRIE_BITS children. A node stores only the children
+# that exist, in order, along with a bitmap of which ones those are.
+
+HASH_BITS = 32
+HASH_MASK = 2 ** HASH_BITS - 1
+TRIE_BITS = 5
+TRIE_MASK = 2 ** TRIE_BITS - 1
+
+
+class TrieNode:
+    __slots__ = ("bitmap", "children")
+
+    def __init__(self, bitmap, children):
+        self.bitmap = bitmap
+        self.children = children
+
+
+class TrieLeaf:
+    __slots__ = ("hash", "key", "value")
+
+    def __init__(self, hash, key, value):
+        self.hash = hash
+        self.key = key
+        self.value = value
+
+
+class TrieCollision:
+    """The leaves of keys whose hashes are the same in every bit."""
+    __slots__ = ("hash", "leaves")
+
+    def __init__(self, hash, leaves):
+        self.hash = hash
+        self.leaves = leaves
+
+
+EMPTY_NODE = TrieNode(0, ())
+
+
+def trie_find(node, hash, key):
+    """Return the leaf for key in a trie, or None."""
+    shift = 0
+    while True:
+        bit = 1 << (hash >> shift & TRIE_MASK)
+        if not node.bitmap & bit:
+            return None
+        child = node.children[bin(node.bitmap & (bit - 1)).count("1")]
+        if type(child) is TrieNode:
+            node = child
+            shift += TRIE_BITS
+        elif type(child) is TrieLeaf:
+            if child.hash == hash and child.key == key:
+                return child
+            return None
+        else:
+            if child.hash == hash:
+                for leaf in child.leaves:
+                    if leaf.key == key:
+                        return leaf
+            return None
+
+
+def trie_insert(node, leaf, shift=0):
+    """Return a copy of a trie with leaf added, replacing any old leaf
+for the same key. Only the nodes on the path to the leaf are copied.
+"""
+    bit = 1 << (leaf.hash >> shift & TRIE_MASK)
+    index = bin(node.bitmap & (bit - 1)).count("1")
+    children = node.children
+    if not node.bitmap & bit:
+        return TrieNode(node.bitmap | bit,
+                        children[:index] + (leaf,) + children[index:])
+    child = children[index]
+    if type(child) is TrieNode:
+        new_child = trie_insert(child, leaf, shift + TRIE_BITS)
+    elif type(child) is TrieLeaf and child.key == leaf.key:
+        new_child = leaf
+    elif child.hash == leaf.hash:
+        # Two keys with the same hash
+        leaves = child.leaves if type(child) is TrieCollision else (child,)
+        leaves = tuple(old for old in leaves if old.key != leaf.key)
+        new_child = TrieCollision(leaf.hash, leaves + (leaf,))
+    else:
+        # Push the old child down a level, then add the leaf beside it
+        old_bit = 1 << (child.hash >> shift + TRIE_BITS & TRIE_MASK)
+        new_child = trie_insert(TrieNode(old_bit, (child,)), leaf,
+                                shift + TRIE_BITS)
+    return TrieNode(node.bitmap,
+                    children[:index] + (new_child,) + children[index + 1:])
+
+
+def trie_delete(node, hash, key, shift=0):
+    """Return a copy of a trie without the leaf for key, or None if the
+result would be empty. The node itself is returned if key isn't there.
+"""
+    bit = 1 << (hash >> shift & TRIE_MASK)
+    if not node.bitmap & bit:
+        return node
+    index = bin(node.bitmap & (bit - 1)).count("1")
+    children = node.children
+    child = children[index]
+    if type(child) is TrieNode:
+        new_child = trie_delete(child, hash, key, shift + TRIE_BITS)
+        if new_child is child:
+            return node
+        if (new_child is not None and len(new_child.children) == 1
+                and type(new_child.children[0]) is not TrieNode):
+            # Pull a lone leaf back up, so that the trie stays the same
+            # shape as if the deleted key had never been added
+            new_child = new_child.children[0]
+    elif type(child) is TrieLeaf:
+        if child.hash != hash or child.key != key:
+            return node
+        new_child = None
+    else:
+        leaves = tuple(leaf for leaf in child.leaves if leaf.key != key)
+        if len(leaves) == len(child.leaves):
+            return node
+        elif len(leaves) == 1:
+            new_child = leaves[0]
+        else:
+            new_child = TrieCollision(hash, leaves)
+    if new_child is not None:
+        return TrieNode(node.bitmap, children[:index] + (new_child,)
+                        + children[index + 1:])
+    elif node.bitmap == bit:
+        return None
+    else:
+        return TrieNode(node.bitmap & ~bit,
+                        children[:index] + children[index + 1:])
+
+
+def trie_leaves(node):
+    """Generate the leaves of a trie, in hash order."""
+    for child in node.children:
+        if type(child) is TrieNode:
+            yield from trie_leaves(child)
+        elif type(child) is TrieLeaf:
+            yield child
+        else:
+            yield from child.leaves
+
+
+class HashTrie:
+    """The shared parts of HashMap and HashSet.
+
+Both are persistent: inserting or deleting a key returns a new
+collection that shares all but O(log n) of its nodes with the old one,
+which is unchanged. Keys can be any tinylisp values, compared the way
+= compares them, and are listed in the order of their stable hashes,
+which is the same on every run.
+"""
+    __slots__ = ("root", "size", "_hash")
+
+    def __init__(self, root=EMPTY_NODE, size=0):
+        self.root = root
+        self.size = size
+        self._hash = None
+
+    def contains(self, key):
+        return trie_find(self.root, stable_hash(key), key) is not None
+
+    def delete(self, key):
+        """Return a copy of this collection without key."""
+        root = trie_delete(self.root, stable_hash(key), key)
+        if root is self.root:
+            return self
+        return type(self)(root or EMPTY_NODE, self.size - 1)
+
+    def _insert(self, key, value):
+        hash = stable_hash(key)
+        size = self.size
+        if trie_find(self.root, hash, key) is None:
+            size += 1
+        return type(self)(trie_insert(self.root, TrieLeaf(hash, key, value)),
+                          size)
+
+    def keys(self):
+        return (leaf.key for leaf in trie_leaves(self.root))
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __eq__(self, rhs):
+        if type(rhs) is not type(self):
+            return NotImplemented
+        elif self.size != rhs.size:
+            return False
+        for leaf in trie_leaves(self.root):
+            other = trie_find(rhs.root, leaf.hash, leaf.key)
+            if other is None or other.value != leaf.value:
+                return False
+        return True
+
+    def __hash__(self):
+        return self.stable_hash()
+
+    def stable_hash(self):
+        if self._hash is None:
+            # Add up the hashes of the items, so that their order
+            # doesn't matter
+            result = self.size
+            for leaf in trie_leaves(self.root):
+                result += leaf.hash * 31 ^ stable_hash(leaf.value)
+            self._hash = result & HASH_MASK
+        return self._hash
+
+
+class HashMap(HashTrie):
+    """A persistent hash map from tinylisp values to tinylisp values."""
+    __slots__ = ()
+
+    @classmethod
+    def from_items(cls, items):
+        result = cls()
+        for key, value in items:
+            result = result.insert(key, value)
+        return result
+
+    def get(self, key, default=None):
+        leaf = trie_find(self.root, stable_hash(key), key)
+        return default if leaf is None else leaf.value
+
+    def insert(self, key, value):
+        """Return a copy of this map with key bound to value."""
+        return self._insert(key, value)
+
+    def items(self):
+        return ((leaf.key, leaf.value) for leaf in trie_leaves(self.root))
+
+    def __repr__(self):
+        return f"HashMap({dict(self.items())!r})"
+
+
+class HashSet(HashTrie):
+    """A persistent hash set of tinylisp values."""
+    __slots__ = ()
+
+    @classmethod
+    def from_iterable(cls, items):
+        result = cls()
+        for item in items:
+            result = result.insert(item)
+        return result
+
+    def insert(self, item):
+        """Return a copy of this set with item in it."""
+        # A set is a map whose values are all 1
+        return self._insert(item, 1)
+
+    def __iter__(self):
+        return self.keys()
+
+    def __repr__(self):
+        return f"HashSet({list(self)!r})"
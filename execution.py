@@ -1,12 +1,36 @@
 
 import sys
 import os
-from itertools import zip_longest
+import io
+from itertools import zip_longest, count, chain
+from math import prod
 from contextlib import contextmanager
 
 from cfg import nil, Symbol, UNLIMITED
 import cfg
-from parsing import parse
+from datatypes import (List, LazySeq, Environment, Memoized, String,
+                       IntVector, HashMap, HashSet, memo_key)
+from parsing import parse, parse_lines
+from builtin import (macro, function, quiet, top_level_only, repl_only,
+                     params, two_args, Builtin)
+import vectors
+from vectors import VectorBuiltins
+import listlib
+from listlib import ListLibrary
+import memo
+from memo import MemoBuiltins
+import modulecache
+import output
+import autoload
+import image
+import integers
+from integers import IntegerBuiltins
+import hashmaps
+from hashmaps import HashBuiltins
+import sorting
+from sorting import SortBuiltins
+import inputs
+from inputs import InputBuiltins
 
 
 # Built-in functions and macros
@@ -25,8 +49,9 @@ builtins = {
     "tl_less": "<",
     "tl_equal": "=",
     "tl_same_type": "same-type?",
+    "tl_force": "force",
     "tl_unparse": "unparse",
-#    "tl_parse": "parse",
+    "tl_parse": "parse",
     "tl_write": "write",
     "tl_locals": "locals",
     "tl_eval": "eval",
@@ -41,74 +66,31 @@ builtins = {
     "tl_restart": "restart",
     "tl_quit": "quit",
     }
+builtins.update(vectors.builtins)
+builtins.update(memo.builtins)
+builtins.update(integers.builtins)
+builtins.update(hashmaps.builtins)
+builtins.update(sorting.builtins)
+builtins.update(inputs.builtins)
 
+# Macro expansions are cached per call site; when the cache grows past
+# this many entries, it is cleared and refilled as needed
+MACRO_CACHE_SIZE = 10_000
 
-# Decorators for member functions that implement builtins
-
-def macro(pyfunc):
-    """Mark this builtin as a macro."""
-    pyfunc.is_macro = True
-    pyfunc.name = pyfunc.__name__
-    if not hasattr(pyfunc, "is_quiet"):
-        pyfunc.is_quiet = False
-    if not hasattr(pyfunc, "top_level_only"):
-        pyfunc.top_level_only = False
-    if not hasattr(pyfunc, "repl_only"):
-        pyfunc.repl_only = False
-    return pyfunc
-
-
-def function(pyfunc):
-    """Mark this builtin as a function."""
-    pyfunc.is_macro = False
-    pyfunc.name = pyfunc.__name__
-    if not hasattr(pyfunc, "is_quiet"):
-        pyfunc.is_quiet = False
-    if not hasattr(pyfunc, "top_level_only"):
-        pyfunc.top_level_only = False
-    if not hasattr(pyfunc, "repl_only"):
-        pyfunc.repl_only = False
-    return pyfunc
-
-
-def quiet(pyfunc):
-    """This builtin's return value is only displayed in REPL mode."""
-    pyfunc.is_quiet = True
-    return pyfunc
-
-
-def top_level_only(pyfunc):
-    """This builtin cannot be called inside a function, only at top level."""
-    pyfunc.top_level_only = True
-    return pyfunc
-
-
-def repl_only(pyfunc):
-    """This builtin can only be called at top level in the REPL."""
-    pyfunc.repl_only = True
-    pyfunc.top_level_only = True
-    return pyfunc
-
-
-def params(min_param_count, max_param_count=None):
-    """Specify the min and max number of params this builtin takes."""
-    def params_decorator(pyfunc):
-        if max_param_count is not None:
-            pyfunc.min_param_count = min_param_count
-            pyfunc.max_param_count = max_param_count
-        elif min_param_count == UNLIMITED:
-            # This indicates a variadic builtin, so the actual minimum
-            # is zero, not infinity
-            pyfunc.min_param_count = 0
-            pyfunc.max_param_count = min_param_count
-        else:
-            pyfunc.min_param_count = min_param_count
-            pyfunc.max_param_count = min_param_count
-        return pyfunc
-    return params_decorator
+# Likewise for the names found in function bodies by locals
+NAME_SCAN_CACHE_SIZE = 10_000
+
+# unparse_chunks yields its text in chunks of about this many pieces
+UNPARSE_CHUNK_SIZE = 4096
 
+# Each time any Program's global scope changes, it gets a new version
+# number from this counter, so a version number identifies one state
+# of one global scope
+global_versions = count()
 
-class Program:
+
+class Program(VectorBuiltins, ListLibrary, MemoBuiltins,
+              IntegerBuiltins, HashBuiltins, SortBuiltins, InputBuiltins):
     def __init__(self, is_repl=False, debug_mode=False, options=None):
         self.is_repl = is_repl
         self.debug_mode = debug_mode
@@ -116,27 +98,78 @@ class Program:
         self.module_paths = [os.path.abspath(os.path.dirname(__file__))]
         self.global_scope = {}
         self.local_scopes = [{}]
-        self.builtins = []
+        self.macro_cache = {}
+        self.macro_hits = 0
+        self.macro_misses = 0
+        self.name_scan_cache = {}
+        # Files opened by the input builtins, by absolute path
+        self.input_files = {}
+        self.builtins = {}
         # Go through the tinylisp builtins and put the corresponding
         # member functions into the top-level symbol table
         for func_name, tl_func_name in builtins.items():
-            builtin = getattr(self, func_name)
-            self.builtins.append(builtin)
+            builtin = Builtin(getattr(self, func_name), tl_func_name)
+            self.builtins[func_name] = builtin
             self.global_scope[Symbol(tl_func_name)] = builtin
+        self.global_version = next(global_versions)
+        # The evaluators treat these builtins specially
+        self.if_builtin = self.builtins["tl_if"]
+        self.eval_builtin = self.builtins["tl_eval"]
+        self.quote_builtin = self.builtins["tl_quote"]
+        self.locals_builtin = self.builtins["tl_locals"]
+        # Use the native versions of core library functions unless the
+        # options say otherwise
+        self.native_library = not getattr(options, "no_native_library",
+                                          False)
+        self.native_definitions = {}
+        # Cache the parsed code of loaded modules unless the options
+        # say otherwise
+        self.module_cache = not getattr(options, "no_module_cache", False)
+        # Library names that haven't been loaded yet, each mapped to the
+        # module that defines it, and the module files they came from
+        self.autoload_index = {}
+        self.autoload_files = []
+        # Keep the options for restarting
+        self.options = options
+        image_path = getattr(options, "image", None)
+        if image_path is not None and image.restore(self, image_path):
+            # The library is already in the restored global scope
+            self.global_version = next(global_versions)
+        else:
+            self.load_library(options)
+            if image_path is not None:
+                image.save(self, image_path)
+
+    def load_library(self, options):
+        """Load the core library and short names.
+
+Unless the options say otherwise, the library modules are only indexed
+here, and each one is loaded when one of its names is first used.
+"""
         if options is not None:
             # Load the core library and short names according to
             # the user-specified options
+            modules = []
             if not options.no_library:
-                self.tl_load("lib/core")
+                modules.append("lib/core")
             if not options.no_short_names:
-                self.tl_load("lib/short-builtins")
+                modules.append("lib/short-builtins")
             if not options.no_library and not options.no_short_names:
-                self.tl_load("lib/short-names")
+                modules.append("lib/short-names")
         else:
             # By default, load the library and short names
-            self.tl_load("lib/core")
-            self.tl_load("lib/short-builtins")
-            self.tl_load("lib/short-names")
+            modules = ["lib/core", "lib/short-builtins", "lib/short-names"]
+        index = None
+        if not getattr(options, "no_autoload", False):
+            index = autoload.build_index(
+                [autoload.module_path(self.module_paths[0], module)
+                 for module in modules],
+                self.module_cache)
+        if index is not None:
+            self.autoload_index, self.autoload_files = index
+        else:
+            for module in modules:
+                self.tl_load(module)
 
     @property
     def current_scope(self):
@@ -149,35 +182,29 @@ class Program:
         return len(self.module_paths) > 1
 
     def execute(self, code):
+        """Execute code given as a str or as an iterable of lines.
+
+Each top-level expression is executed as soon as it has been parsed,
+so code from a file or stdin runs while it is being read.
+"""
+        # Determine whether the code is in single-line or
+        # multiline form:
+        # In single-line form, the code is parsed one line at a time
+        # with closing parentheses inferred at the end of each line
+        # In multiline form, the code is parsed as a whole, with
+        # closing parentheses inferred only at the end
+        # If any line in the code contains more closing parens than
+        # opening parens, the code is assumed to be in multiline
+        # form; otherwise, it's single-line
+        # parse_lines works this out as it goes
         if isinstance(code, str):
-            # Determine whether the code is in single-line or
-            # multiline form:
-            # In single-line form, the code is parsed one line at a time
-            # with closing parentheses inferred at the end of each line
-            # In multiline form, the code is parsed as a whole, with
-            # closing parentheses inferred only at the end
-            # If any line in the code contains more closing parens than
-            # opening parens, the code is assumed to be in multiline
-            # form; otherwise, it's single-line
-            codelines = code.split("\n")
-            multiline = any(line.count(")") > line.count("(")
-                            for line in codelines)
-            result = None
-            if multiline:
-                # Parse code as a whole
-                for expr in parse(code):
-                    result = self.execute_expression(expr)
-            else:
-                # Parse each line separately
-                for codeline in codelines:
-                    for expr in parse(codeline):
-                        result = self.execute_expression(expr)
-            # Return the result of the last expression
-            return result
-        else:
-            raise NotImplementedError("Argument to execute() must be "
-                                      f"str, not {type(code)}")
-    
+            code = io.StringIO(code)
+        result = None
+        for expr in parse_lines(code):
+            result = self.execute_expression(expr)
+        # Return the result of the last expression
+        return result
+
     def execute_expression(self, expr):
         """Evaluate an expression and (usually) display the result.
 
@@ -190,14 +217,14 @@ and the expression is a call to a builtin with the @quiet decorator.
         # This test isn't perfectly accurate, but it's close enough
         # in most cases, and it's better than evaluating the head
         # of the expression twice
-        if (not self.is_repl and isinstance(expr, list)
-                and expr != [] and isinstance(expr[0], Symbol)):
+        if (not self.is_repl and isinstance(expr, List)
+                and expr is not nil and isinstance(expr.head, Symbol)):
             try:
-                outer_function = self.lookup_name(expr[0])
+                outer_function = self.lookup_name(expr.head)
             except NameError:
                 pass
             else:
-                if cfg.tl_type(outer_function) == "Builtin":
+                if type(outer_function) is Builtin:
                     suppress_output = outer_function.is_quiet
         result = self.evaluate(expr, top_level=True)
         if not suppress_output:
@@ -205,37 +232,57 @@ and the expression is a call to a builtin with the @quiet decorator.
         return result
 
     def evaluate(self, expr, top_level=False):
+        """Evaluate an expression.
+
+Calls to memoized functions whose results aren't cached yet run in the
+same loop as other tail calls, so they take no more stack space than
+calls to plain functions; their result is stored under the keys of all
+the memoized calls in the chain.
+"""
         # TODO: better error handling instead of just returning nil
+        if type(expr) is Symbol:
+            # Names are the most common kind of expression, so look them
+            # up without setting up the evaluation loop
+            try:
+                return self.lookup_name(expr)
+            except NameError as err:
+                cfg.error(*err.args)
+                return nil
         bindings = None
+        # The memoized functions called in the chain of tail calls, with
+        # their keys
+        memo_keys = None
         # Loop while the expression represents a call to a user-defined
         # function (tail-call optimization)
         while True:
             with self.open_scope(bindings):
                 # Eliminate any macros, ifs, and evals
-                if isinstance(expr, list) and expr != []:
-                    head = self.evaluate(expr[0])
-                    tail = expr[1:]
+                if isinstance(expr, List) and expr is not nil:
+                    head = self.evaluate(expr.head)
+                    tail = expr.tail
                     try:
                         head, tail = self.resolve_macros(head, tail)
                     except TypeError:
                         # resolve_macros encountered an error condition
                         # (it already gave the error message)
-                        return nil
+                        value = nil
+                        break
                 else:
                     head = None
                     tail = expr
                 if head is not None:
                     # After macro elimination, expr is still some kind of
                     # function call
-                    if head in self.builtins:
+                    if type(head) is Builtin:
                         # Call to a builtin function or macro
                         builtin = head
                         if builtin.top_level_only and not top_level:
-                            cfg.error(builtins[builtin.name],
+                            cfg.error(builtin.tl_name,
                                       "can only be called at top level")
-                            return nil
+                            value = nil
+                            break
                         elif builtin.repl_only and not self.is_repl:
-                            cfg.error(builtins[builtin.name],
+                            cfg.error(builtin.tl_name,
                                       "can only be used in REPL mode")
                         if builtin.is_macro:
                             # Macros receive their args unevaluated
@@ -244,22 +291,28 @@ and the expression is a call to a builtin with the @quiet decorator.
                             # Functions receive their args evaluated
                             args = [self.evaluate(arg) for arg in tail]
                         if len(args) < builtin.min_param_count:
-                            cfg.error(builtins[builtin.name],
+                            cfg.error(builtin.tl_name,
                                       "takes at least",
                                       builtin.min_param_count,
                                       "arguments, got",
                                       len(args))
-                            return nil
+                            value = nil
+                            break
                         elif len(args) > builtin.max_param_count:
-                            cfg.error(builtins[builtin.name],
+                            cfg.error(builtin.tl_name,
                                       "takes at most",
                                       builtin.max_param_count,
                                       "arguments, got",
                                       len(args))
-                            return nil
+                            value = nil
+                            break
+                        elif len(args) == 2:
+                            value = builtin.call2(*args)
+                            break
                         else:
-                            return builtin(*args)
-                    elif isinstance(head, list) and head != []:
+                            value = builtin.call(*args)
+                            break
+                    elif isinstance(head, List) and head is not nil:
                         # User-defined function; do a tail call
                         try:
                             environment, param_names, body = head
@@ -267,8 +320,15 @@ and the expression is a call to a builtin with the @quiet decorator.
                             cfg.error("List callable as function must have "
                                       "3 elements, not",
                                       len(head))
-                            return nil
-                        args = [self.evaluate(arg) for arg in tail]
+                            value = nil
+                            break
+                        args = List.from_iterable([self.evaluate(arg)
+                                                   for arg in tail])
+                        if type(head) is Memoized:
+                            key = memo_key(args)
+                            value = head.lookup(key)
+                            if value is not None:
+                                break
                         try:
                             bindings = self.bind_params(environment,
                                                         param_names,
@@ -277,7 +337,14 @@ and the expression is a call to a builtin with the @quiet decorator.
                             # There was a problem with the structure of
                             # the parameter list (bind_params already gave
                             # the error message)
-                            return nil
+                            value = nil
+                            break
+                        if type(head) is Memoized:
+                            # The result of this tail call is the result
+                            # of the whole chain of tail calls
+                            if memo_keys is None:
+                                memo_keys = []
+                            memo_keys.append((head, key))
                         expr = body
                         top_level = False
                         # Loop with the new expression and bindings
@@ -285,31 +352,43 @@ and the expression is a call to a builtin with the @quiet decorator.
                         # Trying to call something other than a builtin or
                         # user-defined function
                         cfg.error(head, "is not a function or macro")
-                        return nil
+                        value = nil
+                        break
                 else:
                     # If head is None, the expression (stored in tail)
                     # must be nil, a symbol, or a literal
                     expr = tail
-                    if expr == nil:
+                    if expr is nil:
                         # Nil evaluates to itself
-                        return nil
+                        value = nil
+                        break
                     elif isinstance(expr, Symbol):
                         # A symbol is looked up as a name
                         try:
-                            return self.lookup_name(expr)
+                            value = self.lookup_name(expr)
+                            break
                         except NameError as err:
                             cfg.error(*err.args)
-                            return nil
-                    elif isinstance(expr, (int, str)):
+                            value = nil
+                            break
+                    elif isinstance(expr, (int, String)):
                         # Integers and strings evaluate to themselves
-                        return expr
-                    elif expr in self.builtins:
+                        value = expr
+                        break
+                    elif type(expr) is Builtin:
                         # Builtins also evaluate to themselves
-                        return expr
+                        value = expr
+                        break
                     else:
                         # Code should never get here
                         raise TypeError("unexpected type in evaluate():",
                                         type(expr))
+        if memo_keys is not None:
+            # Store the outermost call's result last, so that it's the
+            # last to be evicted
+            for function, key in reversed(memo_keys):
+                function.store(key, value)
+        return value
 
     @contextmanager
     def open_scope(self, bindings):
@@ -325,17 +404,69 @@ If bindings is None, do not open a new scope, just use the current one.
             if bindings is not None:
                 self.local_scopes.pop()
 
+    def evaluate_in_scope(self, expr, scope):
+        """Evaluate an expression in a new local scope.
+
+The scope is a dictionary of name:value pairs.
+"""
+        with self.open_scope(scope):
+            return self.evaluate(expr)
+
     def lookup_name(self, name):
         """Look up a name in the local and global symbol tables.
 
 Raises NameError if the name is not found.
 """
-        if name in self.current_scope:
-            return self.current_scope[name]
-        elif name in self.global_scope:
-            return self.global_scope[name]
-        else:
-            raise NameError(f"{name!r} is not defined")
+        # None is never a tinylisp value, so it can mark a missing name
+        value = self.local_scopes[-1].get(name)
+        if value is None:
+            value = self.global_scope.get(name)
+            if value is None:
+                value = self.global_value(name)
+                if value is None:
+                    raise NameError(f"{name!r} is not defined")
+        return value
+
+    def global_value(self, name):
+        """Return the value of a global name, or None if it's undefined.
+
+A library name that hasn't been loaded yet gets loaded first.
+"""
+        value = self.global_scope.get(name)
+        if value is None and name in self.autoload_index:
+            self.autoload(name)
+            value = self.global_scope.get(name)
+        return value
+
+    def is_global_name(self, name):
+        """Is a name global, or a library name that isn't loaded yet?"""
+        return name in self.global_scope or name in self.autoload_index
+
+    def autoload(self, name):
+        """Load the library module that defines a name.
+
+The module runs in a scope of its own, as if loaded from the top level,
+so it can't see the local names of the code that needed it.
+"""
+        with self.open_scope({}):
+            self.load_module(self.autoload_index[name])
+
+    def bind_global(self, name, value):
+        """Bind a global name and give the global scope a new version."""
+        self.global_scope[name] = value
+        self.global_version = next(global_versions)
+
+    def call(self, function, args):
+        """Call a tinylisp function with already-evaluated args.
+
+The call is evaluated as an expression whose head and args are quoted,
+so it behaves just like a call from tinylisp code.
+"""
+        quote = self.quote_builtin
+        expr = List(List(quote, List(function, nil)),
+                    List.from_iterable([List(quote, List(arg, nil))
+                                        for arg in args]))
+        return self.evaluate(expr)
 
     def bind_params(self, environment, param_names, arglist):
         """Return a dictionary of name:value pairs.
@@ -349,9 +480,14 @@ arguments, raise TypeError.
 """
         # Bind names from environment first (these are local names captured
         # from a lexically enclosing scope)
-        new_scope = {}
+        if type(environment) is Environment:
+            # Built by locals, so the pairs are known to be well formed
+            new_scope = environment.bindings.copy()
+            environment = nil
+        else:
+            new_scope = {}
         for pair in environment:
-            if isinstance(pair, list) and len(pair) == 2:
+            if isinstance(pair, List) and len(pair) == 2:
                 name, val = pair
                 if isinstance(name, Symbol):
                     new_scope[name] = val
@@ -365,11 +501,11 @@ arguments, raise TypeError.
                           "environment; got", pair, "instead")
                 raise TypeError
         # Bind argument values to parameter names
-        if isinstance(param_names, list):
+        if isinstance(param_names, List):
             name_count = 0
             val_count = 0
             for name, val in zip_longest(param_names, arglist):
-                if isinstance(name, list):
+                if isinstance(name, List):
                     # Should be a name + default value pair
                     default_param = name
                     if len(default_param) == 2:
@@ -393,7 +529,7 @@ arguments, raise TypeError.
                     # Ran out of argument values
                     name_count += 1
                 elif isinstance(name, Symbol):
-                    if name in self.global_scope:
+                    if self.is_global_name(name):
                         cfg.warn("parameter name shadows global name",
                                  name)
                     new_scope[name] = val
@@ -410,7 +546,7 @@ arguments, raise TypeError.
         elif isinstance(param_names, Symbol):
             # Single name, bind entire arglist to it
             arglist_name = param_names
-            if arglist_name in self.global_scope:
+            if self.is_global_name(arglist_name):
                 cfg.warn("parameter name shadows global name", arglist_name)
             new_scope[arglist_name] = arglist
         else:
@@ -433,10 +569,10 @@ user-defined macros.
   value and replace the expression with that.
 """
         self.debug("Resolve macros:", head, tail)
-        while (head == self.tl_if
-               or head == self.tl_eval
+        while (head is self.if_builtin
+               or head is self.eval_builtin
                or self.is_macro(head)):
-            if head == self.tl_if:
+            if head is self.if_builtin:
                 # The head is (some name for) tl_if
                 # If needs exactly three arguments
                 if len(tail) == 3:
@@ -450,7 +586,7 @@ user-defined macros.
                 else:
                     cfg.error("if takes 3 arguments, not", len(tail))
                     raise TypeError
-            elif head == self.tl_eval:
+            elif head is self.eval_builtin:
                 # The head is (some name for) tl_eval
                 # Eval needs exactly one argument
                 if len(tail) == 1:
@@ -460,21 +596,17 @@ user-defined macros.
                     raise TypeError
             else:
                 # The head is a list representing a user-defined macro
-                macro_params, macro_body = head
                 try:
-                    macro_bindings = self.bind_params([], macro_params, tail)
+                    expression = self.expand_macro(head, tail)
                 except TypeError:
                     self.debug("TypeError from bind_params")
                     raise
-                # Substitute the arguments for the parameter names in
-                # the macro body expression
-                expression = self.replace(macro_bindings, macro_body)
-            if expression and isinstance(expression, list):
+            if expression and isinstance(expression, List):
                 # The result was a nonempty s-expression which could be
                 # another macro invocation, so set up for another trip
                 # through the loop
-                head, *tail = expression
-                head = self.evaluate(head)
+                head = self.evaluate(expression.head)
+                tail = expression.tail
             else:
                 # The result was nil or something other than an
                 # s-expression; mark this case by setting head to None
@@ -489,20 +621,185 @@ user-defined macros.
     def is_macro(self, expression):
         """Does an expression represent a user-defined macro?"""
         # A macro must be a list with two elements (params and body)
-        if isinstance(expression, list) and len(expression) == 2:
+        if isinstance(expression, List) and expression.length == 2:
             return True
         else:
             return False
 
+    def expand_macro(self, macro, args):
+        """Return the expansion of a call to a user-defined macro.
+
+Expansions are cached by call site: the macro and the argument List,
+both compared by identity. Lists are immutable, so the same macro
+called with the same argument List always expands the same way, and
+the cached expansion can be reused as is. Calls whose bindings give
+warnings or errors are never cached, so that the messages appear every
+time. If binding the arguments fails, raise TypeError.
+"""
+        key = (id(macro), id(args))
+        entry = self.macro_cache.get(key)
+        if entry is not None and entry[2] == len(self.global_scope):
+            self.macro_hits += 1
+            return entry[3]
+        self.macro_misses += 1
+        macro_params, macro_body = macro
+        bindings = self.macro_bindings(macro_params, args)
+        if bindings is None:
+            bindings = self.bind_params(nil, macro_params, args)
+            return self.replace(bindings, macro_body)
+        expansion = self.replace(bindings, macro_body)
+        if len(self.macro_cache) >= MACRO_CACHE_SIZE:
+            self.macro_cache.clear()
+        # Keep the macro and arguments alive alongside the expansion, so
+        # that their ids can't be reused while the cache entry exists.
+        # Defining a global name that is also a parameter name would
+        # make the binding give a warning, so the entry is only valid as
+        # long as the global scope doesn't change size.
+        self.macro_cache[key] = (macro, args, len(self.global_scope),
+                                 expansion)
+        return expansion
+
+    def macro_bindings(self, params, args):
+        """Bind a macro's params, or return None if that gives messages.
+
+This is bind_params for the simple cases that can't produce errors or
+warnings: a single parameter name, or a List of parameter names without
+default values whose length matches the argument list.
+"""
+        if isinstance(params, Symbol):
+            if self.is_global_name(params):
+                return None
+            return {params: args}
+        elif isinstance(params, List) and len(params) == len(args):
+            bindings = {}
+            for name, arg in zip(params, args):
+                if not isinstance(name, Symbol) or self.is_global_name(name):
+                    return None
+                bindings[name] = arg
+            return bindings
+        else:
+            return None
+
+    def local_names_used(self, body, param_names, scope):
+        """Return the names from scope that a function could refer to.
+
+The function has the given body and param_names; it binds its
+parameter names itself, so those are left out. The result is
+conservative: it has every local name that appears in body or in the
+body of a macro that body names. If body could call eval, or locals
+without arguments, the result is None, meaning that any local name
+might be needed. (A function that receives eval as an argument and
+calls it can still only see the names in the result.)
+"""
+        key = (id(body), self.global_version)
+        entry = self.name_scan_cache.get(key)
+        if entry is None:
+            if len(self.name_scan_cache) >= NAME_SCAN_CACHE_SIZE:
+                self.name_scan_cache.clear()
+            # Keep the body alive so that its id can't be reused while
+            # the cache entry exists
+            entry = (body, self.scan_names(body))
+            self.name_scan_cache[key] = entry
+        names = entry[1]
+        if names is None:
+            return None
+        if isinstance(param_names, Symbol):
+            param_names = [param_names]
+        elif not isinstance(param_names, List):
+            param_names = []
+        bound_names = set()
+        for param in param_names:
+            if isinstance(param, List):
+                # A name + default value pair
+                param = param.head
+            if isinstance(param, Symbol):
+                bound_names.add(param)
+        used = set()
+        pending = [name for name in names
+                   if name in scope and name not in bound_names]
+        while pending:
+            name = pending.pop()
+            if name in used:
+                continue
+            used.add(name)
+            value = scope[name]
+            if value is self.eval_builtin or value is self.locals_builtin:
+                return None
+            elif self.is_macro(value):
+                # A local macro's expansion can refer to more names
+                macro_names = self.scan_names(value)
+                if macro_names is None:
+                    return None
+                pending.extend(name for name in macro_names
+                               if name in scope and name not in bound_names)
+        return used
+
+    def scan_names(self, expression):
+        """Return the set of names that appear in an expression.
+
+Also scan the bodies of global macros that the expression names, since
+their expansions can refer to local names at the call site. Return
+None if the expression names eval, or names locals anywhere but at the
+head of a call with arguments.
+
+Only the global scope is looked at: scanning shouldn't load a library
+module that the code might never use. So the result is also None if
+the expression names a library name that hasn't been loaded yet, since
+it could be a macro.
+"""
+        names = set()
+        macros_seen = set()
+        pending = [expression]
+        while pending:
+            expression = pending.pop()
+            if isinstance(expression, Symbol):
+                if expression in names:
+                    continue
+                names.add(expression)
+                value = self.global_scope.get(expression)
+                if value is None and expression in self.autoload_index:
+                    return None
+                elif (value is self.eval_builtin
+                        or value is self.locals_builtin):
+                    return None
+                elif self.is_macro(value) and id(value) not in macros_seen:
+                    macros_seen.add(id(value))
+                    pending.append(value)
+            elif isinstance(expression, List) and expression is not nil:
+                if (expression.tail
+                        and isinstance(expression.head, Symbol)
+                        and self.global_scope.get(expression.head)
+                        is self.locals_builtin):
+                    # A call to locals with arguments only needs the
+                    # names in its arguments
+                    pending.extend(expression.tail)
+                else:
+                    pending.extend(expression)
+        return names
+
     def replace(self, bindings, expression):
         """Replaces names in expression with their values from bindings.
 
 Bindings is a dictionary; expression is any expression.
-Names that aren't in bindings are left untouched.
+Names that aren't in bindings are left untouched. Parts of expression
+that contain no bound names are shared with the result, not copied.
 """
-        if isinstance(expression, list):
+        if isinstance(expression, List):
             # An s-expression
-            return [self.replace(bindings, subexpr) for subexpr in expression]
+            cells = []
+            cell = expression
+            while cell:
+                cells.append(cell)
+                cell = cell.tail
+            items = [self.replace(bindings, cell.head) for cell in cells]
+            # Reuse the longest tail of the list in which nothing changed
+            index = len(cells)
+            while index > 0 and items[index - 1] is cells[index - 1].head:
+                index -= 1
+            result = cells[index] if index < len(cells) else nil
+            for item in reversed(items[:index]):
+                result = List(item, result)
+            return result
         elif isinstance(expression, Symbol) and expression in bindings:
             # A name that needs to be replaced
             return bindings[expression]
@@ -510,15 +807,112 @@ Names that aren't in bindings are left untouched.
             # A non-bound name or a literal
             return expression
 
+    def unparse(self, value):
+        """Return the unambiguous representation of a value as a str."""
+        return "".join(self.unparse_chunks(value))
+
+    def unparse_chunks(self, value):
+        """Yield the unambiguous representation of a value in pieces.
+
+Lists, hash maps and hash sets are unparsed iteratively, with the
+remaining items of each one that has been started kept on an explicit
+stack, so there is no limit on how deeply they can be nested.
+"""
+        # The remaining items of each collection that has been started
+        # but not finished, innermost last, with the text that ends it
+        unfinished = []
+        # Text that hasn't been yielded yet
+        pieces = []
+        while True:
+            if isinstance(value, List):
+                # Separate the items of a list with spaces and wrap them
+                # in parentheses
+                pieces.append("(")
+                unfinished.append((iter(value), ")"))
+                # The first item comes right after the parenthesis
+                separator = ""
+            elif isinstance(value, (HashMap, HashSet)):
+                # Hash maps and sets don't have a literal syntax; show
+                # them as the arguments that would build them
+                if isinstance(value, HashMap):
+                    pieces.append("<hash-map")
+                    items = chain.from_iterable(value.items())
+                else:
+                    pieces.append("<hash-set")
+                    items = iter(value)
+                unfinished.append((items, ">"))
+                separator = " "
+            else:
+                pieces.append(self.unparse_atom(value))
+                separator = " "
+            # Unparse items up to the next one that is a collection,
+            # finishing any collections that run out of items
+            while unfinished:
+                items, end = unfinished[-1]
+                for value in items:
+                    pieces.append(separator)
+                    separator = " "
+                    if isinstance(value, (List, HashMap, HashSet)):
+                        break
+                    elif type(value) is int:
+                        pieces.append(str(value))
+                    else:
+                        pieces.append(self.unparse_atom(value))
+                    if len(pieces) >= UNPARSE_CHUNK_SIZE:
+                        yield "".join(pieces)
+                        pieces.clear()
+                else:
+                    pieces.append(end)
+                    unfinished.pop()
+                    separator = " "
+                    continue
+                break
+            else:
+                yield "".join(pieces)
+                return
+            if len(pieces) >= UNPARSE_CHUNK_SIZE:
+                yield "".join(pieces)
+                pieces.clear()
+
+    def unparse_atom(self, value):
+        """Return the representation of a value that has no items."""
+        if type(value) is Builtin:
+            # A builtin function or macro can't be unparsed because it
+            # don't have a literal syntax, but at least return something
+            # that looks okay when displayed
+            builtin_type = "macro" if value.is_macro else "function"
+            return f"<builtin {builtin_type} {value.name}>"
+        elif isinstance(value, IntVector):
+            # Vectors don't have a literal syntax either
+            return " ".join(["<vector"] + [str(item) for item in value]) + ">"
+        elif isinstance(value, String):
+            # Wrap a string in double-quotes and escape special characters
+            python_repr = repr('\'"' + str(value))
+            result = python_repr[4:-1]
+            result = result.replace(r"\'", "'").replace('"', r'\"')
+            return '"' + result + '"'
+        else:
+            # Convert an integer or symbol to a string
+            return str(value)
+
     def display(self, value):
         """Output an unambiguous representation of a value."""
         if value is not None and not self.is_quiet:
-            print(self.tl_unparse(value))
+            output.stdout.writelines(self.unparse_chunks(value))
+            output.stdout.write("\n")
 
     def inform(self, *messages):
         """Output messages, but only in REPL mode."""
         if self.is_repl and not self.is_quiet:
-            print(*messages)
+            print(*messages, file=output.stdout)
+
+    def report_stats(self):
+        """Print performance counters to stderr."""
+        lookups = self.macro_hits + self.macro_misses
+        hit_rate = self.macro_hits / lookups if lookups else 0
+        print(f"Macro expansions: {self.macro_hits} cached, "
+              f"{self.macro_misses} computed ({hit_rate:.1%} hit rate)",
+              file=sys.stderr)
 
     def debug(self, *messages):
         """Output debug messages, but only in debug mode."""
@@ -528,13 +922,16 @@ Names that aren't in bindings are left untouched.
     @function
     @params(2)
     def tl_cons(self, head, tail):
-        if isinstance(tail, list):
+        if type(tail) is LazySeq:
+            # Prepend an item without forcing the rest of the list
+            return LazySeq.cons(head, tail)
+        elif isinstance(tail, List):
             # Prepend an item to a list
-            return [head] + tail
-        elif isinstance(tail, str):
+            return List(head, tail)
+        elif isinstance(tail, String):
             # Prepend a character code to a string
             if isinstance(head, int):
-                return chr(head) + tail
+                return tail.prepend(chr(head))
             else:
                 cfg.error("cannot cons", cfg.tl_type(head), "to String")
                 return nil
@@ -546,16 +943,16 @@ Names that aren't in bindings are left untouched.
     @function
     @params(1)
     def tl_head(self, val):
-        if isinstance(val, list):
-            if val == nil:
+        if isinstance(val, List):
+            if val is nil:
                 return nil
             else:
-                return val[0]
-        elif isinstance(val, str):
+                return val.head
+        elif isinstance(val, String):
             if val == "":
                 return nil
             else:
-                return ord(val[0])
+                return val.head
         else:
             cfg.error("cannot get head of", cfg.tl_type(val))
             return nil
@@ -563,24 +960,34 @@ Names that aren't in bindings are left untouched.
     @function
     @params(1)
     def tl_tail(self, val):
-        if isinstance(val, list):
-            if val == nil:
+        if isinstance(val, List):
+            if val is nil:
                 return nil
             else:
-                return val[1:]
-        elif isinstance(val, str):
+                return val.tail
+        elif isinstance(val, String):
             if val == "":
-                return ""
+                return val
             else:
-                return val[1:]
+                return val.tail
         else:
             cfg.error("cannot get tail of", cfg.tl_type(val))
             return nil
 
+    def add_two(self, arg1, arg2):
+        if type(arg1) is int and type(arg2) is int:
+            return arg1 + arg2
+        else:
+            return self.tl_add(arg1, arg2)
+
     @function
+    @two_args(add_two)
     @params(UNLIMITED)
     def tl_add(self, *args):
-        if len(args) == 1 and isinstance(args[0], list):
+        if len(args) == 1 and isinstance(args[0], IntVector):
+            # Given a single vector argument, sum it in one C loop
+            return sum(args[0].items)
+        elif len(args) == 1 and isinstance(args[0], List):
             # Given a single list argument, sum the list
             args = args[0]
         result = 0
@@ -592,7 +999,14 @@ Names that aren't in bindings are left untouched.
                 return nil
         return result
 
+    def sub_two(self, arg1, arg2):
+        if type(arg1) is int and type(arg2) is int:
+            return arg1 - arg2
+        else:
+            return self.tl_sub(arg1, arg2)
+
     @function
+    @two_args(sub_two)
     @params(UNLIMITED)
     def tl_sub(self, *args):
         if len(args) == 0:
@@ -620,7 +1034,10 @@ Names that aren't in bindings are left untouched.
     @function
     @params(UNLIMITED)
     def tl_mul(self, *args):
-        if len(args) == 1 and isinstance(args[0], list):
+        if len(args) == 1 and isinstance(args[0], IntVector):
+            # Given a single vector argument, multiply it in one C loop
+            return prod(args[0].items)
+        elif len(args) == 1 and isinstance(args[0], List):
             # Given a single list argument, take the product of the list
             args = args[0]
         result = 1
@@ -665,7 +1082,14 @@ Names that aren't in bindings are left untouched.
                       cfg.tl_type(arg2))
             return nil
 
+    def less_two(self, arg1, arg2):
+        if type(arg1) is int and type(arg2) is int:
+            return int(arg1 < arg2)
+        else:
+            return self.tl_less(arg1, arg2)
+
     @function
+    @two_args(less_two)
     @params(1, UNLIMITED)
     def tl_less(self, *args):
         result = True
@@ -678,7 +1102,11 @@ Names that aren't in bindings are left untouched.
                 return nil
         return int(result)
 
+    def equal_two(self, arg1, arg2):
+        return int(arg1 == arg2)
+
     @function
+    @two_args(equal_two)
     @params(1, UNLIMITED)
     def tl_equal(self, *args):
         result = True
@@ -698,52 +1126,58 @@ Names that aren't in bindings are left untouched.
 
     @function
     @params(1)
-    def tl_unparse(self, value):
-        if isinstance(value, list):
-            # Join items of a list on space and wrap in parentheses
-            first_item = True
-            result = "("
-            for item in value:
-                if first_item:
-                    first_item = False
-                else:
-                    result += " "
-                result += self.tl_unparse(item)
-            result += ")"
-        elif value in self.builtins:
-            # A builtin function or macro can't be unparsed because it
-            # don't have a literal syntax, but at least return something
-            # that looks okay when displayed
-            builtin_type = "macro" if value.is_macro else "function"
-            result = f"<builtin {builtin_type} {value.name}>"
-        elif isinstance(value, str):
-            # Wrap a string in double-quotes and escape special characters
-            python_repr = repr('\'"' + value)
-            result = python_repr[4:-1]
-            result = result.replace(r"\'", "'").replace('"', r'\"')
-            result = '"' + result + '"'
+    def tl_force(self, value):
+        if type(value) is LazySeq:
+            # Produce all the items and put them in an ordinary List
+            return List.from_iterable(value)
         else:
-            # Convert an integer or symbol to a string
-            result = str(value)
-        return result
+            return value
+
+    @function
+    @params(1)
+    def tl_unparse(self, value):
+        return String(self.unparse(value))
+
+    @function
+    @params(1)
+    def tl_parse(self, code):
+        # Return the first expression in the code, unevaluated, or nil if
+        # there isn't one
+        if not isinstance(code, String):
+            cfg.error("parse requires String, not", cfg.tl_type(code))
+            return nil
+        try:
+            for expr in parse(str(code)):
+                return expr
+        except SyntaxError as err:
+            cfg.error(err.msg)
+        return nil
 
     @function
     @quiet
     @params(UNLIMITED)
     def tl_write(self, *vals):
         for val in vals:
-            if isinstance(val, str):
+            if isinstance(val, String):
                 # Write strings without surrounding quotes
-                cfg.write(val)
+                cfg.write(str(val))
             else:
                 # Write other values the same as their unparsed format
-                cfg.write(self.tl_unparse(val))
+                output.stdout.writelines(self.unparse_chunks(val))
         return nil
 
     @function
-    @params(0)
-    def tl_locals(self):
-        return [[name, val] for name, val in self.current_scope.items()]
+    @params(0, 2)
+    def tl_locals(self, body=None, param_names=nil):
+        scope = self.current_scope
+        if body is not None:
+            # Only return the names that a function with this body and
+            # these parameters could refer to
+            names = self.local_names_used(body, param_names, scope)
+            if names is not None:
+                scope = {name: val for name, val in scope.items()
+                         if name in names}
+        return Environment.from_bindings(scope)
 
     @function
     @params(1)
@@ -757,11 +1191,19 @@ Names that aren't in bindings are left untouched.
     @params(2)
     def tl_def(self, name, value):
         if isinstance(name, Symbol):
-            if name in self.global_scope:
+            if self.is_global_name(name):
                 cfg.error("name", name, "already in use")
                 return nil
             else:
-                self.global_scope[name] = self.evaluate(value)
+                value = self.evaluate(value)
+                if (self.native_library
+                        and self.has_native_version(name.name)
+                        and self.module_paths[-1]
+                        == listlib.LIBRARY_DIRECTORY):
+                    # Replace a core library function with its native
+                    # version
+                    value = self.native_function(name.name, value)
+                self.bind_global(name, value)
                 return name
         else:
             cfg.error("def expected Symbol, not", cfg.tl_type(name))
@@ -783,39 +1225,65 @@ Names that aren't in bindings are left untouched.
     @top_level_only
     @params(1)
     def tl_load(self, module):
-        if isinstance(module, Symbol):
+        if isinstance(module, (Symbol, String)):
             module = str(module)
         if not isinstance(module, str):
             cfg.error("load requires module name, not", cfg.tl_type(module))
             return nil
         if not module.endswith(".tl"):
             module += ".tl"
-        abspath = os.path.abspath(os.path.join(self.module_paths[-1], module))
-        module_directory, module_name = os.path.split(abspath)
+        abspath = autoload.module_path(self.module_paths[-1], module)
         if abspath not in self.modules:
             # Module has not already been loaded
-            try:
-                with open(abspath) as f:
-                    module_code = f.read()
-            except (FileNotFoundError, IOError):
-                cfg.error("could not load", module_name,
-                          "from", module_directory)
-                return nil
-            else:
-                # Add the module to the list of loaded modules
-                self.modules.append(abspath)
-                # Push the module's directory to the stack of module
-                # directories--this allows relative paths in load calls
-                # from within the module
-                self.module_paths.append(module_directory)
-                # Execute the module code
-                self.execute(module_code)
-                # Put everything back the way it was before loading
-                self.module_paths.pop()
+            if self.load_module(abspath):
                 self.inform("Loaded", module)
+            else:
+                return nil
         else:
             self.inform("Already loaded", module)
 
+    def load_module(self, abspath):
+        """Load the module at an absolute path.
+
+Return False if the module can't be read.
+"""
+        module_directory, module_name = os.path.split(abspath)
+        # The module's names are no longer waiting to be loaded; until
+        # it defines them, they are undefined, just as if the whole
+        # library were being loaded
+        for name, path in list(self.autoload_index.items()):
+            if path == abspath:
+                del self.autoload_index[name]
+        try:
+            with open(abspath) as f:
+                module_code = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime_ns
+        except (FileNotFoundError, IOError):
+            cfg.error("could not load", module_name,
+                      "from", module_directory)
+            return False
+        # Add the module to the list of loaded modules
+        self.modules.append(abspath)
+        # Push the module's directory to the stack of module
+        # directories--this allows relative paths in load calls
+        # from within the module
+        self.module_paths.append(module_directory)
+        # Execute the module code, using its cached parse if it
+        # has an up-to-date one
+        expressions = None
+        if self.module_cache:
+            expressions = modulecache.read(abspath, mtime, module_code)
+        if expressions is not None:
+            for expr in expressions:
+                self.execute_expression(expr)
+        else:
+            self.execute(module_code)
+            if self.module_cache:
+                modulecache.write(abspath, mtime, module_code)
+        # Put everything back the way it was before loading
+        self.module_paths.pop()
+        return True
+
     @macro
     @top_level_only
     @params(UNLIMITED)
@@ -833,7 +1301,9 @@ Names that aren't in bindings are left untouched.
     @params(0)
     def tl_restart(self):
         self.inform("Restarting...")
-        self.__init__(is_repl=self.is_repl)
+        # With an image, this restores the library from it instead of
+        # loading it again
+        self.__init__(is_repl=self.is_repl, options=self.options)
 
     @macro
     @repl_only
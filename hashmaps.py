@@ -0,0 +1,164 @@
+
+from cfg import nil, UNLIMITED
+import cfg
+from datatypes import List, String, HashMap, HashSet
+from builtin import function, params
+
+
+# Built-in functions for hash maps and hash sets
+# Key = implementation name; value = tinylisp name
+
+builtins = {
+    "tl_hash_map": "hash-map",
+    "tl_hash_set": "hash-set",
+    "tl_to_hash_map": "to-hash-map",
+    "tl_to_hash_set": "to-hash-set",
+    "tl_hash_get": "hash-get",
+    "tl_hash_has": "hash-has?",
+    "tl_hash_insert": "hash-insert",
+    "tl_hash_delete": "hash-delete",
+    "tl_hash_size": "hash-size",
+    "tl_hash_keys": "hash-keys",
+    "tl_hash_values": "hash-values",
+    "tl_hash_items": "hash-items",
+    }
+
+
+def is_hash_collection(value):
+    return isinstance(value, (HashMap, HashSet))
+
+
+class HashBuiltins:
+    """Builtins that create and use hash maps and hash sets."""
+
+    @function
+    @params(UNLIMITED)
+    def tl_hash_map(self, *args):
+        if len(args) % 2 == 1:
+            cfg.error("hash-map requires an even number of arguments, not",
+                      len(args))
+            return nil
+        return HashMap.from_items(zip(args[::2], args[1::2]))
+
+    @function
+    @params(UNLIMITED)
+    def tl_hash_set(self, *args):
+        return HashSet.from_iterable(args)
+
+    @function
+    @params(1)
+    def tl_to_hash_map(self, pairs):
+        if isinstance(pairs, HashMap):
+            return pairs
+        elif isinstance(pairs, List):
+            for pair in pairs:
+                if not (isinstance(pair, List) and len(pair) == 2):
+                    cfg.error("to-hash-map requires a List of "
+                              "(key value) pairs")
+                    return nil
+            return HashMap.from_items(pairs)
+        else:
+            cfg.error("cannot convert", cfg.tl_type(pairs), "to HashMap")
+            return nil
+
+    @function
+    @params(1)
+    def tl_to_hash_set(self, seq):
+        if isinstance(seq, HashSet):
+            return seq
+        elif isinstance(seq, List):
+            return HashSet.from_iterable(seq)
+        elif isinstance(seq, String):
+            # Like head, treat a string as its character codes
+            return HashSet.from_iterable(map(ord, str(seq)))
+        else:
+            cfg.error("cannot convert", cfg.tl_type(seq), "to HashSet")
+            return nil
+
+    @function
+    @params(2, 3)
+    def tl_hash_get(self, hash_map, key, default=nil):
+        if isinstance(hash_map, HashMap):
+            return hash_map.get(key, default)
+        else:
+            cfg.error("hash-get requires a HashMap, not",
+                      cfg.tl_type(hash_map))
+            return nil
+
+    @function
+    @params(2)
+    def tl_hash_has(self, collection, key):
+        if is_hash_collection(collection):
+            return int(collection.contains(key))
+        else:
+            cfg.error("hash-has? requires a HashMap or HashSet, not",
+                      cfg.tl_type(collection))
+            return nil
+
+    @function
+    @params(2, 3)
+    def tl_hash_insert(self, collection, key, *value):
+        if isinstance(collection, HashMap):
+            if not value:
+                cfg.error("hash-insert into a HashMap requires a value")
+                return nil
+            return collection.insert(key, value[0])
+        elif isinstance(collection, HashSet):
+            if value:
+                cfg.error("hash-insert into a HashSet takes no value")
+                return nil
+            return collection.insert(key)
+        else:
+            cfg.error("hash-insert requires a HashMap or HashSet, not",
+                      cfg.tl_type(collection))
+            return nil
+
+    @function
+    @params(2)
+    def tl_hash_delete(self, collection, key):
+        if is_hash_collection(collection):
+            return collection.delete(key)
+        else:
+            cfg.error("hash-delete requires a HashMap or HashSet, not",
+                      cfg.tl_type(collection))
+            return nil
+
+    @function
+    @params(1)
+    def tl_hash_size(self, collection):
+        if is_hash_collection(collection):
+            return len(collection)
+        else:
+            cfg.error("hash-size requires a HashMap or HashSet, not",
+                      cfg.tl_type(collection))
+            return nil
+
+    @function
+    @params(1)
+    def tl_hash_keys(self, collection):
+        if is_hash_collection(collection):
+            return List.from_iterable(collection.keys())
+        else:
+            cfg.error("hash-keys requires a HashMap or HashSet, not",
+                      cfg.tl_type(collection))
+            return nil
+
+    @function
+    @params(1)
+    def tl_hash_values(self, hash_map):
+        if isinstance(hash_map, HashMap):
+            return List.from_iterable(value for _, value in hash_map.items())
+        else:
+            cfg.error("hash-values requires a HashMap, not",
+                      cfg.tl_type(hash_map))
+            return nil
+
+    @function
+    @params(1)
+    def tl_hash_items(self, hash_map):
+        if isinstance(hash_map, HashMap):
+            return List.from_pairs(hash_map.items())
+        else:
+            cfg.error("hash-items requires a HashMap, not",
+                      cfg.tl_type(hash_map))
+            return nil
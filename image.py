@@ -0,0 +1,169 @@
+
+import os
+import io
+import pickle
+import hashlib
+import tempfile
+
+from builtin import Builtin
+import listlib
+
+
+# Change this whenever the layout of an image changes, so old images
+# get rebuilt
+IMAGE_FORMAT_VERSION = 2
+
+# Images that have been read or written, by path, with the stat of the
+# file they came from, so that restarting doesn't read the file again
+loaded_images = {}
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def image_key(program):
+    """What must match for an image to be used by a Program.
+
+Images depend on which parts of the library get loaded, on the
+builtins that the saved values may refer to, and on which library
+functions get native versions (the stack engine leaves out some).
+"""
+    options = program.options
+    natives = [name for name in listlib.natives
+               if program.has_native_version(name)]
+    return (getattr(options, "no_library", False),
+            getattr(options, "no_short_names", False),
+            getattr(options, "no_autoload", False),
+            program.native_library,
+            tuple(sorted(program.builtins)),
+            tuple(sorted(natives)))
+
+
+class ImagePickler(pickle.Pickler):
+    """Pickle a Program's state, saving builtins by name.
+
+Builtins are bound to the Program that made them, so they can't be
+pickled; instead, a builtin is saved as its implementation name, and
+a native library function as its name and tinylisp definition.
+"""
+
+    def __init__(self, file, program):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.program = program
+        self.builtin_names = {id(builtin): name
+                              for name, builtin in program.builtins.items()}
+
+    def persistent_id(self, obj):
+        if type(obj) is not Builtin:
+            return None
+        elif id(obj) in self.builtin_names:
+            return ("builtin", self.builtin_names[id(obj)])
+        elif (obj.tl_name in listlib.natives and obj.name == obj.tl_name
+                and obj.tl_name in self.program.native_definitions):
+            return ("native", obj.tl_name,
+                    self.program.native_definitions[obj.tl_name])
+        else:
+            raise pickle.PicklingError(f"can't save {obj!r} in an image")
+
+
+class ImageUnpickler(pickle.Unpickler):
+    """Unpickle a Program's state, linking builtins to the Program."""
+
+    def __init__(self, file, program):
+        super().__init__(file)
+        self.program = program
+
+    def persistent_load(self, pid):
+        if pid[0] == "builtin":
+            return self.program.builtins[pid[1]]
+        elif pid[0] == "native":
+            _, name, definition = pid
+            return self.program.native_function(name, definition)
+        else:
+            raise pickle.UnpicklingError(f"unknown persistent id {pid!r}")
+
+
+def modules_unchanged(modules):
+    """Are the module files an image was built from still the same?"""
+    for path, mtime, digest in modules:
+        try:
+            if (os.stat(path).st_mtime_ns != mtime
+                    and file_hash(path) != digest):
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def restore(program, path):
+    """Restore a Program's global state from the image at path.
+
+Return True if the image was restored, or False if there is no image
+there or it is out of date.
+"""
+    try:
+        stat = os.stat(path)
+        cached = loaded_images.get(path)
+        if cached is not None and cached[0] == (stat.st_mtime_ns,
+                                                stat.st_size):
+            data = cached[1]
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+        header, state = ImageUnpickler(io.BytesIO(data), program).load()
+    except Exception:
+        # Missing, unreadable, or corrupt
+        program.native_definitions.clear()
+        return False
+    if (header != (IMAGE_FORMAT_VERSION, image_key(program))
+            or not modules_unchanged(state["modules"])):
+        program.native_definitions.clear()
+        return False
+    loaded_images[path] = ((stat.st_mtime_ns, stat.st_size), data)
+    program.global_scope = state["global_scope"]
+    program.modules = state["loaded"]
+    program.autoload_index = state["autoload_index"]
+    program.autoload_files = state["autoload_files"]
+    return True
+
+
+def save(program, path):
+    """Save a Program's global state as an image at path.
+
+Give up quietly if the image can't be written; the Program then just
+loads the library itself next time.
+"""
+    try:
+        # The image depends on the modules that have been loaded and on
+        # those that the autoload index came from
+        paths = list(dict.fromkeys(program.modules + program.autoload_files))
+        modules = [(path, os.stat(path).st_mtime_ns, file_hash(path))
+                   for path in paths]
+        state = {
+            "global_scope": program.global_scope,
+            "loaded": program.modules,
+            "autoload_index": program.autoload_index,
+            "autoload_files": program.autoload_files,
+            "modules": modules,
+            }
+        buffer = io.BytesIO()
+        header = (IMAGE_FORMAT_VERSION, image_key(program))
+        ImagePickler(buffer, program).dump((header, state))
+        data = buffer.getvalue()
+        directory = os.path.dirname(os.path.abspath(path))
+        # Write a temporary file and move it into place, so that another
+        # process never reads a half-written image
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        stat = os.stat(path)
+    except (OSError, pickle.PicklingError, RecursionError):
+        return
+    loaded_images[path] = ((stat.st_mtime_ns, stat.st_size), data)
@@ -0,0 +1,160 @@
+
+import os
+import sys
+
+from cfg import nil
+import cfg
+import output
+from datatypes import LazySeq, String
+from builtin import function, params
+
+
+# Built-in functions for reading input from stdin and from files
+# Key = implementation name; value = tinylisp name
+
+builtins = {
+    "tl_read_line": "read-line",
+    "tl_read_lines": "read-lines",
+    "tl_read_all": "read-all",
+    "tl_read_ints": "read-ints",
+    }
+
+# Files are read through a buffer of this many bytes, and read-ints
+# reads at most this many characters at a time
+INPUT_BUFFER_SIZE = 1024 * 1024
+
+
+def strip_newline(line):
+    return line[:-1] if line.endswith("\n") else line
+
+
+class InputBuiltins:
+    """Builtins that read text from stdin or from files.
+
+Each of them takes an optional file name; without one, they read from
+stdin. A file is opened the first time it is read from, and stays open,
+so each read carries on from where the last one left off. Reading goes
+through a large buffer, a line or a chunk at a time, so going through a
+huge file line by line (with read-line, or by recursing down the list
+from read-lines) only needs memory for the current line.
+
+When the program itself comes from stdin, reading from stdin carries on
+from the line after the one the program has got to, so data can follow
+the code.
+"""
+
+    def input_file(self, builtin_name, filename):
+        """Return the open file to read from, or None after an error."""
+        if filename is None:
+            # Anything written so far should show up before waiting for
+            # input, especially a prompt
+            output.stdout.flush()
+            return sys.stdin
+        elif not isinstance(filename, String):
+            cfg.error(builtin_name, "requires a file name String, not",
+                      cfg.tl_type(filename))
+            return None
+        path = os.path.abspath(str(filename))
+        file = self.input_files.get(path)
+        if file is None:
+            try:
+                file = open(path, buffering=INPUT_BUFFER_SIZE)
+            except FileNotFoundError:
+                cfg.error("could not find", filename)
+                return None
+            except PermissionError:
+                cfg.error("insufficient permissions to read", filename)
+                return None
+            except OSError:
+                cfg.error("could not read", filename)
+                return None
+            self.input_files[path] = file
+        return file
+
+    @function
+    @params(0, 1)
+    def tl_read_line(self, filename=None):
+        file = self.input_file("read-line", filename)
+        if file is None:
+            return nil
+        try:
+            line = file.readline()
+        except (OSError, UnicodeDecodeError) as err:
+            cfg.error("could not read input:", err)
+            return nil
+        if line:
+            return String(strip_newline(line))
+        else:
+            # At the end of the input
+            return nil
+
+    @function
+    @params(0, 1)
+    def tl_read_lines(self, filename=None):
+        file = self.input_file("read-lines", filename)
+        if file is None:
+            return nil
+        return LazySeq.from_iterator(self.lines_from(file))
+
+    def lines_from(self, file):
+        """Yield the rest of the lines of a file as Strings."""
+        while True:
+            try:
+                line = file.readline()
+            except (OSError, UnicodeDecodeError) as err:
+                cfg.error("could not read input:", err)
+                return
+            if not line:
+                return
+            yield String(strip_newline(line))
+
+    @function
+    @params(0, 1)
+    def tl_read_all(self, filename=None):
+        file = self.input_file("read-all", filename)
+        if file is None:
+            return nil
+        try:
+            return String(file.read())
+        except (OSError, UnicodeDecodeError) as err:
+            cfg.error("could not read input:", err)
+            return nil
+
+    @function
+    @params(0, 1)
+    def tl_read_ints(self, filename=None):
+        file = self.input_file("read-ints", filename)
+        if file is None:
+            return nil
+        return LazySeq.from_iterator(self.ints_from(file))
+
+    def ints_from(self, file):
+        """Yield the whitespace-separated integers in the rest of a file.
+
+The file is read a line at a time (or a large chunk of a line, if it is
+very long), so a later read from the same file starts at the line after
+the last integer taken.
+"""
+        # The start of a token that was cut off at the end of a chunk
+        partial = ""
+        while True:
+            try:
+                chunk = file.readline(INPUT_BUFFER_SIZE)
+            except (OSError, UnicodeDecodeError) as err:
+                cfg.error("could not read input:", err)
+                return
+            text = partial + chunk
+            tokens = text.split()
+            if chunk and tokens and not text[-1].isspace():
+                partial = tokens.pop()
+            else:
+                partial = ""
+            for token in tokens:
+                try:
+                    value = int(token)
+                except ValueError:
+                    cfg.error("read-ints expected an integer, not", token)
+                    return
+                yield value
+            if not chunk:
+                return
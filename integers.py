@@ -0,0 +1,314 @@
+
+import math
+from functools import reduce
+
+from cfg import nil, UNLIMITED
+import cfg
+from datatypes import List, String
+from builtin import function, params
+
+
+# Built-in functions for integer arithmetic and number theory
+# Key = implementation name; value = tinylisp name
+
+builtins = {
+    "tl_isqrt": "isqrt",
+    "tl_pow_mod": "pow-mod",
+    "tl_gcd": "gcd",
+    "tl_lcm": "lcm",
+    "tl_divmod": "divmod",
+    "tl_bit_and": "bit-and",
+    "tl_bit_or": "bit-or",
+    "tl_bit_xor": "bit-xor",
+    "tl_bit_not": "bit-not",
+    "tl_shift_left": "shift-left",
+    "tl_shift_right": "shift-right",
+    "tl_int_prime": "int-prime?",
+    "tl_int_to_base": "int-to-base",
+    "tl_int_from_base": "int-from-base",
+    }
+
+SMALL_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
+# Miller-Rabin with each of SMALL_PRIMES as a base gives the right
+# answer for every number below this
+MILLER_RABIN_LIMIT = 3_317_044_064_679_887_385_961_981
+
+
+def is_prime(num):
+    """Test whether num is prime.
+
+Below MILLER_RABIN_LIMIT, the test is deterministic. Above it, this is
+the Baillie-PSW test (Miller-Rabin base 2 plus a strong Lucas test),
+which has no known counterexamples.
+"""
+    if num < 2:
+        return False
+    for prime in SMALL_PRIMES:
+        if num % prime == 0:
+            return num == prime
+    if num < MILLER_RABIN_LIMIT:
+        return all(miller_rabin(num, base) for base in SMALL_PRIMES)
+    else:
+        return miller_rabin(num, 2) and strong_lucas(num)
+
+
+def miller_rabin(num, base):
+    """Is odd num > 2 a strong probable prime to the given base?"""
+    odd_part = num - 1
+    twos = 0
+    while odd_part % 2 == 0:
+        odd_part //= 2
+        twos += 1
+    x = pow(base, odd_part, num)
+    if x == 1 or x == num - 1:
+        return True
+    for _ in range(twos - 1):
+        x = x * x % num
+        if x == num - 1:
+            return True
+    return False
+
+
+def strong_lucas(num):
+    """Is odd num > 2 a strong Lucas probable prime?
+
+Uses Selfridge's method A to choose the parameters.
+"""
+    root = math.isqrt(num)
+    if root * root == num:
+        # Perfect squares never have a suitable d
+        return False
+    d = 5
+    while jacobi(d, num) != -1:
+        d = -d - 2 if d > 0 else -d + 2
+    p = 1
+    q = (1 - d) // 4
+    odd_part = num + 1
+    twos = 0
+    while odd_part % 2 == 0:
+        odd_part //= 2
+        twos += 1
+    # Compute U and V of index odd_part by binary expansion, from the
+    # top bit down
+    u, v, q_power = 1, p, q
+    for bit in bin(odd_part)[3:]:
+        u, v = u * v % num, (v * v - 2 * q_power) % num
+        q_power = q_power * q_power % num
+        if bit == "1":
+            u, v = halve(p * u + v, num), halve(d * u + p * v, num)
+            q_power = q_power * q % num
+    if u == 0 or v == 0:
+        return True
+    for _ in range(twos - 1):
+        v = (v * v - 2 * q_power) % num
+        q_power = q_power * q_power % num
+        if v == 0:
+            return True
+    return False
+
+
+def halve(value, num):
+    """Divide value by 2 modulo odd num."""
+    if value % 2:
+        value += num
+    return value // 2 % num
+
+
+def jacobi(a, n):
+    """The Jacobi symbol (a/n), for odd positive n."""
+    a %= n
+    result = 1
+    while a:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 in (3, 5):
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    return result if n == 1 else 0
+
+
+def digits_in_base(num, base):
+    """The digits of positive num in base >= 2, most significant first."""
+    if base == 10:
+        try:
+            return [int(digit) for digit in str(num)]
+        except ValueError:
+            # Too many digits for Python's int-to-str conversion
+            pass
+    elif base in (2, 8, 16):
+        return [int(digit, base) for digit in format(num, "box"[base // 8])]
+    digits = []
+    while num:
+        num, digit = divmod(num, base)
+        digits.append(digit)
+    digits.reverse()
+    return digits
+
+
+class IntegerBuiltins:
+    """Builtins for integer arithmetic, number theory, and bits."""
+
+    def check_ints(self, name, args):
+        """Return True if all the args are integers.
+
+Otherwise, give an error message and return False.
+"""
+        for arg in args:
+            if not isinstance(arg, int):
+                cfg.error(name, "requires Integers, not", cfg.tl_type(arg))
+                return False
+        return True
+
+    @function
+    @params(1)
+    def tl_isqrt(self, num):
+        if not self.check_ints("isqrt", [num]):
+            return nil
+        elif num < 0:
+            cfg.error("cannot take square root of negative number")
+            return nil
+        else:
+            return math.isqrt(num)
+
+    @function
+    @params(3)
+    def tl_pow_mod(self, base, exponent, modulus):
+        if not self.check_ints("pow-mod", [base, exponent, modulus]):
+            return nil
+        elif modulus == 0:
+            cfg.error("mod by zero")
+            return nil
+        try:
+            return pow(base, exponent, modulus)
+        except ValueError:
+            # Negative exponent, but base has no inverse mod modulus
+            cfg.error(base, "is not invertible mod", modulus)
+            return nil
+
+    @function
+    @params(UNLIMITED)
+    def tl_gcd(self, *args):
+        if not self.check_ints("gcd", args):
+            return nil
+        return reduce(math.gcd, args, 0)
+
+    @function
+    @params(UNLIMITED)
+    def tl_lcm(self, *args):
+        if not self.check_ints("lcm", args):
+            return nil
+
+        def lcm(a, b):
+            if a == 0 or b == 0:
+                return 0
+            return abs(a * b) // math.gcd(a, b)
+
+        return reduce(lcm, args, 1)
+
+    @function
+    @params(2)
+    def tl_divmod(self, arg1, arg2):
+        if not self.check_ints("divmod", [arg1, arg2]):
+            return nil
+        elif arg2 == 0:
+            cfg.error("division by zero")
+            return nil
+        else:
+            # Rounds the same way as / and mod
+            return List.from_iterable(divmod(arg1, arg2))
+
+    @function
+    @params(UNLIMITED)
+    def tl_bit_and(self, *args):
+        if not self.check_ints("bit-and", args):
+            return nil
+        return reduce(lambda a, b: a & b, args, -1)
+
+    @function
+    @params(UNLIMITED)
+    def tl_bit_or(self, *args):
+        if not self.check_ints("bit-or", args):
+            return nil
+        return reduce(lambda a, b: a | b, args, 0)
+
+    @function
+    @params(UNLIMITED)
+    def tl_bit_xor(self, *args):
+        if not self.check_ints("bit-xor", args):
+            return nil
+        return reduce(lambda a, b: a ^ b, args, 0)
+
+    @function
+    @params(1)
+    def tl_bit_not(self, num):
+        if not self.check_ints("bit-not", [num]):
+            return nil
+        return ~num
+
+    @function
+    @params(2)
+    def tl_shift_left(self, num, count):
+        if not self.check_ints("shift-left", [num, count]):
+            return nil
+        elif count < 0:
+            cfg.error("negative shift count")
+            return nil
+        else:
+            return num << count
+
+    @function
+    @params(2)
+    def tl_shift_right(self, num, count):
+        if not self.check_ints("shift-right", [num, count]):
+            return nil
+        elif count < 0:
+            cfg.error("negative shift count")
+            return nil
+        else:
+            # Rounds toward negative infinity, like /
+            return num >> count
+
+    @function
+    @params(1)
+    def tl_int_prime(self, num):
+        if not self.check_ints("int-prime?", [num]):
+            return nil
+        return int(is_prime(num))
+
+    @function
+    @params(2)
+    def tl_int_to_base(self, base, num):
+        if not self.check_ints("int-to-base", [base, num]):
+            return nil
+        elif base < 2:
+            cfg.error("int-to-base requires base of at least 2, not", base)
+            return nil
+        elif num <= 0:
+            # There are no digits, as with to-base
+            return nil
+        else:
+            return List.from_iterable(digits_in_base(num, base))
+
+    @function
+    @params(2, 3)
+    def tl_int_from_base(self, base, digits, accum=0):
+        if not self.check_ints("int-from-base", [base, accum]):
+            return nil
+        elif isinstance(digits, String):
+            # Like head, treat a string as its character codes
+            digits = map(ord, str(digits))
+        elif not isinstance(digits, List):
+            cfg.error("int-from-base requires List of digits, not",
+                      cfg.tl_type(digits))
+            return nil
+        for digit in digits:
+            if not isinstance(digit, int):
+                cfg.error("int-from-base requires Integer digits, not",
+                          cfg.tl_type(digit))
+                return nil
+            accum = accum * base + digit
+        return accum
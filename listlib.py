@@ -0,0 +1,495 @@
+
+import os
+from itertools import chain, repeat
+
+from cfg import nil, Symbol, UNLIMITED
+import cfg
+from datatypes import List, LazySeq, Environment, String, structural_key
+from builtin import function, params, Builtin
+from integers import is_prime, digits_in_base
+
+
+# Core library functions that have native versions
+# Key = tinylisp name; value = implementation name
+
+natives = {
+    "length": "native_length",
+    "nth": "native_nth",
+    "reverse-onto": "native_reverse_onto",
+    "reverse": "native_reverse",
+    "concat": "native_concat",
+    "take": "native_take",
+    "drop": "native_drop",
+    "contains?": "native_contains",
+    "first-index": "native_first_index",
+    "count-up": "native_count_up",
+    "count-down": "native_count_down",
+    "range": "native_range",
+    "repeat": "native_repeat",
+    "zip": "native_zip",
+    "unique": "native_unique",
+    "map-backwards": "native_map_backwards",
+    "map": "native_map",
+    "filter": "native_filter",
+    "take-while": "native_take_while",
+    "foldl": "native_foldl",
+    "abs": "native_abs",
+    "sign": "native_sign",
+    "minimum": "native_minimum",
+    "min": "native_min",
+    "maximum": "native_maximum",
+    "max": "native_max",
+    "prime?": "native_prime",
+    "to-base": "native_to_base",
+    "from-base": "native_from_base",
+    }
+
+# The natives that call back into tinylisp code, by tinylisp name
+calls_back = {"map-backwards", "map", "filter", "take-while", "foldl"}
+
+# The callbacks of map-backwards, map, filter, take-while, and foldl
+# are evaluated the same way as in their tinylisp versions: as these
+# expressions, in a scope with the same local names
+FUNC = Symbol("func")
+SEQ = Symbol("seq")
+ACCUM = Symbol("accum")
+CALL_ON_HEAD = List(FUNC, List(List(Symbol("head"), List(SEQ, nil)), nil))
+CALL_ON_ACCUM_AND_HEAD = List(FUNC, List(ACCUM, CALL_ON_HEAD.tail))
+
+# Only definitions made while loading modules from this directory get
+# replaced, so user code can still define these names for itself
+LIBRARY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "lib", "core")
+
+
+def param_counts(param_names):
+    """Return the min and max arg counts and the names of a param list."""
+    if isinstance(param_names, Symbol):
+        return 0, UNLIMITED, [param_names]
+    min_count = 0
+    names = []
+    for param in param_names:
+        if isinstance(param, List):
+            # A (name default) pair
+            names.append(param.head)
+        else:
+            names.append(param)
+            min_count = len(names)
+    return min_count, len(names), names
+
+
+def is_sequence(value):
+    return isinstance(value, (List, String))
+
+
+def items(seq):
+    """The items of a List, or the character codes of a String."""
+    if isinstance(seq, String):
+        return map(ord, str(seq))
+    else:
+        return iter(seq)
+
+
+def same_kind(seq, values):
+    """Put values in the same kind of sequence as seq, like empty does."""
+    if isinstance(seq, String):
+        return String("".join(map(chr, values)))
+    else:
+        return List.from_iterable(values)
+
+
+def tie_knot(name, definition):
+    """Give a top-level function a local binding of its name to itself.
+
+Recursive calls in the returned function's body are then tail calls to
+the function itself, rather than calls to a native version bound to the
+same global name, which would each use up Python stack.
+"""
+    if definition.length != 3 or definition.head is not nil:
+        # A macro, or a function that already has an environment
+        return definition
+    value_cell = List(nil, nil)
+    environment = Environment(List(Symbol(name), value_cell), nil)
+    function = List(environment, definition.tail)
+    # The cells are new and nothing else can see them yet, so the cycle
+    # can be closed without changing any List in use
+    value_cell.head = function
+    environment.bindings = {Symbol(name): function}
+    return function
+
+
+def prepend(values, seq):
+    """Cons each of the values in turn onto a List."""
+    for value in values:
+        seq = List(value, seq)
+    return seq
+
+
+class ListLibrary:
+    """Native versions of the core library's list and math functions.
+
+Some of them are lazy: count-up, count-down, range, and repeat always
+return a LazySeq, and map, filter, take-while, and zip return one when
+given one. A lazy map or filter evaluates its callback on each item
+when that item is first needed (with accum bound to nil), so pipelines
+of them over long ranges use constant memory. Any output or errors from
+the callback come then too, rather than when the lazy list is made.
+
+When the core library is loaded with native functions turned on, def
+binds each name in natives to a builtin that runs the Python version of
+the function instead of its tinylisp definition. The definition is kept,
+and the builtin falls back to it whenever the Python version doesn't
+handle the arguments (the wrong number of them, sequences that aren't
+Lists or Strings, and so on) or one of the definition's parameter names
+shadows a global name, so errors and warnings are the same either way.
+A native version returns NotImplemented to fall back.
+
+The functions themselves are builtins, though, not Lists: they unparse
+as <builtin function name> and can't be taken apart with head and tail.
+The builtin for map, which is a macro in the library, evaluates its args
+even when there are the wrong number of them.
+"""
+
+    def has_native_version(self, name):
+        """Should def replace this core library function with a builtin?"""
+        return name in natives
+
+    def native_function(self, name, definition):
+        """Return a builtin that runs the native version of a function.
+
+The definition can also be a macro whose params all begin with &, like
+map's; the builtin is then a function, which gives the same results,
+since the macro just passes its args on to functions. If the definition
+is neither, return it unchanged.
+"""
+        if not (isinstance(definition, List)
+                and definition.length in (2, 3)):
+            return definition
+        self.native_definitions[name] = definition
+        fallback = tie_knot(name, definition)
+        implementation = getattr(self, natives[name])
+        min_count, max_count, _ = param_counts(definition[-2])
+        global_count = None
+        param_names = None
+
+        def native(*args):
+            nonlocal global_count, param_names
+            if global_count != len(self.global_scope):
+                # Global names are only ever added, so the names only
+                # need finding again when there are more of them
+                param_names = self.library_param_names(definition)
+                global_count = len(self.global_scope)
+            if (min_count <= len(args) <= max_count
+                    and self.global_scope.keys().isdisjoint(param_names)
+                    and self.autoload_index.keys().isdisjoint(param_names)):
+                result = implementation(*args)
+                if result is not NotImplemented:
+                    return result
+            return self.call(fallback, args)
+
+        # Display it under its tinylisp name, like the definition would be
+        native.__name__ = name
+        return Builtin(function(params(UNLIMITED)(native)), name)
+
+    def library_param_names(self, definition):
+        """Return the param names that running a definition could bind.
+
+These are the params of the definition and of every global function or
+macro that its body refers to, directly or indirectly. If any of them
+is a global name, the tinylisp version gives warnings that the native
+version wouldn't.
+"""
+        names = set()
+        seen = set()
+        pending = [definition]
+        while pending:
+            value = pending.pop()
+            if type(value) is Builtin:
+                # Look inside the definitions of other native functions
+                value = self.native_definitions.get(value.tl_name)
+            if (not isinstance(value, List) or value.length not in (2, 3)
+                    or id(value) in seen):
+                continue
+            seen.add(id(value))
+            *_, param_names, body = value
+            if isinstance(param_names, (List, Symbol)):
+                names.update(param_counts(param_names)[2])
+            expressions = [body]
+            while expressions:
+                expr = expressions.pop()
+                if isinstance(expr, List):
+                    expressions.extend(expr)
+                elif isinstance(expr, Symbol):
+                    value = self.global_value(expr)
+                    if value is not None:
+                        pending.append(value)
+        return names
+
+    def native_length(self, seq, accum=0):
+        if is_sequence(seq) and isinstance(accum, int):
+            return accum + len(seq)
+        return NotImplemented
+
+    def native_nth(self, seq, index):
+        if not isinstance(index, int) or index < 0:
+            return nil
+        elif isinstance(seq, List):
+            # Walk the cells instead of finding the length, which would
+            # force all of a LazySeq
+            while index and seq is not nil:
+                seq = seq.tail
+                index -= 1
+            return seq.head
+        elif isinstance(seq, String):
+            return ord(str(seq)[index]) if index < len(seq) else nil
+        return NotImplemented
+
+    def native_reverse_onto(self, seq, accum):
+        if is_sequence(seq) and isinstance(accum, List):
+            return prepend(items(seq), accum)
+        elif isinstance(seq, String) and isinstance(accum, String):
+            return String(str(seq)[::-1] + str(accum))
+        elif (isinstance(seq, List) and isinstance(accum, String)
+                and all(isinstance(value, int) and 0 <= value < 0x110000
+                        for value in seq)):
+            # Character codes consed onto a String
+            return String("".join(map(chr, seq))[::-1] + str(accum))
+        return NotImplemented
+
+    def native_reverse(self, seq):
+        if isinstance(seq, List):
+            return prepend(seq, nil)
+        elif isinstance(seq, String):
+            return String(str(seq)[::-1])
+        return NotImplemented
+
+    def native_concat(self, seq_front, seq_back):
+        if is_sequence(seq_front):
+            return self.native_reverse_onto(self.native_reverse(seq_front),
+                                            seq_back)
+        return NotImplemented
+
+    def native_take(self, count, seq, accum=nil):
+        if is_sequence(seq) and isinstance(count, int) and accum is nil:
+            if isinstance(seq, String):
+                return String(str(seq)[:max(count, 0)])
+            values = []
+            for value in seq:
+                if len(values) >= count:
+                    break
+                values.append(value)
+            return List.from_iterable(values)
+        return NotImplemented
+
+    def native_drop(self, count, seq):
+        if is_sequence(seq) and isinstance(count, int):
+            if isinstance(seq, String):
+                return String(str(seq)[max(count, 0):])
+            while seq and count > 0:
+                seq = seq.tail
+                count -= 1
+            return seq
+        return NotImplemented
+
+    def native_contains(self, seq, item):
+        if is_sequence(seq):
+            return int(any(value == item for value in items(seq)))
+        return NotImplemented
+
+    def native_first_index(self, seq, item, index=0):
+        if is_sequence(seq) and isinstance(index, int):
+            for offset, value in enumerate(items(seq)):
+                if value == item:
+                    return index + offset
+            return nil
+        return NotImplemented
+
+    def native_count_up(self, lower, upper, accum=nil):
+        if (isinstance(lower, int) and isinstance(upper, int)
+                and isinstance(accum, List)):
+            if upper < lower:
+                return accum
+            return LazySeq.from_iterator(chain(range(lower, upper + 1),
+                                               accum))
+        return NotImplemented
+
+    def native_count_down(self, upper, lower, accum=nil):
+        if (isinstance(upper, int) and isinstance(lower, int)
+                and isinstance(accum, List)):
+            if upper < lower:
+                return accum
+            return LazySeq.from_iterator(chain(range(upper, lower - 1, -1),
+                                               accum))
+        return NotImplemented
+
+    def native_range(self, num1, num2=nil):
+        if num2 is nil:
+            num1, num2 = 0, num1
+        if isinstance(num1, int) and isinstance(num2, int):
+            return LazySeq.from_iterator(iter(range(num1, num2)))
+        return NotImplemented
+
+    def native_repeat(self, val, count, accum=nil):
+        if isinstance(count, int) and isinstance(accum, List):
+            if count <= 0:
+                return accum
+            return LazySeq.from_iterator(chain(repeat(val, count), accum))
+        return NotImplemented
+
+    def native_zip(self, *seqs):
+        if all(is_sequence(seq) for seq in seqs):
+            # zip stops at the end of the shortest sequence, just like the
+            # library version
+            rows = (List.from_iterable(values)
+                    for values in zip(*map(items, seqs)))
+            if any(type(seq) is LazySeq for seq in seqs):
+                return LazySeq.from_iterator(rows)
+            return List.from_iterable(rows)
+        return NotImplemented
+
+    def native_unique(self, seq):
+        if is_sequence(seq):
+            values = []
+            # Lists are unhashable, but their structural keys aren't
+            seen = set()
+            for value in items(seq):
+                key = structural_key(value)
+                if key not in seen:
+                    seen.add(key)
+                    values.append(value)
+            return same_kind(seq, values)
+        return NotImplemented
+
+    def native_map_backwards(self, func, seq, accum=nil):
+        if is_sequence(seq) and isinstance(accum, List):
+            while seq:
+                scope = {FUNC: func, SEQ: seq, ACCUM: accum}
+                accum = List(self.evaluate_in_scope(CALL_ON_HEAD, scope),
+                             accum)
+                seq = seq.tail
+            return accum
+        return NotImplemented
+
+    def native_map(self, func, seq):
+        if type(seq) is LazySeq:
+            return LazySeq.from_iterator(self.lazy_map(func, seq))
+        accum = self.native_map_backwards(func, seq)
+        if accum is NotImplemented:
+            return NotImplemented
+        return self.native_reverse(accum)
+
+    def lazy_map(self, func, seq):
+        while seq is not nil:
+            scope = {FUNC: func, SEQ: seq, ACCUM: nil}
+            yield self.evaluate_in_scope(CALL_ON_HEAD, scope)
+            seq = seq.tail
+
+    def native_filter(self, func, seq, accum=nil):
+        if type(seq) is LazySeq and accum is nil:
+            return LazySeq.from_iterator(self.lazy_filter(func, seq))
+        elif is_sequence(seq) and accum is nil:
+            while seq:
+                scope = {FUNC: func, SEQ: seq, ACCUM: accum}
+                if cfg.tl_truthy(self.evaluate_in_scope(CALL_ON_HEAD,
+                                                        scope)):
+                    accum = List(seq.head, accum)
+                seq = seq.tail
+            # Like (reverse-onto accum seq), where seq is now empty
+            return self.native_reverse_onto(accum, seq)
+        return NotImplemented
+
+    def lazy_filter(self, func, seq):
+        while seq is not nil:
+            scope = {FUNC: func, SEQ: seq, ACCUM: nil}
+            if cfg.tl_truthy(self.evaluate_in_scope(CALL_ON_HEAD, scope)):
+                yield seq.head
+            seq = seq.tail
+
+    def native_take_while(self, func, seq, accum=nil):
+        if type(seq) is LazySeq and accum is nil:
+            return LazySeq.from_iterator(self.lazy_take_while(func, seq))
+        elif is_sequence(seq) and isinstance(accum, List):
+            while seq:
+                scope = {FUNC: func, SEQ: seq, ACCUM: accum}
+                if not cfg.tl_truthy(self.evaluate_in_scope(CALL_ON_HEAD,
+                                                            scope)):
+                    break
+                accum = List(seq.head, accum)
+                seq = seq.tail
+            return self.native_reverse(accum)
+        return NotImplemented
+
+    def lazy_take_while(self, func, seq):
+        while seq is not nil:
+            scope = {FUNC: func, SEQ: seq, ACCUM: nil}
+            if not cfg.tl_truthy(self.evaluate_in_scope(CALL_ON_HEAD, scope)):
+                break
+            yield seq.head
+            seq = seq.tail
+
+    def native_foldl(self, func, seq, accum=nil):
+        if is_sequence(seq):
+            while seq:
+                scope = {FUNC: func, SEQ: seq, ACCUM: accum}
+                accum = self.evaluate_in_scope(CALL_ON_ACCUM_AND_HEAD, scope)
+                seq = seq.tail
+            return accum
+        return NotImplemented
+
+    def native_abs(self, num):
+        if isinstance(num, int):
+            return abs(num)
+        return NotImplemented
+
+    def native_sign(self, num):
+        if isinstance(num, int):
+            return (num > 0) - (num < 0)
+        return NotImplemented
+
+    def native_minimum(self, seq):
+        if is_sequence(seq):
+            values = list(items(seq))
+            if all(isinstance(value, int) for value in values):
+                return min(values, default=nil)
+        return NotImplemented
+
+    def native_min(self, *nums):
+        return self.native_minimum(List.from_iterable(nums))
+
+    def native_maximum(self, seq):
+        if is_sequence(seq):
+            values = list(items(seq))
+            if all(isinstance(value, int) for value in values):
+                return max(values, default=nil)
+        return NotImplemented
+
+    def native_max(self, *nums):
+        return self.native_maximum(List.from_iterable(nums))
+
+    def native_prime(self, num):
+        if isinstance(num, int):
+            if num > 1:
+                return int(is_prime(num))
+            return int(num == -1)
+        return NotImplemented
+
+    def native_to_base(self, base, num):
+        if isinstance(base, int) and isinstance(num, int):
+            if base <= 0:
+                return nil
+            elif base == 1:
+                return self.native_repeat(1, num)
+            elif num <= 0:
+                return nil
+            return List.from_iterable(digits_in_base(num, base))
+        return NotImplemented
+
+    def native_from_base(self, base, digits, accum=0):
+        if (isinstance(base, int) and is_sequence(digits)
+                and isinstance(accum, int)):
+            for digit in items(digits):
+                if not isinstance(digit, int):
+                    return NotImplemented
+                accum = accum * base + digit
+            return accum
+        return NotImplemented
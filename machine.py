@@ -0,0 +1,271 @@
+
+from cfg import nil, Symbol
+import cfg
+from datatypes import List, Memoized, String, memo_key
+from builtin import Builtin
+import listlib
+from execution import Program
+
+
+# Non-tail recursion uses up continuation frames on an explicit stack
+# instead of Python stack frames; this is the default limit on how many
+# can be pending at once
+DEFAULT_MAX_STACK = 1_000_000
+
+# Kinds of continuation frames. Each frame is a tuple (or, for ARGS, a
+# list that gets updated in place) whose first item is its kind:
+# (HEAD, expr, scope, top_level): evaluating the head of the call expr
+# (IF, branches, scope, top_level): evaluating the condition of an if
+#   whose true and false branches are the List branches
+# (EVAL, scope, top_level): evaluating the argument of an eval
+# [ARGS, head, remaining, args, scope, top_level]: evaluating an
+#   argument of a call to head; args holds the values of the arguments
+#   before it and remaining is the List of arguments after it
+# (MEMO, memo_keys): evaluating the body of a memoized function; its
+#   result gets stored under each (function, key) pair in memo_keys,
+#   which has more than one if memoized functions made tail calls
+HEAD, IF, EVAL, ARGS, MEMO = range(5)
+
+
+class StackProgram(Program):
+    """A Program that evaluates with an explicit continuation stack.
+
+This is the tree-walking evaluator turned into a CEK-style machine: the
+registers are the expression being evaluated (or the value being
+returned), its local scope, and whether it is at top level, and the
+rest of the computation is a stack of continuation frames. Evaluating
+an argument, an if condition, or the head of a call pushes a frame
+instead of recursing in Python, so non-tail recursion is limited by
+max_stack rather than by Python's recursion limit. Tail calls replace
+the registers without pushing anything, so they still run in constant
+space. Output and errors match the tree-walking evaluator.
+
+Builtins that evaluate code themselves still start a new machine
+through evaluate(), so recursion through them uses up Python stack.
+That includes def, load, builtins that call a function (like sort-by
+and group-by), and the native library's fallbacks to tinylisp
+definitions. For that reason, the core library functions that take a
+callback (map, map-backwards, filter, take-while, and foldl) keep their
+tinylisp definitions here, so recursing through them stays on the
+explicit stack.
+"""
+
+    def __init__(self, *args, **kwargs):
+        options = kwargs.get("options")
+        self.max_stack = (getattr(options, "max_stack", None)
+                          or DEFAULT_MAX_STACK)
+        super().__init__(*args, **kwargs)
+
+    def has_native_version(self, name):
+        # A native version would evaluate its callback in a new machine
+        return (super().has_native_version(name)
+                and name not in listlib.calls_back)
+
+    def evaluate(self, expr, top_level=False):
+        scope = self.local_scopes[-1]
+        global_scope = self.global_scope
+        stack = []
+        evaluating = True
+        while True:
+            if evaluating:
+                # Evaluate expr in scope, or start to
+                if type(expr) is Symbol:
+                    # None is never a tinylisp value, so it can mark a
+                    # missing name
+                    value = scope.get(expr)
+                    if value is None:
+                        value = global_scope.get(expr)
+                        if value is None:
+                            value = self.global_value(expr)
+                        if value is None:
+                            cfg.error(f"{expr!r} is not defined")
+                            value = nil
+                elif isinstance(expr, List) and expr is not nil:
+                    # Evaluate the head first
+                    if len(stack) >= self.max_stack:
+                        raise RecursionError("evaluation stack is full")
+                    stack.append((HEAD, expr, scope, top_level))
+                    expr = expr.head
+                    top_level = False
+                    continue
+                elif (expr is nil or isinstance(expr, (int, String))
+                        or type(expr) is Builtin):
+                    # Nil, integers, strings, and builtins evaluate to
+                    # themselves
+                    value = expr
+                else:
+                    # Code should never get here
+                    raise TypeError("unexpected type in evaluate():",
+                                    type(expr))
+                evaluating = False
+            # Pass the value to the innermost continuation
+            if not stack:
+                return value
+            frame = stack.pop()
+            kind = frame[0]
+            if kind == HEAD:
+                _, call_expr, scope, top_level = frame
+                head = value
+                tail = call_expr.tail
+                if head is self.if_builtin:
+                    if tail.length == 3:
+                        stack.append((IF, tail.tail, scope, top_level))
+                        expr = tail.head
+                        top_level = False
+                        evaluating = True
+                    else:
+                        cfg.error("if takes 3 arguments, not", len(tail))
+                        value = nil
+                elif head is self.eval_builtin:
+                    if tail.length == 1:
+                        stack.append((EVAL, scope, top_level))
+                        expr = tail.head
+                        top_level = False
+                        evaluating = True
+                    else:
+                        cfg.error("eval takes 1 argument, not", len(tail))
+                        value = nil
+                elif self.is_macro(head):
+                    try:
+                        expr = self.expand_macro(head, tail)
+                    except TypeError:
+                        # bind_params already gave the error message
+                        value = nil
+                    else:
+                        evaluating = True
+                elif type(head) is Builtin:
+                    if head.top_level_only and not top_level:
+                        cfg.error(head.tl_name,
+                                  "can only be called at top level")
+                        value = nil
+                        continue
+                    elif head.repl_only and not self.is_repl:
+                        cfg.error(head.tl_name,
+                                  "can only be used in REPL mode")
+                    if head.is_macro:
+                        # Macros receive their args unevaluated
+                        value = self.call_builtin(head, tail, scope)
+                    elif tail is nil:
+                        value = self.call_builtin(head, [], scope)
+                    else:
+                        # Functions receive their args evaluated
+                        stack.append([ARGS, head, tail.tail, [], scope,
+                                      top_level])
+                        expr = tail.head
+                        top_level = False
+                        evaluating = True
+                elif isinstance(head, List) and head is not nil:
+                    if head.length != 3:
+                        cfg.error("List callable as function must have "
+                                  "3 elements, not", len(head))
+                        value = nil
+                    elif tail is nil:
+                        value, expr, scope = self.bind_call(head, [], scope,
+                                                            stack)
+                        evaluating = value is None
+                        top_level = False
+                    else:
+                        stack.append([ARGS, head, tail.tail, [], scope,
+                                      top_level])
+                        expr = tail.head
+                        top_level = False
+                        evaluating = True
+                else:
+                    # Trying to call something other than a builtin or
+                    # user-defined function
+                    cfg.error(head, "is not a function or macro")
+                    value = nil
+            elif kind == IF:
+                _, branches, scope, top_level = frame
+                if cfg.tl_truthy(value):
+                    expr = branches.head
+                else:
+                    expr = branches.tail.head
+                evaluating = True
+            elif kind == EVAL:
+                _, scope, top_level = frame
+                expr = value
+                evaluating = True
+            elif kind == MEMO:
+                # Store the outermost call's result last, so that it's
+                # the last to be evicted
+                for function, key in reversed(frame[1]):
+                    function.store(key, value)
+            else:
+                _, head, remaining, args, scope, top_level = frame
+                args.append(value)
+                if remaining is not nil:
+                    # Go on to the next argument
+                    frame[2] = remaining.tail
+                    stack.append(frame)
+                    expr = remaining.head
+                    top_level = False
+                    evaluating = True
+                elif type(head) is Builtin:
+                    value = self.call_builtin(head, args, scope)
+                else:
+                    # User-defined function; do a tail call
+                    value, expr, scope = self.bind_call(head, args, scope,
+                                                        stack)
+                    evaluating = value is None
+                    top_level = False
+
+    def call_builtin(self, builtin, args, scope):
+        """Check the arg count and call a builtin in the given scope."""
+        if len(args) < builtin.min_param_count:
+            cfg.error(builtin.tl_name, "takes at least",
+                      builtin.min_param_count, "arguments, got", len(args))
+            return nil
+        elif len(args) > builtin.max_param_count:
+            cfg.error(builtin.tl_name, "takes at most",
+                      builtin.max_param_count, "arguments, got", len(args))
+            return nil
+        # Hold on to the list of scopes, since restart replaces it
+        local_scopes = self.local_scopes
+        local_scopes.append(scope)
+        try:
+            if len(args) == 2:
+                return builtin.call2(*args)
+            else:
+                return builtin.call(*args)
+        finally:
+            local_scopes.pop()
+
+    def bind_call(self, function, args, scope, stack):
+        """Set up a call to a user-defined function from the given scope.
+
+Return a (value, body, new_scope) triple: if binding the arguments
+fails, value is nil, and if the function is memoized and has a cached
+result, value is that result; otherwise it is None, and the function
+body should be evaluated in the new scope. In that case, a memoized
+function's key is added to the MEMO frame on top of the stack, or to a
+new one.
+"""
+        if type(function) is Memoized:
+            key = memo_key(args)
+            value = function.lookup(key)
+            if value is not None:
+                return value, None, scope
+        environment, param_names, body = function
+        # Default values get evaluated in the calling scope
+        self.local_scopes.append(scope)
+        try:
+            new_scope = self.bind_params(environment, param_names,
+                                         List.from_iterable(args))
+        except TypeError:
+            # There was a problem with the structure of the parameter
+            # list (bind_params already gave the error message)
+            return nil, None, scope
+        finally:
+            self.local_scopes.pop()
+        if type(function) is Memoized:
+            if stack and stack[-1][0] == MEMO:
+                # A tail call from the body of another memoized function
+                # has the same result, so this keeps tail calls in
+                # constant space
+                stack[-1][1].append((function, key))
+            elif len(stack) >= self.max_stack:
+                raise RecursionError("evaluation stack is full")
+            else:
+                stack.append((MEMO, [(function, key)]))
+        return None, body, new_scope
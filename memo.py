@@ -0,0 +1,61 @@
+
+from cfg import nil, Symbol
+import cfg
+from datatypes import List, Memoized
+from builtin import function, quiet, params
+
+
+# Built-in functions for memoization
+# Key = implementation name; value = tinylisp name
+
+builtins = {
+    "tl_memoize": "memoize",
+    "tl_memo_stats": "memo-stats",
+    "tl_memo_clear": "memo-clear",
+    }
+
+# How many results a memoized function keeps, unless memoize is told
+# otherwise
+DEFAULT_MEMO_SIZE = 10_000
+
+
+class MemoBuiltins:
+    """Builtins that create and manage memoized functions."""
+
+    @function
+    @params(1, 2)
+    def tl_memoize(self, func, max_size=DEFAULT_MEMO_SIZE):
+        if not (isinstance(func, List) and len(func) == 3):
+            cfg.error("memoize requires a user-defined function, not",
+                      cfg.tl_type(func))
+            return nil
+        elif not (isinstance(max_size, int) and max_size > 0):
+            cfg.error("memoize cache size must be a positive Integer")
+            return nil
+        else:
+            return Memoized.from_function(func, max_size)
+
+    @function
+    @params(1)
+    def tl_memo_stats(self, func):
+        if isinstance(func, Memoized):
+            return List.from_pairs([(Symbol("hits"), func.hits),
+                                    (Symbol("misses"), func.misses),
+                                    (Symbol("evictions"), func.evictions),
+                                    (Symbol("size"), len(func.cache)),
+                                    (Symbol("max-size"), func.max_size)])
+        else:
+            cfg.error("memo-stats requires a memoized function, not",
+                      cfg.tl_type(func))
+            return nil
+
+    @function
+    @quiet
+    @params(1)
+    def tl_memo_clear(self, func):
+        if isinstance(func, Memoized):
+            func.clear()
+        else:
+            cfg.error("memo-clear requires a memoized function, not",
+                      cfg.tl_type(func))
+        return nil
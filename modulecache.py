@@ -0,0 +1,112 @@
+
+import os
+import io
+import pickle
+import hashlib
+import tempfile
+import contextlib
+
+from parsing import parse_lines
+
+
+# Parsed modules are cached in this directory next to the module, like
+# __pycache__, or in USER_CACHE_DIRECTORY if that directory can't be
+# written to
+CACHE_DIRECTORY_NAME = "__tlcache__"
+USER_CACHE_DIRECTORY = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "tinylisp2")
+
+# Change this whenever parsing changes, so old cache files get rebuilt
+CACHE_FORMAT_VERSION = 1
+
+
+def source_hash(code):
+    return hashlib.sha256(code.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def cache_paths(abspath):
+    """The places a module's cache file can be, in order of preference."""
+    module_directory, module_name = os.path.split(abspath)
+    cache_name = module_name + ".pickle"
+    # In the shared user directory, cache files are named by their
+    # module's full path
+    path_hash = hashlib.sha256(abspath.encode("utf-8", "surrogatepass"))
+    user_cache_name = path_hash.hexdigest()[:32] + "-" + cache_name
+    return [os.path.join(module_directory, CACHE_DIRECTORY_NAME, cache_name),
+            os.path.join(USER_CACHE_DIRECTORY, user_cache_name)]
+
+
+def read(abspath, mtime, code):
+    """Return the cached parse of a module as a list of expressions.
+
+Return None if there is no cache file for the module, or if it was made
+from a different version of the module's code.
+"""
+    digest = None
+    for cache_path in cache_paths(abspath):
+        try:
+            with open(cache_path, "rb") as f:
+                entry = pickle.load(f)
+        except Exception:
+            # Missing, unreadable, or corrupt; treat it as a miss
+            continue
+        if (not isinstance(entry, dict)
+                or entry.get("version") != CACHE_FORMAT_VERSION
+                or entry.get("path") != abspath
+                or entry.get("mtime") != mtime):
+            continue
+        if digest is None:
+            digest = source_hash(code)
+        if entry.get("hash") == digest:
+            return entry["expressions"]
+    return None
+
+
+def write(abspath, mtime, code):
+    """Parse a module's code and save the result in a cache file.
+
+Nothing is saved if parsing the code gives warnings or errors, which
+need to be shown every time the module is loaded. If no cache file can
+be written, the module is simply parsed again next time.
+"""
+    warnings = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(warnings):
+            expressions = list(parse_lines(io.StringIO(code)))
+    except SyntaxError:
+        return
+    if warnings.getvalue():
+        return
+    entry = {
+        "version": CACHE_FORMAT_VERSION,
+        "path": abspath,
+        "mtime": mtime,
+        "hash": source_hash(code),
+        "expressions": expressions,
+        }
+    try:
+        data = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, RecursionError):
+        # Expressions nested too deeply to pickle
+        return
+    for cache_path in cache_paths(abspath):
+        cache_directory = os.path.dirname(cache_path)
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+            # Write a temporary file and move it into place, so that
+            # another process never reads a half-written cache file
+            fd, temp_path = tempfile.mkstemp(dir=cache_directory,
+                                             suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, cache_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except OSError:
+            # Try the next place
+            continue
+        else:
+            return
@@ -0,0 +1,105 @@
+
+import sys
+import atexit
+
+
+# Flush policies:
+# - "line" writes the buffer out at the end of every line
+# - "block" writes it out only when it fills up
+# - "auto" is "line" when stdout is a terminal and "block" otherwise
+FLUSH_POLICIES = ("auto", "line", "block")
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+
+class OutputBuffer:
+    """Collect text written to stdout and write it out in large chunks.
+
+The text goes to whatever sys.stdout is when it is written out; if
+sys.stdout gets replaced, what was written before that is written out
+first. Writing out the buffer also flushes sys.stdout, so the text is
+on its way once flush() returns.
+"""
+
+    def __init__(self, size=DEFAULT_BUFFER_SIZE, policy="auto"):
+        self.chunks = []
+        self.length = 0
+        self.stream = None
+        self.configure(size, policy)
+
+    def configure(self, size=None, policy=None):
+        """Change the buffer size or the flush policy."""
+        if size is not None:
+            self.size = max(size, 1)
+        if policy is not None:
+            if policy not in FLUSH_POLICIES:
+                raise ValueError(f"unknown flush policy {policy!r}")
+            self.policy = policy
+        self.flush()
+        # Check the stream again next time, under the new policy
+        self.stream = None
+
+    def line_buffered(self, stream):
+        if self.policy == "auto":
+            try:
+                return stream.isatty()
+            except (AttributeError, ValueError):
+                return False
+        return self.policy == "line"
+
+    def check_stream(self):
+        """Switch to the current sys.stdout, flushing for the old one."""
+        if sys.stdout is not self.stream:
+            self.flush()
+            self.stream = sys.stdout
+            self.by_line = self.line_buffered(self.stream)
+
+    def write(self, text):
+        if sys.stdout is not self.stream:
+            self.check_stream()
+        self.chunks.append(text)
+        self.length += len(text)
+        if self.length >= self.size or self.by_line and "\n" in text:
+            self.flush()
+
+    def writelines(self, chunks):
+        """Write an iterable of strings, such as from unparse_chunks.
+
+The chunks shouldn't contain newlines; under the "line" policy, they
+stay in the buffer until a newline is written.
+"""
+        if sys.stdout is not self.stream:
+            self.check_stream()
+        # Getting the next chunk can run code that writes too (such as
+        # producing the items of a lazy list), so self.length is kept
+        # up to date as it goes
+        for chunk in chunks:
+            self.chunks.append(chunk)
+            self.length += len(chunk)
+            if self.length >= self.size:
+                self.flush()
+
+    def flush(self):
+        """Write out everything buffered so far."""
+        if self.chunks:
+            text = "".join(self.chunks)
+            self.chunks.clear()
+            self.length = 0
+            self.stream.write(text)
+        if self.stream is not None:
+            self.stream.flush()
+
+
+# All tinylisp output to stdout goes through this buffer
+stdout = OutputBuffer()
+
+
+@atexit.register
+def flush_at_exit():
+    """Write out whatever is left when the interpreter exits."""
+    try:
+        stdout.flush()
+    except (OSError, ValueError):
+        # stdout is closed or broken; there's nowhere for the output
+        # to go
+        pass
@@ -1,134 +1,278 @@
+import re
+import unicodedata
+from itertools import chain
 
 import cfg
+from datatypes import List, String
+
+
+# Each match of the scanner's regex is a token (group 1), along with any
+# whitespace and comments (which run up to but not including the end of
+# the line) before it. A token is one of:
+# - a parenthesis
+# - a symbol or numeric literal, which runs until a special character
+# - a string literal, which is closed by a delimiter, or autoclosed at
+#   the end of a line or of the code; an escape sequence is a backslash
+#   and whatever character follows it (even a newline), and a backslash
+#   at the very end of the code is an unterminated escape sequence
+# Whitespace and comments at the end of the code match with an empty
+# token.
+TOKEN_REGEX = re.compile(r"""
+    (?: [{whitespace}]+ | {comment} [^\n]* )*
+    ( [{parens}]
+    | [^{special}]+
+    | {delimiter}
+        [^{delimiter}{escape}\n]*
+        (?: {escape}[\s\S] [^{delimiter}{escape}\n]* )*
+        (?: (?P<closed>{delimiter}) | (?P<unterminated>{escape}) )?
+    | \Z )
+    """.format(whitespace=re.escape(cfg.WHITESPACE),
+               comment=re.escape(cfg.LINE_COMMENT_CHAR),
+               parens=re.escape(cfg.PARENS),
+               delimiter=re.escape(cfg.STRING_DELIMITER),
+               escape=re.escape(cfg.STRING_ESCAPE_CHAR),
+               special=re.escape(cfg.SPECIAL_CHARS)),
+    re.VERBOSE)
+
+# Escape sequences in string literals are the same as in Python string
+# literals
+ESCAPE_REGEX = re.compile(r"""
+    \\ ( [0-7]{1,3}
+       | x[0-9a-fA-F]{0,2}
+       | u[0-9a-fA-F]{0,4}
+       | U[0-9a-fA-F]{0,8}
+       | N\{[^}\n]*\}
+       | [\s\S] )
+    """, re.VERBOSE)
+
+SIMPLE_ESCAPES = {
+    "\n": "",
+    "\\": "\\",
+    "'": "'",
+    '"': '"',
+    "a": "\a",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+    "v": "\v",
+    }
+
+# The number of hex digits each kind of hex escape needs
+HEX_ESCAPE_LENGTHS = {"x": 2, "u": 4, "U": 8}
 
 
 def scan(code):
     """Take a string and yield a series of tokens."""
-    # Add a newline to the end to allow peeking at the next character
-    # without requiring a check for end-of-string
-    code += "\n"
-    i = 0
-    while i < len(code):
-        char = code[i]
-        if char in cfg.WHITESPACE:
-            # Whitespace--ignore
-            pass
-        elif char == cfg.LINE_COMMENT_CHAR:
-            # Start of a comment--scan till newline
-            while code[i+1] != "\n":
-                i += 1
-        elif char in cfg.PARENS:
-            # Parentheses are their own tokens
-            yield char
-        elif char == cfg.STRING_DELIMITER:
-            # Start of a string literal--scan till the end of it
-            # A string literal looks like:
-            #  "chars \"and\" \\escapes"
-            # which represents this string:
-            #  chars "and" \escapes
-            start = i
-            i += 1
-            while code[i] != cfg.STRING_DELIMITER:
-                if code[i] == "\n":
-                    # String literals that are unterminated by the end
-                    # of a line get autoclosed
-                    yield code[start:i] + cfg.STRING_DELIMITER
-                    # Back the index up a notch so the newline gets
-                    # scanned in its own right on the next iteration
-                    i -= 1
-                    break
-                elif code[i] == cfg.STRING_ESCAPE_CHAR:
-                    # Include the whole escape sequence together
-                    i += 2
-                    # But make sure we didn't just walk off the end of
-                    # the code
-                    if i >= len(code):
-                        cfg.warn("unterminated escape sequence in string")
-                        yield code[start:i] + cfg.STRING_DELIMITER
-                        i -= 1
-                        break
-                else:
-                    # Include a single character
-                    i += 1
-            else:
-                yield code[start:i+1]
-        else:
-            # Start of a regular, non-extended token (symbol or
-            # numeric literal)--scan till the end of it
-            start = i
-            while code[i+1] not in cfg.SPECIAL_CHARS:
-                i += 1
-            yield code[start:i+1]
-        i += 1
+    for match in TOKEN_REGEX.finditer(code):
+        token = match.group(1)
+        if not token:
+            # Nothing but whitespace and comments at the end
+            break
+        elif (token[0] == cfg.STRING_DELIMITER
+                and match.group("closed") is None):
+            if match.group("unterminated") is not None:
+                cfg.warn("unterminated escape sequence in string")
+                # Escape the end of the line, as if the code ended with
+                # a newline, which decodes to nothing
+                token += "\n"
+            # String literals that are unterminated by the end of a
+            # line get autoclosed
+            token += cfg.STRING_DELIMITER
+        yield token
+
+
+def scan_lines(lines):
+    """Take an iterable of lines of code and yield a series of tokens.
+
+The tokens are the same as from scanning the lines joined together.
+Each line is scanned as soon as it arrives, unless it ends in the
+middle of an escape sequence that continues a string literal onto the
+next line; then the lines are scanned together.
+"""
+    chunk = ""
+    for line in lines:
+        chunk += line
+        if (line.endswith(cfg.STRING_ESCAPE_CHAR + "\n")
+                and ends_in_escape(chunk[:-1])):
+            # The string literal goes on past the end of the line
+            continue
+        yield from scan(chunk)
+        chunk = ""
+    if chunk:
+        yield from scan(chunk)
+
+
+def ends_in_escape(code):
+    """Does the code end with an unterminated escape sequence?"""
+    for match in TOKEN_REGEX.finditer(code):
+        if match.group("unterminated") is not None:
+            # This can only be the last token
+            return True
+    return False
+
+
+def complete_tokens(code):
+    """Return a list of the tokens in code if they make up complete
+expressions, or None if parsing them would need to supply any missing
+closing parentheses or end with an unterminated escape sequence.
+"""
+    tokens = []
+    depth = 0
+    for match in TOKEN_REGEX.finditer(code):
+        token = match.group(1)
+        if not token:
+            break
+        elif token == "(":
+            depth += 1
+        elif token == ")":
+            # Unmatched closing parentheses are ignored
+            depth = max(depth - 1, 0)
+        elif (token[0] == cfg.STRING_DELIMITER
+                and match.group("closed") is None):
+            if match.group("unterminated") is not None:
+                return None
+            token += cfg.STRING_DELIMITER
+        tokens.append(token)
+    return tokens if depth == 0 else None
 
 
 def parse(code):
     """Take a series of expressions, yield a series of parse trees.
 
 The code can be a string or an iterator that yields tokens.
-Each resulting parse tree is a nested list.
+Each resulting parse tree is a nested List.
+
+Parsing is iterative: the items of each unfinished s-expression are
+kept on an explicit stack rather than in Python stack frames, so there
+is no limit on how deeply expressions can be nested.
 """
     if isinstance(code, str):
         # If we're given a raw codestring, scan it before parsing
         code = scan(code)
-    try:
-        while True:
-            token = next(code)
-            if token == "(":
-                # After an opening parenthesis, parse expressions until
-                # the matching closing parenthesis and yield the
-                # resulting nested list
-                yield parse_expressions(code)
-            elif token == ")":
+    # The items parsed so far of each s-expression that has been opened
+    # but not closed, innermost last
+    unfinished = []
+    # Symbols and integers parsed so far, by token; the same names and
+    # numbers tend to come up over and over
+    atoms = {}
+    for token in code:
+        if token == "(":
+            # After an opening parenthesis, collect items until the
+            # matching closing parenthesis
+            unfinished.append([])
+            continue
+        elif token == ")":
+            if not unfinished:
                 # Ignore unmatched closing parentheses with a warning
                 cfg.warn("unmatched closing parenthesis")
-            else:
-                # If the code doesn't start with a parenthesis, it must
-                # be a symbol, a string literal, or a numeric literal
-                yield parse_symbol_or_literal(token)
-    except StopIteration:
-        # Everything has been parsed
-        pass
-
-
-def parse_expressions(code):
-    """Take a token iterator and parse expressions from it until ).
-
-This function assumes we're parsing an s-expression and that the
-opening parenthesis has already been processed. So we parse the items
-or (sub)expressions in the s-expr one after the other, turning them
-into a list. When we go to parse another item and we find a closing
-parenthesis, we've hit the end of the s-expr, so we return nil.
+                continue
+            expr = List.from_iterable(unfinished.pop())
+        else:
+            # A symbol, a string literal, or a numeric literal
+            expr = atoms.get(token)
+            if expr is None:
+                expr = parse_symbol_or_literal(token)
+                if not isinstance(expr, String):
+                    atoms[token] = expr
+        if unfinished:
+            unfinished[-1].append(expr)
+        else:
+            yield expr
+    # If any s-expressions are unfinished and we've run out of tokens,
+    # supply the missing close-parens
+    while unfinished:
+        expr = List.from_iterable(unfinished.pop())
+        if unfinished:
+            unfinished[-1].append(expr)
+        else:
+            yield expr
+
+
+def parse_lines(lines):
+    """Take an iterable of lines of code, yield a series of parse trees.
+
+The lines should each end with a newline, except perhaps the last, as
+when reading a text file. Each parse tree is yielded as soon as the
+lines it comes from have been read.
+
+The code is in multiline form if any line has more closing parentheses
+than opening parentheses, and in single-line form otherwise (see
+Program.execute). Rather than reading all the lines to find out which
+it is, lines that parse the same way in either form--those that leave
+no parentheses or escape sequences open--are parsed as they arrive.
+From the first line that leaves something open, lines are held until
+a line with extra closing parentheses shows that the code is in
+multiline form, after which the rest of it is parsed as it arrives, or
+until the end of the code shows that it is in single-line form.
 """
-    parsed = []
-    while True:
-        try:
-            token = next(code)
-        except StopIteration:
-            # If the s-expression is unfinished and we've run out of tokens,
-            # supply the missing close-paren
-            token = ")"
-        if token == ")":
-            break
-        elif token == "(":
-            # The subexpression is itself a list
-            expr = parse_expressions(code)
+    lines = iter(lines)
+    held = []
+    for line in lines:
+        code = line[:-1] if line.endswith("\n") else line
+        if code.count(")") > code.count("("):
+            # Multiline form: parse the code as a whole
+            held.append(line)
+            yield from parse(scan_lines(chain(held, lines)))
+            return
+        elif held:
+            held.append(line)
         else:
-            expr = parse_symbol_or_literal(token)
-        parsed.append(expr)
-    return parsed
+            tokens = complete_tokens(code)
+            if tokens is None:
+                held.append(line)
+            else:
+                yield from parse(iter(tokens))
+    # Single-line form: parse each line separately
+    for line in held:
+        yield from parse(line[:-1] if line.endswith("\n") else line)
 
 
 def parse_symbol_or_literal(token):
     "Take a string and parse it as a literal or a symbol."""
     if token.startswith(cfg.STRING_DELIMITER):
-        # String literal--should be the same syntax as a Python string
-        # literal, so try just eval'ing it
-        # TODO: error handling
-        return eval(token)
+        # String literal--strip the delimiters and decode the escapes
+        return String(decode_string(token[1:-1]))
     if token.isdigit() or token.startswith("-") and token[1:].isdigit():
         # Integer literal
         return int(token)
     else:
         # If it's not any kind of recognized literal, it's a symbol
         return cfg.Symbol(token)
+
+
+def decode_string(text):
+    """Replace the escape sequences in the text of a string literal.
+
+Raise SyntaxError if an escape sequence is malformed.
+"""
+    if cfg.STRING_ESCAPE_CHAR not in text:
+        return text
+    return ESCAPE_REGEX.sub(decode_escape, text)
+
+
+def decode_escape(match):
+    sequence = match.group(1)
+    kind = sequence[0]
+    if kind in SIMPLE_ESCAPES:
+        return SIMPLE_ESCAPES[kind]
+    elif kind in "01234567":
+        return chr(int(sequence, 8))
+    elif kind in HEX_ESCAPE_LENGTHS:
+        if len(sequence) - 1 < HEX_ESCAPE_LENGTHS[kind]:
+            raise SyntaxError(f"truncated \\{kind} escape in string")
+        code_point = int(sequence[1:], 16)
+        if code_point > 0x10FFFF:
+            raise SyntaxError("illegal Unicode character in string")
+        return chr(code_point)
+    elif kind == "N":
+        if len(sequence) == 1:
+            raise SyntaxError("malformed \\N character escape in string")
+        try:
+            return unicodedata.lookup(sequence[2:-1])
+        except KeyError:
+            raise SyntaxError("unknown Unicode character name in string")
+    else:
+        # Unrecognized escape sequences are left as they are
+        return match.group()
@@ -1,32 +1,51 @@
 
-import sys
-
 import cfg
+import output
 from execution import Program
+from compiler import CompiledProgram
+from machine import StackProgram
+
+
+# Evaluation engines that can be selected with --engine
+engines = {
+    "tree": Program,
+    "compiled": CompiledProgram,
+    "stack": StackProgram,
+    }
+
+
+def new_program(is_repl=False, options=None):
+    """Create a Program using the engine chosen in the options."""
+    engine = getattr(options, "engine", "tree")
+    return engines[engine](is_repl=is_repl, options=options)
 
 
 def run_file(filename, environment=None, options=None):
+    """Execute the code in a file; return False if it can't be read."""
     if environment is None:
-        environment = Program(is_repl=False, options=options)
+        environment = new_program(is_repl=False, options=options)
     try:
-        with open(filename) as f:
-            code = f.read()
+        f = open(filename)
     except FileNotFoundError:
         cfg.error("could not find", filename)
-        return
+        return False
     except PermissionError:
         cfg.error("insufficient permissions to read", filename)
-        return
+        return False
     except IOError:
         cfg.error("could not read", filename)
-        return
-    # If file read was successful, execute the code
-    run_program(code, environment)
+        return False
+    # If the file opened successfully, execute the code as it is read
+    with f:
+        run_program(f, environment)
+    report_stats(environment, options)
+    return True
 
 
 def run_program(code, environment=None, options=None):
+    """Execute code from a str, or from a text file as it is read."""
     if environment is None:
-        environment = Program(is_repl=False, options=options)
+        environment = new_program(is_repl=False, options=options)
     try:
         environment.execute(code)
     except KeyboardInterrupt:
@@ -38,14 +57,15 @@ def run_program(code, environment=None, options=None):
         # the interpreter
         cfg.error(err)
     finally:
-        sys.stdout.flush()
+        output.stdout.flush()
+    report_stats(environment, options)
 
 
 def repl(environment=None, options=None):
-    print("(tinylisp 2)")
+    print("(tinylisp 2)", file=output.stdout)
     if environment is None:
-        environment = Program(is_repl=True, options=options)
-    print("Type (help) for information")
+        environment = new_program(is_repl=True, options=options)
+    print("Type (help) for information", file=output.stdout)
     instruction = input_instruction()
     while True:
         try:
@@ -63,12 +83,22 @@ def repl(environment=None, options=None):
             break
         else:
             if last_value is not None:
-                environment.global_scope[cfg.Symbol("_")] = last_value
+                environment.bind_global(cfg.Symbol("_"), last_value)
         instruction = input_instruction()
-    print("Bye!")
+    print("Bye!", file=output.stdout)
+    output.stdout.flush()
+    report_stats(environment, options)
+
+
+def report_stats(environment, options=None):
+    """Print the environment's performance counters if asked to."""
+    if getattr(options, "stats", False):
+        environment.report_stats()
 
 
 def input_instruction():
+    # Make sure all the output so far shows up before the prompt
+    output.stdout.flush()
     try:
         instruction = input(cfg.PROMPT)
     except (EOFError, KeyboardInterrupt):
@@ -0,0 +1,84 @@
+
+from cfg import nil
+import cfg
+from datatypes import List, String, structural_key
+from builtin import function, params
+from listlib import is_sequence, items, same_kind
+
+
+# Built-in functions for sorting and grouping
+# Key = implementation name; value = tinylisp name
+
+builtins = {
+    "tl_sort": "sort",
+    "tl_sort_by": "sort-by",
+    "tl_group_by": "group-by",
+    }
+
+
+def sort_keys(keys):
+    """Return Python sort keys for tinylisp values, or None if they can't
+be ordered. Integers are ordered as by <, and Strings by their
+characters; a List must be all one or all the other.
+"""
+    for key1, key2 in zip(keys, keys[1:]):
+        if not (isinstance(key1, int) and isinstance(key2, int)
+                or isinstance(key1, String) and isinstance(key2, String)):
+            cfg.error("cannot compare", cfg.tl_type(key1),
+                      "and", cfg.tl_type(key2))
+            return None
+    if keys and isinstance(keys[0], String):
+        return [str(key) for key in keys]
+    return keys
+
+
+class SortBuiltins:
+    """Builtins that sort and group the items of Lists and Strings.
+
+Sorting is stable. A String is treated as its character codes, like
+head does, and the result is a String again.
+"""
+
+    @function
+    @params(1)
+    def tl_sort(self, seq):
+        if not is_sequence(seq):
+            cfg.error("sort requires a List or String, not", cfg.tl_type(seq))
+            return nil
+        values = list(items(seq))
+        keys = sort_keys(values)
+        if keys is None:
+            return nil
+        order = sorted(range(len(values)), key=keys.__getitem__)
+        return same_kind(seq, [values[index] for index in order])
+
+    @function
+    @params(2)
+    def tl_sort_by(self, func, seq):
+        if not is_sequence(seq):
+            cfg.error("sort-by requires a List or String, not",
+                      cfg.tl_type(seq))
+            return nil
+        values = list(items(seq))
+        # Call the key function once per item
+        keys = sort_keys([self.call(func, [value]) for value in values])
+        if keys is None:
+            return nil
+        order = sorted(range(len(values)), key=keys.__getitem__)
+        return same_kind(seq, [values[index] for index in order])
+
+    @function
+    @params(2)
+    def tl_group_by(self, func, seq):
+        if not is_sequence(seq):
+            cfg.error("group-by requires a List or String, not",
+                      cfg.tl_type(seq))
+            return nil
+        # Map the structural key of each group's key to the key and the
+        # group's items, in order of first appearance
+        groups = {}
+        for value in items(seq):
+            key = self.call(func, [value])
+            groups.setdefault(structural_key(key), (key, []))[1].append(value)
+        return List.from_pairs((key, same_kind(seq, group))
+                               for key, group in groups.values())
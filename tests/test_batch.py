@@ -0,0 +1,85 @@
+
+"""Check that batch mode keeps each program's output to itself."""
+
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+
+INTERPRETER = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "tinylisp2.py")
+
+# Each program, with what it should write to stdout and to stderr
+PROGRAMS = [
+    ("one.tl", "(q one)\n", "one\n", ""),
+    ("two.tl", "(write (q two))\n", "two", ""),
+    ("three.tl", "(q three)\n(undefined-name)\n", "three\n()\n",
+     "Error: Symbol('undefined-name') is not defined\n"
+     "Error: [] is not a function or macro\n"),
+    ("four.tl", "(def x 4)\nx\n", "4\n", ""),
+    ]
+
+
+def write_programs(directory):
+    """Write the programs, each twice over; return their file names."""
+    filenames = []
+    for name, code, _, _ in PROGRAMS:
+        path = directory / name
+        path.write_text(code)
+        filenames.append(str(path))
+    return filenames * 2
+
+
+def expected_outputs():
+    return [(stdout, stderr) for _, _, stdout, stderr in PROGRAMS] * 2
+
+
+def run_batch(args):
+    return subprocess.run([sys.executable, INTERPRETER, *args],
+                          capture_output=True, text=True, timeout=120)
+
+
+def split_report(text, filenames):
+    """Split batch output into the text after each file's header."""
+    parts = re.split(r"==> (.*?) <==\n", text)
+    assert parts[0] == ""
+    assert parts[1::2] == filenames
+    return parts[2::2]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_output_to_stdout(tmp_path, jobs):
+    filenames = write_programs(tmp_path)
+    result = run_batch(["--batch", *filenames, "--jobs", str(jobs)])
+    assert result.returncode == 0
+    stdouts = split_report(result.stdout, filenames)
+    assert stdouts == [stdout for stdout, _ in expected_outputs()]
+    stderrs, summary = result.stderr.rsplit("Ran ", 1)
+    assert summary.startswith(f"{len(filenames)} programs")
+    error_filenames = [filename
+                       for filename, (_, stderr)
+                       in zip(filenames, expected_outputs()) if stderr]
+    assert split_report(stderrs, error_filenames) == [
+        stderr for _, stderr in expected_outputs() if stderr]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_output_to_directory(tmp_path, jobs):
+    filenames = write_programs(tmp_path)
+    output_dir = tmp_path / "results"
+    result = run_batch(["--batch", *filenames, "--jobs", str(jobs),
+                        "--output-dir", str(output_dir)])
+    assert result.returncode == 0
+    assert result.stdout == ""
+    for number, ((name, *_), (stdout, stderr)) in enumerate(
+            zip(PROGRAMS * 2, expected_outputs()), 1):
+        base = os.path.splitext(name)[0]
+        if number > len(PROGRAMS):
+            # The second run of a program gets the job number added
+            base = f"{base}-{number}"
+        assert (output_dir / (base + ".out")).read_text() == stdout
+        assert (output_dir / (base + ".err")).read_text() == stderr
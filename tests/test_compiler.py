@@ -0,0 +1,35 @@
+
+"""Check the compiled engine against the tree-walking one."""
+
+import contextlib
+import io
+import sys
+
+import run
+import tinylisp2
+
+
+DEEP_RECURSION = """
+(def count-down-slowly (lambda (n) (if n (inc (count-down-slowly (dec n))) 0)))
+(count-down-slowly 300)
+"""
+
+
+def run_code(code, engine):
+    options = tinylisp2.parse_args(["--engine", engine])
+    transcript = io.StringIO()
+    with contextlib.redirect_stdout(transcript), \
+            contextlib.redirect_stderr(transcript):
+        run.run_program(code, options=options)
+    return transcript.getvalue()
+
+
+def test_recursion_limit_is_restored():
+    limit = sys.getrecursionlimit()
+    assert run_code(DEEP_RECURSION, "compiled") == "300\n"
+    assert sys.getrecursionlimit() == limit
+
+
+def test_same_depth_as_tree_engine():
+    assert run_code(DEEP_RECURSION, "compiled") == run_code(DEEP_RECURSION,
+                                                            "tree")
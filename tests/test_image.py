@@ -0,0 +1,45 @@
+
+"""Check that an image is only reused by Programs it was built for."""
+
+import contextlib
+import io
+
+import pytest
+
+import run
+import tinylisp2
+
+
+# Without autoload, the image holds all of the library, including the
+# functions that take a callback, which only some engines make native
+CALLBACKS = """
+(same-type? map cons)
+(def depth (lambda (x) (if x (inc (maximum (map depth x))) 0)))
+(def nest (lambda (n (accum)) (if n (nest (dec n) (list accum)) accum)))
+(depth (nest 3000))
+"""
+
+
+def run_code(code, engine, image_path):
+    options = tinylisp2.parse_args(["--engine", engine, "--no-autoload",
+                                    "--image", str(image_path)])
+    transcript = io.StringIO()
+    with contextlib.redirect_stdout(transcript), \
+            contextlib.redirect_stderr(transcript):
+        run.run_program(code, options=options)
+    return transcript.getvalue()
+
+
+@pytest.mark.parametrize("first_engine", ["tree", "compiled"])
+def test_stack_engine_keeps_callbacks_in_tinylisp(tmp_path, first_engine):
+    image_path = tmp_path / "library.image"
+    run_code("", first_engine, image_path)
+    assert image_path.exists()
+    assert run_code(CALLBACKS, "stack", image_path) == "0\n3000\n"
+
+
+def test_other_engines_get_native_callbacks(tmp_path):
+    image_path = tmp_path / "library.image"
+    run_code("", "stack", image_path)
+    assert image_path.exists()
+    assert run_code("(same-type? map cons)", "tree", image_path) == "1\n"
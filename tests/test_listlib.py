@@ -0,0 +1,215 @@
+
+"""Check that the native library gives the same results as lib/core.
+
+Each case runs the same code twice, once with the native versions of
+the core library functions and once with their tinylisp definitions,
+and compares everything written to stdout and stderr.
+"""
+
+import contextlib
+import io
+
+import pytest
+
+from cfg import Symbol
+from builtin import Builtin
+import run
+import tinylisp2
+
+
+ENGINES = ("tree", "compiled", "stack")
+
+# Calls to each native function with Lists, Strings, and arguments of
+# the wrong type or number (map is a macro in the library, so with the
+# wrong number of args, the native version evaluates them first; these
+# args have no side effects)
+CASES = {
+    "length": [
+        "(length (q (1 2 3)))", "(length ())", "(length \"abc\")",
+        "(length \"\")", "(length (range 5))", "(length (q (1 2)) 10)",
+        "(length 5)", "(length (q x))", "(length (q (1 2)) \"a\")",
+        "(length)",
+        ],
+    "nth": [
+        "(nth (q (1 2 3)) 0)", "(nth (q (1 2 3)) 2)", "(nth (q (1 2 3)) 3)",
+        "(nth (q (1 2 3)) -1)", "(nth \"abc\" 1)", "(nth \"abc\" 5)",
+        "(nth (range 100) 42)", "(nth (q (1 2)) \"a\")", "(nth 5 0)",
+        "(nth (q x) 0)", "(nth (q (1 2)))",
+        ],
+    "reverse-onto": [
+        "(reverse-onto (q (1 2 3)) (q (4 5)))", "(reverse-onto () ())",
+        "(reverse-onto \"abc\" \"de\")", "(reverse-onto \"abc\" (q (1)))",
+        "(reverse-onto (q (97 98)) \"c\")", "(reverse-onto (q (-1)) \"c\")",
+        "(reverse-onto (q (1 2)) 3)", "(reverse-onto 3 (q (1 2)))",
+        "(reverse-onto (q (1)))",
+        ],
+    "reverse": [
+        "(reverse (q (1 2 3)))", "(reverse ())", "(reverse \"abc\")",
+        "(reverse \"\")", "(reverse (range 4))", "(reverse 5)",
+        "(reverse (q x))", "(reverse (q (1)) (q (2)))",
+        ],
+    "concat": [
+        "(concat (q (1 2)) (q (3 4)))", "(concat () (q (1)))",
+        "(concat \"ab\" \"cd\")", "(concat \"ab\" (q (1 2)))",
+        "(concat (q (104 105)) \"!\")", "(concat (range 3) (range 2))",
+        "(concat 1 (q (2)))", "(concat (q (1)) 2)", "(concat (q (1)))",
+        ],
+    "take": [
+        "(take 2 (q (1 2 3)))", "(take 5 (q (1 2 3)))", "(take 0 (q (1)))",
+        "(take -1 (q (1 2)))", "(take 2 \"abc\")", "(take 9 \"abc\")",
+        "(take 3 (range 0 1000))", "(take \"a\" (q (1 2)))",
+        "(take 2 5)", "(take 1 (q (1 2)) (q (0)))", "(take 1)",
+        ],
+    "drop": [
+        "(drop 2 (q (1 2 3)))", "(drop 5 (q (1 2 3)))", "(drop 0 ())",
+        "(drop -1 (q (1 2)))", "(drop 1 \"abc\")", "(drop 9 \"abc\")",
+        "(take 2 (drop 5 (range 100)))", "(drop \"a\" (q (1 2)))",
+        "(drop 2 5)", "(drop 1)",
+        ],
+    "contains?": [
+        "(contains? (q (1 2 3)) 2)", "(contains? (q (1 2 3)) 4)",
+        "(contains? () 1)", "(contains? (q ((1 2) x)) (q (1 2)))",
+        "(contains? \"abc\" 98)", "(contains? \"abc\" \"b\")",
+        "(contains? (range 10) 9)", "(contains? 5 5)", "(contains? (q (1)))",
+        ],
+    "first-index": [
+        "(first-index (q (1 2 3 2)) 2)", "(first-index (q (1 2 3)) 4)",
+        "(first-index () 1)", "(first-index \"abcb\" 98)",
+        "(first-index (q (1 2)) 2 10)", "(first-index (range 10) 7)",
+        "(first-index (q (1 2)) 2 \"a\")", "(first-index 5 5)",
+        "(first-index (q (1)))",
+        ],
+    "filter": [
+        "(filter odd? (q (1 2 3 4 5)))", "(filter odd? ())",
+        "(filter (lambda (ch) (< ch 99)) \"abcd\")",
+        "(filter odd? (range 10))", "(take 3 (filter odd? (range 0 1000)))",
+        "(filter 1 (q (1 2)))", "(filter odd? 5)",
+        "(filter odd? (q (1 2 3)) (q (0)))", "(filter odd?)",
+        ],
+    "foldl": [
+        "(foldl + (q (1 2 3)))", "(foldl + (q (1 2 3)) 10)", "(foldl + ())",
+        "(foldl + \"abc\" 0)", "(foldl (lambda (a x) (cons x a)) \"ab\" ())",
+        "(foldl + (range 101) 0)", "(foldl 1 (q (1 2)))", "(foldl + 5)",
+        "(foldl +)",
+        ],
+    "map-backwards": [
+        "(map-backwards inc (q (1 2 3)))", "(map-backwards inc ())",
+        "(map-backwards inc \"abc\")", "(map-backwards inc (range 3))",
+        "(map-backwards inc (q (1 2)) (q (0)))",
+        "(map-backwards 1 (q (1 2)))", "(map-backwards inc 5)",
+        "(map-backwards inc)",
+        ],
+    "map": [
+        "(map inc (q (1 2 3)))", "(map inc ())", "(map inc \"abc\")",
+        "(map inc (range 3))", "(take 3 (map inc (range 0 1000)))",
+        "(map 1 (q (1 2)))", "(map inc 5)", "(map inc)",
+        ],
+    "range": [
+        "(range 5)", "(range 2 6)", "(range 6 2)", "(range 0)",
+        "(range -3)", "(take 5 (range 0 1000))", "(range \"a\")",
+        "(range 1 \"a\")", "(range (q (1 2)))", "(range)", "(range 1 2 3)",
+        ],
+    "repeat": [
+        "(repeat 7 3)", "(repeat (q (1 2)) 2)", "(repeat \"a\" 2)",
+        "(repeat 7 0)", "(repeat 7 -2)", "(repeat 7 2 (q (0)))",
+        "(repeat 7 2 \"a\")", "(repeat 7 \"a\")", "(repeat 7)",
+        ],
+    "zip": [
+        "(zip (q (1 2 3)) (q (4 5 6)))", "(zip (q (1 2 3)) (q (4 5)))",
+        "(zip \"ab\" (q (1 2)))", "(zip (q (1 2)))", "(zip)",
+        "(zip (range 3) (range 10 20))", "(zip () (q (1)))",
+        "(zip (q (1 2)) 5)", "(zip 5)",
+        ],
+    "unique": [
+        "(unique (q (1 2 1 3 2)))", "(unique ())", "(unique \"abcab\")",
+        "(unique (q ((1 2) (1 2) x x \"a\" \"a\")))",
+        "(unique (repeat 4 5))", "(unique 5)", "(unique (q x))",
+        "(unique (q (1)) (q (2)))",
+        ],
+    "prime?": [
+        "(prime? 2)", "(prime? 97)", "(prime? 91)", "(prime? 1)",
+        "(prime? 0)", "(prime? -1)", "(prime? -7)", "(prime? 1000003)",
+        "(prime? \"a\")", "(prime? (q (1)))", "(prime?)",
+        ],
+    "to-base": [
+        "(to-base 2 10)", "(to-base 10 1234)", "(to-base 16 255)",
+        "(to-base 7 0)", "(to-base 7 -5)", "(to-base 1 3)", "(to-base 0 5)",
+        "(to-base -2 5)", "(to-base 1 \"a\")", "(to-base \"a\" 5)",
+        "(to-base 2 \"a\")", "(to-base 2)",
+        ],
+    "from-base": [
+        "(from-base 2 (q (1 0 1 0)))", "(from-base 10 (q (1 2 3)) 4)",
+        "(from-base 10 ())", "(from-base 10 \"12\")",
+        "(from-base 10 (range 5))", "(from-base 10 (q (1 x 2)))",
+        "(from-base \"a\" (q (1 2)))", "(from-base 10 5)",
+        "(from-base 10 (q (1)) \"a\")", "(from-base 10)",
+        ],
+    }
+
+# Global names that the tinylisp definitions use as parameter names;
+# defining them makes every call give a warning
+SHADOWED_NAMES = ("seq", "accum", "func", "item", "index", "count", "val",
+                  "num1", "num2", "seqs", "seq-front", "seq-back", "num",
+                  "base", "digits", "divisor")
+
+
+def run_code(code, engine, native):
+    """Run code; return everything it wrote to stdout and stderr."""
+    args = ["--engine", engine]
+    if not native:
+        args.append("--no-native-library")
+    options = tinylisp2.parse_args(args)
+    transcript = io.StringIO()
+    with contextlib.redirect_stdout(transcript), \
+            contextlib.redirect_stderr(transcript):
+        run.run_program(code, options=options)
+    return transcript.getvalue()
+
+
+def assert_same(code, engine):
+    native_transcript = run_code(code, engine, native=True)
+    tinylisp_transcript = run_code(code, engine, native=False)
+    assert native_transcript == tinylisp_transcript
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_natives_are_used(engine):
+    options = tinylisp2.parse_args(["--engine", engine])
+    program = run.new_program(options=options)
+    for name in CASES:
+        value = program.global_value(Symbol(name))
+        expected = program.has_native_version(name)
+        assert (type(value) is Builtin) == expected, name
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_same_results(name, engine):
+    assert_same("\n".join(CASES[name]), engine)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_same_results_with_shadowed_names(name, engine):
+    definitions = [f"(def {shadowed} 0)" for shadowed in SHADOWED_NAMES]
+    assert_same("\n".join(definitions + CASES[name]), engine)
+
+
+def test_deep_recursion_through_callbacks():
+    # The stack engine keeps the tinylisp versions of functions that
+    # take a callback, so recursion through them doesn't use Python stack
+    code = """
+(def depth (lambda (x) (if x (inc (maximum (map depth x))) 0)))
+(def nest (lambda (n (accum)) (if n (nest (dec n) (list accum)) accum)))
+(depth (nest 5000))
+(def sum-to (lambda (n) (foldl + (list n (if n (sum-to (dec n)) 0)) 0)))
+(sum-to 20000)
+"""
+    assert run_code(code, "stack", native=True) == "5000\n200010000\n"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_filter_string(engine):
+    code = "(filter (lambda (ch) (< ch 99)) \"abcd\")"
+    assert run_code(code, engine, native=True) == "\"ab\"\n"
+    assert_same(code, engine)
@@ -0,0 +1,37 @@
+
+"""Check that memoized functions behave like the functions they wrap."""
+
+import contextlib
+import io
+
+import pytest
+
+import run
+import tinylisp2
+
+
+ENGINES = ("tree", "compiled", "stack")
+
+DEEP_RECURSION = """
+(def count-down-slowly (lambda (n) (if n (inc (count-down-slowly (dec n))) 0)))
+(def count-down-memo
+  (memoize (lambda (n) (if n (inc (count-down-memo (dec n))) 0))))
+(count-down-slowly {depth})
+(count-down-memo {depth})
+"""
+
+
+def run_code(code, engine):
+    options = tinylisp2.parse_args(["--engine", engine])
+    transcript = io.StringIO()
+    with contextlib.redirect_stdout(transcript), \
+            contextlib.redirect_stderr(transcript):
+        run.run_program(code, options=options)
+    return transcript.getvalue()
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("depth", [300, 400])
+def test_same_depth_as_plain_function(engine, depth):
+    code = DEEP_RECURSION.format(depth=depth)
+    assert run_code(code, engine) == f"{depth}\n{depth}\n"
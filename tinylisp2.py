@@ -3,7 +3,10 @@
 import sys
 import argparse
 
+import cfg
 import run
+import output
+import batch
 
 
 def parse_args(args=None):
@@ -18,6 +21,76 @@ def parse_args(args=None):
     liboptions.add_argument("--builtins-only",
                             help="don't autoload library or aliases",
                             action="store_true")
+    argparser.add_argument("--no-native-library",
+                           help="use the tinylisp definitions of the core "
+                                "list functions instead of native ones",
+                           action="store_true")
+    argparser.add_argument("--no-autoload",
+                           help="load the whole library at startup instead "
+                                "of each module when its names are first "
+                                "used",
+                           action="store_true")
+    argparser.add_argument("--no-module-cache",
+                           help="don't cache parsed modules in "
+                                "__tlcache__ directories",
+                           action="store_true")
+    argparser.add_argument("--image",
+                           help="start from a saved image of the "
+                                "interpreter with its library loaded, "
+                                "creating or updating it as needed",
+                           metavar="FILE")
+    argparser.add_argument("--engine",
+                           help="evaluation engine to use (default: tree); "
+                                "only the compiled engine uses slot-array "
+                                "call frames and caches global lookups",
+                           choices=run.engines,
+                           default="tree")
+    argparser.add_argument("--max-stack",
+                           help="maximum depth of the evaluation stack "
+                                "for the stack engine",
+                           type=int)
+    argparser.add_argument("--output-buffer",
+                           help="size in characters of the buffer that "
+                                "output is collected in (default: "
+                                f"{output.DEFAULT_BUFFER_SIZE})",
+                           type=int,
+                           default=output.DEFAULT_BUFFER_SIZE,
+                           metavar="SIZE")
+    argparser.add_argument("--flush",
+                           help="when to write out buffered output: at the "
+                                "end of every line, only when the buffer "
+                                "is full, or by line only on a terminal "
+                                "(default: auto)",
+                           choices=output.FLUSH_POLICIES,
+                           default="auto")
+    argparser.add_argument("--stats",
+                           help="print performance counters when done",
+                           action="store_true")
+    argparser.add_argument("--batch",
+                           help="run each of these files as a separate "
+                                "program, in parallel",
+                           nargs="+",
+                           metavar="FILE")
+    argparser.add_argument("--manifest",
+                           help="run each file listed in this file (one "
+                                "per line, or - for stdin) as a separate "
+                                "program, in parallel",
+                           metavar="FILE")
+    argparser.add_argument("--jobs",
+                           help="number of programs to run at once in "
+                                "batch mode (default: number of CPUs)",
+                           type=int,
+                           metavar="N")
+    argparser.add_argument("--timeout",
+                           help="in batch mode, stop any program that "
+                                "runs longer than this",
+                           type=float,
+                           metavar="SECONDS")
+    argparser.add_argument("--output-dir",
+                           help="in batch mode, write each program's "
+                                "output and errors to NAME.out and "
+                                "NAME.err in this directory",
+                           metavar="DIR")
     argparser.add_argument("filename",
                            help="code file to execute",
                            nargs="?")
@@ -35,15 +108,27 @@ def parse_args(args=None):
 
 if __name__ == "__main__":
     options = parse_args()
-    if options.filename:
+    output.stdout.configure(options.output_buffer, options.flush)
+    if options.batch or options.manifest:
+        # Run many programs from one warm interpreter
+        filenames = list(options.batch or [])
+        if options.manifest:
+            try:
+                filenames += batch.read_manifest(options.manifest)
+            except OSError:
+                cfg.error("could not read", options.manifest)
+                sys.exit(1)
+        sys.exit(batch.run_batch(filenames, options))
+    elif options.filename:
         # User specified a filename--run it
-        run.run_file(options.filename, options=options)
+        if not run.run_file(options.filename, options=options):
+            sys.exit(1)
     elif sys.stdin.isatty():
         # No filename specified, and the input is coming from a terminal;
         # run in REPL mode
         run.repl(options=options)
     else:
         # No filename specified, but input is piped in from a file or
-        # another process, so treat that as a program and run it
-        code = sys.stdin.read()
-        run.run_program(code, options=options)
+        # another process, so treat that as a program and run it as
+        # it comes in
+        run.run_program(sys.stdin, options=options)
@@ -0,0 +1,320 @@
+
+import operator
+from array import array
+from itertools import repeat
+from math import prod
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from cfg import nil
+import cfg
+from datatypes import List, String, IntVector
+from builtin import function, params
+
+
+# Built-in functions for integer vectors
+# Key = implementation name; value = tinylisp name
+
+builtins = {
+    "tl_to_vector": "to-vector",
+    "tl_from_vector": "from-vector",
+    "tl_vector_range": "vector-range",
+    "tl_vector_length": "vector-length",
+    "tl_vector_get": "vector-get",
+    "tl_vector_slice": "vector-slice",
+    "tl_vector_add": "vector+",
+    "tl_vector_sub": "vector-",
+    "tl_vector_mul": "vector*",
+    "tl_vector_div": "vector/",
+    "tl_vector_mod": "vector-mod",
+    "tl_vector_less": "vector<",
+    "tl_vector_equal": "vector=",
+    "tl_vector_sum": "vector-sum",
+    "tl_vector_product": "vector-product",
+    }
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+# Item-by-item kernels
+# Each takes two operands, either of which may be a plain int, and
+# returns an array of 64-bit integers. They raise OverflowError if a
+# result doesn't fit in 64 bits.
+
+def elementwise(op, a, b):
+    """Apply a binary integer operation item by item."""
+    if numpy is not None and op in numpy_kernels and fits(a) and fits(b):
+        result = numpy_kernels[op](as_numpy(a), as_numpy(b))
+        if result is not None:
+            return array("q", result.astype(numpy.int64).tobytes())
+    # Either NumPy isn't available or the result might not fit in
+    # 64 bits: compute exactly with Python ints, which overflows
+    # loudly when the results are stored
+    if isinstance(a, int):
+        return array("q", map(op, repeat(a), b))
+    elif isinstance(b, int):
+        return array("q", map(op, a, repeat(b)))
+    else:
+        return array("q", map(op, a, b))
+
+
+def fits(operand):
+    """Is the operand an array or an int that fits in 64 bits?"""
+    return not isinstance(operand, int) or INT64_MIN <= operand <= INT64_MAX
+
+
+def as_numpy(operand):
+    if isinstance(operand, array):
+        return numpy.frombuffer(operand, dtype=numpy.int64)
+    else:
+        return operand
+
+
+def magnitude(operand):
+    """Largest absolute value in an operand, as a Python int."""
+    if isinstance(operand, int):
+        return abs(operand)
+    elif len(operand) == 0:
+        return 0
+    else:
+        return max(int(operand.max()), -int(operand.min()))
+
+
+# The NumPy kernels work with wrapping int64 arithmetic, so each one
+# checks that no result can have wrapped around; if it can't rule that
+# out cheaply, it returns None to fall back to the exact computation
+
+def numpy_add(a, b):
+    if magnitude(a) + magnitude(b) <= INT64_MAX:
+        return numpy.add(a, b)
+
+
+def numpy_sub(a, b):
+    if magnitude(a) + magnitude(b) <= INT64_MAX:
+        return numpy.subtract(a, b)
+
+
+def numpy_mul(a, b):
+    if magnitude(a) * magnitude(b) <= INT64_MAX:
+        return numpy.multiply(a, b)
+
+
+def numpy_floordiv(a, b):
+    # Only INT64_MIN // -1 can overflow
+    if magnitude(a) <= INT64_MAX:
+        return numpy.floor_divide(a, b)
+
+
+def numpy_mod(a, b):
+    return numpy.remainder(a, b)
+
+
+def numpy_lt(a, b):
+    return numpy.less(a, b)
+
+
+def numpy_eq(a, b):
+    return numpy.equal(a, b)
+
+
+numpy_kernels = {
+    operator.add: numpy_add,
+    operator.sub: numpy_sub,
+    operator.mul: numpy_mul,
+    operator.floordiv: numpy_floordiv,
+    operator.mod: numpy_mod,
+    operator.lt: numpy_lt,
+    operator.eq: numpy_eq,
+    }
+
+
+class VectorBuiltins:
+    """Builtins that create and operate on integer vectors."""
+
+    def vector_operands(self, verb, arg1, arg2):
+        """Check the operands of an item-by-item operation.
+
+At least one must be a vector and the other must be a vector of the
+same length or an integer. Return the operands as arrays or ints, or
+None (after giving an error message) if they are not valid.
+"""
+        if isinstance(arg1, IntVector) and isinstance(arg2, IntVector):
+            if len(arg1) != len(arg2):
+                cfg.error("cannot", verb, "vectors of lengths", len(arg1),
+                          "and", len(arg2))
+                return None
+            return arg1.items, arg2.items
+        elif isinstance(arg1, IntVector) and isinstance(arg2, int):
+            return arg1.items, arg2
+        elif isinstance(arg1, int) and isinstance(arg2, IntVector):
+            return arg1, arg2.items
+        else:
+            cfg.error("cannot", verb, cfg.tl_type(arg1), "and",
+                      cfg.tl_type(arg2), "item by item")
+            return None
+
+    def vector_elementwise(self, op, verb, arg1, arg2):
+        operands = self.vector_operands(verb, arg1, arg2)
+        if operands is None:
+            return nil
+        a, b = operands
+        if op in (operator.floordiv, operator.mod):
+            if isinstance(b, int):
+                zero_divisor = (b == 0)
+            else:
+                zero_divisor = (0 in b)
+            if zero_divisor:
+                cfg.error("division by zero" if op is operator.floordiv
+                          else "mod by zero")
+                return nil
+        try:
+            return IntVector(elementwise(op, a, b))
+        except OverflowError:
+            cfg.error("result of vector operation doesn't fit in 64 bits")
+            return nil
+
+    @function
+    @params(1)
+    def tl_to_vector(self, seq):
+        if isinstance(seq, IntVector):
+            return seq
+        elif isinstance(seq, String):
+            # A string becomes a vector of its character codes
+            return IntVector(map(ord, str(seq)))
+        elif isinstance(seq, List):
+            try:
+                return IntVector(seq)
+            except TypeError:
+                for item in seq:
+                    if not isinstance(item, int):
+                        break
+                cfg.error("cannot put", cfg.tl_type(item), "in a vector")
+                return nil
+            except OverflowError:
+                cfg.error("vector items must fit in 64 bits")
+                return nil
+        else:
+            cfg.error("cannot convert", cfg.tl_type(seq), "to vector")
+            return nil
+
+    @function
+    @params(1)
+    def tl_from_vector(self, vec):
+        if isinstance(vec, IntVector):
+            return List.from_iterable(vec.items.tolist())
+        else:
+            cfg.error("from-vector requires Vector, not", cfg.tl_type(vec))
+            return nil
+
+    @function
+    @params(1, 2)
+    def tl_vector_range(self, num1, num2=None):
+        if num2 is None:
+            # One argument: count up from 0 to num1 - 1, like range
+            num1, num2 = 0, num1
+        if isinstance(num1, int) and isinstance(num2, int):
+            try:
+                return IntVector(range(num1, num2))
+            except OverflowError:
+                cfg.error("vector items must fit in 64 bits")
+                return nil
+        else:
+            cfg.error("vector-range requires Integers, not",
+                      cfg.tl_type(num1), "and", cfg.tl_type(num2))
+            return nil
+
+    @function
+    @params(1)
+    def tl_vector_length(self, vec):
+        if isinstance(vec, IntVector):
+            return len(vec)
+        else:
+            cfg.error("cannot get vector length of", cfg.tl_type(vec))
+            return nil
+
+    @function
+    @params(2)
+    def tl_vector_get(self, vec, index):
+        if isinstance(vec, IntVector) and isinstance(index, int):
+            if 0 <= index < len(vec):
+                return vec.items[index]
+            else:
+                # Out of range, like nth
+                return nil
+        else:
+            cfg.error("vector-get requires Vector and Integer, not",
+                      cfg.tl_type(vec), "and", cfg.tl_type(index))
+            return nil
+
+    @function
+    @params(2, 3)
+    def tl_vector_slice(self, vec, start, end=None):
+        if (isinstance(vec, IntVector) and isinstance(start, int)
+                and isinstance(end, (int, type(None)))):
+            # Slicing follows Python's rules, so negative indices count
+            # from the end
+            return IntVector(vec.items[start:end])
+        else:
+            cfg.error("vector-slice requires Vector and Integers")
+            return nil
+
+    @function
+    @params(2)
+    def tl_vector_add(self, arg1, arg2):
+        return self.vector_elementwise(operator.add, "add", arg1, arg2)
+
+    @function
+    @params(2)
+    def tl_vector_sub(self, arg1, arg2):
+        return self.vector_elementwise(operator.sub, "subtract", arg1, arg2)
+
+    @function
+    @params(2)
+    def tl_vector_mul(self, arg1, arg2):
+        return self.vector_elementwise(operator.mul, "multiply", arg1, arg2)
+
+    @function
+    @params(2)
+    def tl_vector_div(self, arg1, arg2):
+        return self.vector_elementwise(operator.floordiv, "divide",
+                                       arg1, arg2)
+
+    @function
+    @params(2)
+    def tl_vector_mod(self, arg1, arg2):
+        return self.vector_elementwise(operator.mod, "mod", arg1, arg2)
+
+    @function
+    @params(2)
+    def tl_vector_less(self, arg1, arg2):
+        # The result is a mask of 1s and 0s
+        return self.vector_elementwise(operator.lt, "compare", arg1, arg2)
+
+    @function
+    @params(2)
+    def tl_vector_equal(self, arg1, arg2):
+        # The result is a mask of 1s and 0s
+        return self.vector_elementwise(operator.eq, "compare", arg1, arg2)
+
+    @function
+    @params(1)
+    def tl_vector_sum(self, vec):
+        if isinstance(vec, IntVector):
+            # Python's sum is exact, so this can't overflow
+            return sum(vec.items)
+        else:
+            cfg.error("cannot sum", cfg.tl_type(vec))
+            return nil
+
+    @function
+    @params(1)
+    def tl_vector_product(self, vec):
+        if isinstance(vec, IntVector):
+            return prod(vec.items)
+        else:
+            cfg.error("cannot take product of", cfg.tl_type(vec))
+            return nil